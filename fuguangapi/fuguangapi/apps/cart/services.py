@@ -0,0 +1,107 @@
+"""
+购物车服务
+购物车保存在redis的hash中，key为 cart_<用户ID>，field为课程ID，value为勾选状态[1为勾选，0为不勾选]。
+需要先读后写的操作使用lua脚本在redis服务端执行，每个请求只与redis往返一次，并且读写之间不会被其他请求插入。
+"""
+from django_redis import get_redis_connection
+
+# 课程不在购物车中才添加，返回[是否添加成功, 购物车商品总数]
+ADD_CART_SCRIPT = """
+local added = redis.call("hsetnx", KEYS[1], ARGV[1], ARGV[2])
+return {added, redis.call("hlen", KEYS[1])}
+"""
+
+# 课程在购物车中才修改勾选状态，避免把已经删除的课程重新写回购物车
+SET_SELECTED_SCRIPT = """
+if redis.call("hexists", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call("hset", KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+# 修改购物车中所有课程的勾选状态，返回购物车商品总数
+SELECT_ALL_SCRIPT = """
+local course_id_list = redis.call("hkeys", KEYS[1])
+for i = 1, #course_id_list do
+    redis.call("hset", KEYS[1], course_id_list[i], ARGV[1])
+end
+return #course_id_list
+"""
+
+# 把购物车中的课程拆分为勾选与不勾选两个列表，只把课程ID返回客户端
+SPLIT_SELECTED_SCRIPT = """
+local cart = redis.call("hgetall", KEYS[1])
+local selected, unselected = {}, {}
+for i = 1, #cart, 2 do
+    if cart[i + 1] == "1" then
+        selected[#selected + 1] = cart[i]
+    else
+        unselected[#unselected + 1] = cart[i]
+    end
+end
+return {selected, unselected}
+"""
+
+# 每个进程只注册一次lua脚本
+_cart_scripts = {}
+
+
+def get_cart_script(name, script):
+    """获取注册以后的lua脚本"""
+    if name not in _cart_scripts:
+        redis = get_redis_connection("cart")
+        _cart_scripts[name] = redis.register_script(script)
+    return _cart_scripts[name]
+
+
+def get_cart_key(user_id):
+    """用户购物车在redis中的key"""
+    return f"cart_{user_id}"
+
+
+def add_cart_course(user_id, course_id, selected=1):
+    """
+    添加课程到购物车
+    :return: (是否添加成功[课程已经在购物车中则为False], 购物车商品总数)
+    """
+    script = get_cart_script("add", ADD_CART_SCRIPT)
+    added, cart_total = script(keys=[get_cart_key(user_id)], args=[course_id, int(selected)])
+    return bool(added), cart_total
+
+
+def set_cart_selected(user_id, course_id, selected):
+    """修改购物车中课程的勾选状态，课程不在购物车中时返回False"""
+    script = get_cart_script("set_selected", SET_SELECTED_SCRIPT)
+    return bool(script(keys=[get_cart_key(user_id)], args=[course_id, int(bool(selected))]))
+
+
+def set_cart_all_selected(user_id, selected):
+    """全选/全不选，返回购物车商品总数[0表示购物车为空]"""
+    script = get_cart_script("select_all", SELECT_ALL_SCRIPT)
+    return script(keys=[get_cart_key(user_id)], args=[int(bool(selected))])
+
+
+def split_cart_courses(user_id):
+    """
+    把购物车中的课程拆分为勾选与不勾选两部分
+    :return: (勾选的课程ID列表, 不勾选的课程ID列表)
+    """
+    script = get_cart_script("split", SPLIT_SELECTED_SCRIPT)
+    selected, unselected = script(keys=[get_cart_key(user_id)])
+    return [int(course_id) for course_id in selected], [int(course_id) for course_id in unselected]
+
+
+def delete_cart_courses(user_id, course_id_list):
+    """从购物车中删除课程[单条命令即可完成，不需要lua脚本]"""
+    if not course_id_list:
+        return 0
+    redis = get_redis_connection("cart")
+    return redis.hdel(get_cart_key(user_id), *course_id_list)
+
+
+def get_cart_dict(user_id):
+    """获取购物车中所有课程的勾选状态，{课程ID: 是否勾选}"""
+    redis = get_redis_connection("cart")
+    cart_hash = redis.hgetall(get_cart_key(user_id))
+    return {int(course_id.decode()): selected == b'1' for course_id, selected in cart_hash.items()}
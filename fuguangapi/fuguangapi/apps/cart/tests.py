@@ -1 +1,88 @@
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+from courses.models import Course
+from users.models import UserCourse
+from .services import add_cart_course, set_cart_selected, set_cart_all_selected, split_cart_courses, get_cart_key
+
+CART_URL = "/cart/"
+
+
+class CartServiceTestCase(TestCase):
+    """购物车lua脚本的测试集"""
+
+    def setUp(self):
+        get_redis_connection("cart").flushall()
+
+    def test_add_cart_course(self):
+        """测试重复添加课程不会覆盖勾选状态，并返回购物车商品总数"""
+        self.assertEqual((True, 1), add_cart_course(1, 10))
+        self.assertEqual((True, 2), add_cart_course(1, 11, selected=0))
+        set_cart_selected(1, 10, 0)
+        self.assertEqual((False, 2), add_cart_course(1, 10))
+        self.assertEqual(b"0", get_redis_connection("cart").hget(get_cart_key(1), 10))
+
+    def test_set_selected(self):
+        """测试只修改购物车中已有课程的勾选状态"""
+        add_cart_course(1, 10)
+        self.assertTrue(set_cart_selected(1, 10, False))
+        self.assertFalse(set_cart_selected(1, 11, True))
+        self.assertEqual(([], [10]), split_cart_courses(1))
+
+    def test_select_all(self):
+        """测试全选/全不选，以及拆分勾选与不勾选的课程"""
+        self.assertEqual(0, set_cart_all_selected(1, True))
+        for course_id in (10, 11, 12):
+            add_cart_course(1, course_id, selected=0)
+        self.assertEqual(3, set_cart_all_selected(1, True))
+        set_cart_selected(1, 11, False)
+        selected_list, unselected_list = split_cart_courses(1)
+        self.assertEqual([10, 12], sorted(selected_list))
+        self.assertEqual([11], unselected_list)
+
+
+class CartAPITestCase(TestCase):
+    """购物车接口的测试集"""
+
+    def setUp(self):
+        get_redis_connection("cart").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.course = Course.objects.create(name="python入门", price=100, course_cover="course/python.png")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_add_cart(self):
+        """测试添加购物车只查询一次数据库"""
+        with self.assertNumQueries(1):
+            response = self.client.post(CART_URL, {"course_id": self.course.id}, format="json")
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(1, response.data["cart_total"])
+
+        response = self.client.post(CART_URL, {"course_id": self.course.id}, format="json")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.data["cart_total"])
+
+    def test_add_cart_invalid(self):
+        """测试添加不存在或者已经购买的课程"""
+        response = self.client.post(CART_URL, {"course_id": self.course.id + 1}, format="json")
+        self.assertEqual("课程不存在", response.data["errmsg"])
+        UserCourse.objects.create(user=self.user, course=self.course)
+        response = self.client.post(CART_URL, {"course_id": self.course.id}, format="json")
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(get_redis_connection("cart").exists(get_cart_key(self.user.id)))
+
+    def test_select_and_delete(self):
+        """测试勾选、全选以后获取勾选列表，删除课程以后购物车为空"""
+        self.assertEqual(204, self.client.put(CART_URL, {"selected": True}, format="json").status_code)
+        self.client.post(CART_URL, {"course_id": self.course.id}, format="json")
+        self.client.patch(CART_URL, {"course_id": self.course.id, "selected": False}, format="json")
+        self.assertEqual([], self.client.get(f"{CART_URL}select/").data["cart"])
+
+        self.client.put(CART_URL, {"selected": True}, format="json")
+        response = self.client.get(f"{CART_URL}select/")
+        self.assertEqual([self.course.id], [item["id"] for item in response.data["cart"]])
+
+        self.client.delete(f"{CART_URL}?course_id={self.course.id}")
+        self.assertEqual(204, self.client.get(CART_URL).status_code)
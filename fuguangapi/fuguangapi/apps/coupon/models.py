@@ -1,5 +1,6 @@
 from courses.models import CourseDirection, CourseCategory, Course
 from fuguangapi.utils.models import BaseModel, models
+from fuguangapi.utils.pricing import get_pricing_rule, validate_pricing_rule
 from orders.models import Order
 from users.models import User
 
@@ -29,7 +30,7 @@ class Coupon(BaseModel):
     get_type = models.SmallIntegerField(choices=get_choices, default=0, verbose_name="领取方式")
     condition = models.IntegerField(blank=True, default=0, verbose_name="满足使用优惠券的价格条件")
     per_limit = models.SmallIntegerField(default=1, verbose_name="每人限制领取数量")
-    sale = models.TextField(verbose_name="优惠公式", help_text="""
+    sale = models.TextField(verbose_name="优惠公式", validators=[validate_pricing_rule], help_text="""
             *号开头表示折扣价，例如*0.82表示八二折；<br>
             -号开头表示减免价,例如-10表示在总价基础上减免10元<br>   
             """)
@@ -39,6 +40,11 @@ class Coupon(BaseModel):
         verbose_name = "优惠券"
         verbose_name_plural = verbose_name
 
+    @property
+    def rule(self):
+        """编译以后的优惠公式"""
+        return get_pricing_rule("coupon", self.pk, self.sale)
+
 
 class CouponDirection(models.Model):
     """课程方向优惠券"""
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Activity, Discount, DiscountType, CourseActivityPrice
+from .models import Activity, Discount, DiscountType, CourseActivityPrice, CoursePriceSnapshot
 from .models import CourseDirection, CourseCategory, Course, Teacher, CourseChapter, CourseLesson
 
 
@@ -150,3 +150,14 @@ class CourseActivityPriceModelAdmin(admin.ModelAdmin):
 
 
 admin.site.register(CourseActivityPrice, CourseActivityPriceModelAdmin)
+
+
+class CoursePriceSnapshotModelAdmin(admin.ModelAdmin):
+    """
+    课程价格快照的模型管理器
+    """
+    list_display = ["id", "course", "real_price", "discount_price", "discount_type", "expire_time", "updated_time"]
+    readonly_fields = ["course", "real_price", "discount_price", "discount_type", "expire_time", "updated_time"]
+
+
+admin.site.register(CoursePriceSnapshot, CoursePriceSnapshotModelAdmin)
@@ -6,3 +6,7 @@ class CoursesConfig(AppConfig):
     name = 'courses'
     verbose_name = '课程管理'
     verbose_name_plural = verbose_name
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone as datetime
+
+from courses.models import Course, CourseActivityPrice
+from orders.models import Order
+from users.models import UserCourse, StudyProgress, Credit
+
+
+def get_hot_queries():
+    """
+    热点查询与期望使用的索引
+    :return: 列表 [(说明, 查询集, 索引名称或者索引名称元组[使用其中任意一个即可])]
+    """
+    now_time = datetime.now()
+    return [
+        # sqlite把唯一约束写在建表语句中，索引名称由数据库自动生成
+        ("根据订单号查询订单", Order.objects.filter(order_number="0"),
+         ("fg_order_number_uniq", "sqlite_autoindex_fg_order_")),
+        ("用户的订单列表", Order.objects.filter(
+            user_id=1, is_show=True, is_delete=False, order_status=0).order_by("-id"), "fg_order_user_status_idx"),
+        ("判断用户是否购买了课程", UserCourse.objects.filter(user_id=1, course_id=1),
+         ("fg_user_course_uniq", "sqlite_autoindex_fg_user_course_")),
+        ("用户的课时学习进度", StudyProgress.objects.filter(user_id=1, lesson_id=1), "fg_study_progress_idx"),
+        ("用户的积分流水", Credit.objects.filter(user_id=1, id__gt=0).order_by("-id"), "fg_credit_user_idx"),
+        ("课程当前参与的活动", CourseActivityPrice.objects.filter(
+            course_id__in=[1, 2], activity__end_time__gt=now_time, activity__start_time__lt=now_time,
+        ).order_by("-id"), "fg_course_activity_idx"),
+        ("分类的课程列表", Course.objects.filter(is_show=True, is_delete=False, category_id=1).annotate(
+            real_price=Coalesce(F("price_snapshot__real_price"), F("price"))).order_by("-orders", "-id"),
+         "fg_course_category_idx"),
+    ]
+
+
+class Command(BaseCommand):
+    help = "使用EXPLAIN检查热点查询是否使用了对应的索引[数据量太少时，数据库可能会选择全表扫描，请在生产数据上执行]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plan', action='store_true', default=False,
+                            dest='verbose_plan', help='输出完整的执行计划')
+
+    def handle(self, *args, **options):
+        failures = []
+        for title, queryset, index_names in get_hot_queries():
+            if isinstance(index_names, str):
+                index_names = (index_names,)
+            plan = queryset.explain()
+            if any(index_name in plan for index_name in index_names):
+                self.stdout.write(f"[OK] {title}: {index_names[0]}")
+            else:
+                failures.append(title)
+                self.stdout.write(f"[FAIL] {title}: 没有使用索引 {index_names[0]}")
+            if options['verbose_plan']:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"{len(failures)}个热点查询没有使用索引：{'、'.join(failures)}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import Course
+from courses.services import refresh_course_price_snapshot
+
+
+class Command(BaseCommand):
+    help = "重新计算所有课程的价格快照"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=500,
+                            dest='size', help='每批处理的课程数量')
+
+    def handle(self, *args, **options):
+        """分批重新计算课程的价格快照"""
+        size = options['size']
+        last_id = 0
+        total = 0
+        while True:
+            course_id_list = list(Course.objects.filter(pk__gt=last_id).order_by("id").values_list(
+                "id", flat=True)[:size])
+            if not course_id_list:
+                break
+            total += refresh_course_price_snapshot(course_id_list)
+            last_id = course_id_list[-1]
+
+        self.stdout.write(f"课程价格快照更新完成！数量:{total}")
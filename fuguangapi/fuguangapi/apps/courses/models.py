@@ -6,6 +6,7 @@ from django.utils.safestring import mark_safe
 from stdimage import StdImageField
 
 from fuguangapi.utils.models import BaseModel, models
+from fuguangapi.utils.pricing import get_pricing_rule, validate_pricing_rule
 
 
 class CourseDirection(BaseModel):
@@ -84,7 +85,7 @@ class Course(BaseModel):
     direction = models.ForeignKey('CourseDirection', on_delete=models.DO_NOTHING, related_name='course_list',
                                   null=True, blank=True, db_constraint=False, verbose_name='学习方向')
     category = models.ForeignKey('CourseCategory', on_delete=models.DO_NOTHING, related_name='course_list',
-                                 null=True, blank=True, db_constraint=False, verbose_name='课程分类')
+                                 null=True, blank=True, db_constraint=False, db_index=False, verbose_name='课程分类')
     teacher = models.ForeignKey('Teacher', related_name="course_list", null=True, blank=True,
                                 on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='授课老师')
 
@@ -92,6 +93,12 @@ class Course(BaseModel):
         db_table = 'fg_course_info'
         verbose_name = '课程信息'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 课程列表，全部课程和按课程分类过滤，按显示顺序和id倒序
+            models.Index(fields=["is_show", "is_delete", "-orders", "-id"], name="fg_course_list_idx"),
+            models.Index(fields=["category", "is_show", "is_delete", "-orders", "-id"],
+                         name="fg_course_category_idx"),
+        ]
 
     def course_cover_small(self):
         if self.course_cover:
@@ -123,6 +130,10 @@ class Course(BaseModel):
     @property
     def discount(self):
         # 通过计算获取当前课程的折扣优惠相关的信息
+        # 列表页通过 courses.services.prefetch_course_discount 批量计算好的结果，直接返回
+        if hasattr(self, "_discount_cache"):
+            return self._discount_cache
+
         now_time = datetime.now()
 
         # 获取当前课程参与的最新活动记录
@@ -130,6 +141,15 @@ class Course(BaseModel):
             activity__end_time__gt=now_time,
             activity__start_time__lt=now_time).order_by('-id').first()
 
+        return self.get_discount_data(last_activity_log, now_time)
+
+    def get_discount_data(self, last_activity_log, now_time):
+        """
+        根据课程参与的活动记录，计算课程的优惠信息
+        :param last_activity_log: 课程当前参与的最新活动记录[CourseActivityPrice]，没有则为None
+        :param now_time: 计算时的当前时间
+        :return: 优惠信息字典，包含type、price、expire
+        """
         type_text = ""  # 优惠类型的默认值
         price = -1  # 优惠价格
         expire = 0  # 优惠剩余时间
@@ -141,19 +161,9 @@ class Course(BaseModel):
             expire = last_activity_log.activity.end_time.timestamp() - now_time.timestamp()
 
             # 判断课程价格是否满足优惠条件
-            course_price = float(self.price)  # 课程原价
-            condition_price = float(last_activity_log.discount.condition)  # 优惠条件价格
-            if course_price >= condition_price:
-                # 如果课程价格满足优惠条件，则计算优惠价格
-                sale = last_activity_log.discount.sale  # 计算公式 *0.8，-200
-                if sale[0] == '0':
-                    price = 0
-                elif sale[0] == '*':
-                    price = course_price * float(sale[1:])
-                elif sale[0] == '-':
-                    price = course_price - float(sale[1:])
-
-                price = float(f'{price:.2f}')
+            if self.price >= last_activity_log.discount.condition:
+                # 如果课程价格满足优惠条件，则根据编译好的优惠公式计算优惠价格
+                price = float(last_activity_log.discount.rule(self.price))
 
         data = {}
         if type_text:
@@ -338,7 +348,7 @@ class Discount(BaseModel):
                                       db_constraint=False, verbose_name='优惠类型')
     condition = models.IntegerField(verbose_name='优惠条件', default=0,
                                     blank=True, help_text='设置享受优惠的价格条件，不填或0为没有优惠')
-    sale = models.TextField(verbose_name="优惠计算公式", help_text="""
+    sale = models.TextField(verbose_name="优惠计算公式", validators=[validate_pricing_rule], help_text="""
     0表示免费；<br>
     *号开头表示折扣价，例如填写*0.82,则表示八二折；<br>
     -号开头表示减免价, 例如填写-100,则表示减免100；<br>
@@ -352,6 +362,11 @@ class Discount(BaseModel):
     def __str__(self):
         return f'价格优惠:{self.discount_type.name}, 优惠条件:{self.condition}, 优惠公式: {self.sale}'
 
+    @property
+    def rule(self):
+        """编译以后的优惠公式"""
+        return get_pricing_rule("discount", self.pk, self.sale)
+
 
 class CourseActivityPrice(BaseModel):
     """
@@ -360,7 +375,7 @@ class CourseActivityPrice(BaseModel):
     activity = models.ForeignKey('Activity', on_delete=models.CASCADE, related_name='price_list',
                                  db_constraint=False, verbose_name='活动')
     course = models.ForeignKey('Course', on_delete=models.CASCADE, related_name='price_list',
-                               db_constraint=False, verbose_name='课程')
+                               db_constraint=False, db_index=False, verbose_name='课程')
     discount = models.ForeignKey('Discount', on_delete=models.CASCADE, related_name='price_list',
                                  db_constraint=False, verbose_name='优惠')
 
@@ -368,6 +383,34 @@ class CourseActivityPrice(BaseModel):
         db_table = 'fg_course_activity_price'
         verbose_name = '课程参与活动的价格表'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 查询课程当前参与的活动
+            models.Index(fields=["course", "activity"], name="fg_course_activity_idx"),
+        ]
 
     def __str__(self):
         return f"活动:{self.activity.name}-课程:{self.course.name}-优惠公式:{self.discount.sale}"
+
+
+class CoursePriceSnapshot(models.Model):
+    """
+    课程当前价格快照
+    在活动开始/结束、活动价格或优惠公式发生变化时重新计算，列表页可以直接根据当前价格排序、过滤
+    """
+    course = models.OneToOneField('Course', on_delete=models.CASCADE, related_name='price_snapshot',
+                                  db_constraint=False, verbose_name='课程')
+    real_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True,
+                                     verbose_name='当前价格')
+    discount_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                         verbose_name='活动价格')
+    discount_type = models.CharField(max_length=255, default='', blank=True, verbose_name='优惠类型')
+    expire_time = models.DateTimeField(null=True, blank=True, verbose_name='优惠结束时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'fg_course_price_snapshot'
+        verbose_name = '课程价格快照'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"课程:{self.course_id}-当前价格:{self.real_price}"
@@ -1,4 +1,6 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination
+
+from fuguangapi.utils.paginations import PageNumberPagination
 
 
 class CourseListPageNumberPagination(PageNumberPagination):
@@ -7,3 +9,12 @@ class CourseListPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'size'
     page_query_param = 'page'
     max_page_size = 20
+    keyset_ordering = ('-orders', '-id')
+
+
+class CourseLessonCursorPagination(CursorPagination):
+    """章节课时列表分页器"""
+    page_size = 20
+    page_size_query_param = 'size'
+    max_page_size = 100
+    ordering = ('orders', 'id')
@@ -1,9 +1,11 @@
 from django.conf import settings
+from django.db import models
 from drf_haystack.serializers import HaystackSerializer
 from rest_framework import serializers
 
 from .models import CourseDirection, CourseCategory, Course, Teacher, CourseChapter, CourseLesson
 from .search_indexes import CourseIndex
+from .services import prefetch_course_discount
 
 
 class CourseDirectionSerializer(serializers.ModelSerializer):
@@ -22,11 +24,20 @@ class CourseCategorySerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
 
 
+class CourseListSerializer(serializers.ListSerializer):
+    """课程列表序列化器，序列化之前批量计算所有课程的优惠信息，避免每个课程单独查询"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        return super().to_representation(prefetch_course_discount(iterable))
+
+
 class CourseModelSerializer(serializers.ModelSerializer):
     """课程信息序列化器"""
 
     class Meta:
         model = Course
+        list_serializer_class = CourseListSerializer
         fields = ('id', 'name', "course_cover", "level", "get_level_display",
                   "students", "status", "get_status_display",
                   "lessons", "pub_lessons", "price", "discount")
@@ -72,18 +83,48 @@ class CourseChapterModelSerializer(serializers.ModelSerializer):
         fields = ["id", "orders", "name", "summary", "lesson_list"]
 
 
+class CourseChapterOutlineModelSerializer(serializers.ModelSerializer):
+    """课程章节大纲序列化器，只返回章节的课时数量，不返回课时列表"""
+
+    lesson_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CourseChapter
+        fields = ["id", "orders", "name", "summary", "lesson_count"]
+
+
 class CourseRetrieveModelSerializer(serializers.ModelSerializer):
-    """课程详情序列化器"""
+    """
+    课程详情序列化器
+    课程详情会被缓存，所以不包含随时间变化的优惠信息，优惠信息在视图中实时计算
+    """
     direction_name = serializers.CharField(source='direction.name')
     category_name = serializers.CharField(source='category.name')
     # 讲师信息
     teacher = CourseTeacherModelSerializer()
     # 章节列表
     chapter_list = CourseChapterModelSerializer(many=True)
+    can_free_study = serializers.SerializerMethodField()
 
     class Meta:
         model = Course
-        fields = ["name", "course_cover", "course_video", "level", "get_level_display",
-                  "description", "pub_date", "status", "get_status_display", "students", "discount",
+        fields = ["id", "name", "course_cover", "course_video", "level", "get_level_display",
+                  "description", "pub_date", "status", "get_status_display", "students",
                   "credit", "lessons", "pub_lessons", "price", "direction", "direction_name", "category",
                   "category_name", "teacher", "chapter_list", "can_free_study", ]
+
+    def get_can_free_study(self, obj):
+        """判断当前课程是否可以免费学习，直接使用预先查询的章节课时，避免重复查询"""
+        for chapter in obj.chapter_list.all():
+            for lesson in chapter.lesson_list.all():
+                if lesson.free_trail:
+                    return True
+        return False
+
+
+class CourseOutlineModelSerializer(CourseRetrieveModelSerializer):
+    """课程大纲序列化器，章节列表中只包含课时数量，课时列表通过章节课时接口按需获取"""
+    chapter_list = CourseChapterOutlineModelSerializer(many=True)
+
+    def get_can_free_study(self, obj):
+        return obj.can_free_study
@@ -0,0 +1,188 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone as datetime
+from django_redis import get_redis_connection
+
+import constants
+from .models import Activity, Course, CourseActivityPrice, CoursePriceSnapshot
+
+# 从待处理队列中取出已经到达开始或结束时间的活动，取出的同时从队列中删除，避免多个进程重复处理
+POP_DUE_ACTIVITIES_SCRIPT = """
+local activity_id_list = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "limit", 0, ARGV[2])
+if #activity_id_list > 0 then
+    redis.call("zrem", KEYS[1], unpack(activity_id_list))
+end
+return activity_id_list
+"""
+
+# 每个进程只注册一次lua脚本
+_pop_due_activities_script = None
+
+
+def get_last_activity_logs(course_id_list, now_time):
+    """
+    批量获取课程当前参与的最新活动记录
+    :param course_id_list: 课程ID列表
+    :param now_time: 计算时的当前时间
+    :return: 字典 {课程ID: 活动记录[CourseActivityPrice]}，没有参与活动的课程不在字典中
+    """
+    # 一次性查询所有课程当前参与的活动记录，按id倒序，每个课程取第一条即为最新的活动记录
+    price_list = CourseActivityPrice.objects.filter(
+        course_id__in=course_id_list,
+        activity__end_time__gt=now_time,
+        activity__start_time__lt=now_time,
+    ).select_related("activity", "discount__discount_type").order_by("-id")
+
+    last_activity_logs = {}
+    for activity_log in price_list:
+        last_activity_logs.setdefault(activity_log.course_id, activity_log)
+    return last_activity_logs
+
+
+def get_course_discount_map(course_list, now_time=None):
+    """
+    批量获取课程当前参与的活动优惠信息
+    :param course_list: 课程的查询集、课程模型对象列表或者课程ID列表
+    :param now_time: 计算时的当前时间，默认为当前时间
+    :return: 字典 {课程ID: 优惠信息}，优惠信息的格式与 Course.discount 相同
+    """
+    if now_time is None:
+        now_time = datetime.now()
+
+    course_list = list(course_list)
+    # 传入的是课程ID列表，则先查询出课程模型对象[计算优惠价格需要用到课程原价]
+    if course_list and not isinstance(course_list[0], Course):
+        course_list = list(Course.objects.filter(pk__in=course_list).only("id", "price"))
+
+    if not course_list:
+        return {}
+
+    last_activity_logs = get_last_activity_logs([course.id for course in course_list], now_time)
+
+    return {
+        course.id: course.get_discount_data(last_activity_logs.get(course.id), now_time)
+        for course in course_list
+    }
+
+
+def prefetch_course_discount(course_list):
+    """
+    批量计算课程的优惠信息，并缓存到每个课程模型对象中，
+    后续访问 course.discount 时不再重复查询数据库
+    :param course_list: 课程模型对象列表
+    :return: 课程模型对象列表
+    """
+    course_list = list(course_list)
+    discount_map = get_course_discount_map(course_list)
+    for course in course_list:
+        course._discount_cache = discount_map[course.id]
+    return course_list
+
+
+def refresh_course_price_snapshot(course_id_list):
+    """
+    重新计算课程的价格快照
+    :param course_id_list: 需要重新计算的课程ID列表
+    :return: 本次更新的快照数量
+    """
+    course_id_list = set(course_id_list)
+    if not course_id_list:
+        return 0
+
+    now_time = datetime.now()
+    course_list = list(Course.objects.filter(pk__in=course_id_list).only("id", "price"))
+    last_activity_logs = get_last_activity_logs([course.id for course in course_list], now_time)
+    snapshot_dict = {
+        snapshot.course_id: snapshot
+        for snapshot in CoursePriceSnapshot.objects.filter(course_id__in=course_id_list)
+    }
+
+    create_list = []
+    update_list = []
+    for course in course_list:
+        activity_log = last_activity_logs.get(course.id)
+        discount = course.get_discount_data(activity_log, now_time)
+
+        snapshot = snapshot_dict.get(course.id)
+        if snapshot is None:
+            snapshot = CoursePriceSnapshot(course_id=course.id)
+            create_list.append(snapshot)
+        else:
+            update_list.append(snapshot)
+
+        discount_price = discount.get("price")
+        snapshot.discount_price = None if discount_price is None else Decimal(f"{discount_price:.2f}")
+        snapshot.real_price = course.price if discount_price is None else snapshot.discount_price
+        snapshot.discount_type = discount.get("type", "")
+        snapshot.expire_time = activity_log.activity.end_time if activity_log else None
+        snapshot.updated_time = now_time
+
+    CoursePriceSnapshot.objects.bulk_create(create_list)
+    CoursePriceSnapshot.objects.bulk_update(
+        update_list, ["real_price", "discount_price", "discount_type", "expire_time", "updated_time"])
+
+    # 已经不存在的课程，删除对应的快照
+    exist_id_list = {course.id for course in course_list}
+    CoursePriceSnapshot.objects.filter(course_id__in=course_id_list - exist_id_list).delete()
+
+    return len(create_list) + len(update_list)
+
+
+def get_next_activity_boundary(activity, now_time=None):
+    """
+    获取活动下一个需要重新计算价格的时间点
+    :return: 活动开始或结束时间之后1秒[活动时间的判断是开区间]，活动已经结束则返回None
+    """
+    now_time = now_time or datetime.now()
+    for boundary in (activity.start_time, activity.end_time):
+        if boundary > now_time:
+            return boundary + timedelta(seconds=1)
+    return None
+
+
+def schedule_activity_price_refresh(activity_list):
+    """
+    把活动下一个开始或结束的时间点写入待处理队列，由定时任务到点重新计算参与活动的课程价格快照
+    同一个活动在队列中只有一条记录，重复保存活动只会更新时间点
+    """
+    now_time = datetime.now()
+    redis = get_redis_connection("default")
+    pipe = redis.pipeline()
+    for activity in activity_list:
+        boundary = get_next_activity_boundary(activity, now_time)
+        if boundary is None:
+            pipe.zrem(constants.ACTIVITY_PRICE_REFRESH_KEY, activity.id)
+        else:
+            pipe.zadd(constants.ACTIVITY_PRICE_REFRESH_KEY, {activity.id: boundary.timestamp()})
+    pipe.execute()
+
+
+def pop_due_activity_ids(size=constants.ACTIVITY_PRICE_REFRESH_SIZE):
+    """从待处理队列中取出已经到达开始或结束时间的活动ID列表"""
+    global _pop_due_activities_script
+    if _pop_due_activities_script is None:
+        redis = get_redis_connection("default")
+        _pop_due_activities_script = redis.register_script(POP_DUE_ACTIVITIES_SCRIPT)
+    activity_id_list = _pop_due_activities_script(
+        keys=[constants.ACTIVITY_PRICE_REFRESH_KEY], args=[time.time(), size])
+    return [int(activity_id) for activity_id in activity_id_list]
+
+
+def refresh_due_activity_price(size=constants.ACTIVITY_PRICE_REFRESH_SIZE):
+    """
+    重新计算已经到达开始或结束时间的活动的课程价格快照，并把活动的下一个时间点重新写入待处理队列
+    :return: 本次处理的活动数量
+    """
+    activity_id_list = pop_due_activity_ids(size)
+    if not activity_id_list:
+        return 0
+
+    # 已经删除的活动直接跳过
+    activity_list = list(Activity.objects.filter(pk__in=activity_id_list))
+    course_id_list = CourseActivityPrice.objects.filter(
+        activity__in=activity_list).values_list("course_id", flat=True).distinct()
+    refresh_course_price_snapshot(course_id_list)
+    schedule_activity_price_refresh(activity_list)
+    return len(activity_list)
@@ -0,0 +1,93 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+import constants
+from fuguangapi.utils.caches import register_cache_models
+from .models import CourseDirection, CourseCategory, Course, Teacher, CourseChapter, CourseLesson
+from .models import Activity, DiscountType, Discount, CourseActivityPrice
+from .services import schedule_activity_price_refresh
+from .tasks import refresh_course_price
+
+# 学习方向、课程分类和课程发生变化时，更新数据版本号，列表页缓存和课程总数的缓存自动失效
+register_cache_models(CourseDirection, CourseCategory, Course)
+
+
+def refresh_course_price_on_commit(course_id_list):
+    """事务提交以后，异步重新计算课程的价格快照"""
+    course_id_list = list(set(course_id_list))
+    if course_id_list:
+        transaction.on_commit(lambda: refresh_course_price.delay(course_id_list))
+
+
+def schedule_activity_price_refresh_on_commit(activity):
+    """事务提交以后，把活动下一个开始或结束的时间点写入待处理队列，由定时任务重新计算价格快照"""
+    transaction.on_commit(lambda: schedule_activity_price_refresh([activity]))
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, **kwargs):
+    """课程原价可能发生了变化"""
+    refresh_course_price_on_commit([instance.id])
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, **kwargs):
+    """活动时间可能发生了变化"""
+    refresh_course_price_on_commit(instance.price_list.values_list("course_id", flat=True))
+    schedule_activity_price_refresh_on_commit(instance)
+
+
+@receiver(post_save, sender=DiscountType)
+def discount_type_saved(sender, instance, **kwargs):
+    """优惠类型的名称可能发生了变化"""
+    refresh_course_price_on_commit(CourseActivityPrice.objects.filter(
+        discount__discount_type=instance).values_list("course_id", flat=True))
+
+
+@receiver(post_save, sender=Discount)
+def discount_saved(sender, instance, **kwargs):
+    """优惠条件或优惠公式可能发生了变化"""
+    refresh_course_price_on_commit(instance.price_list.values_list("course_id", flat=True))
+
+
+@receiver(post_save, sender=CourseActivityPrice)
+@receiver(post_delete, sender=CourseActivityPrice)
+def course_activity_price_changed(sender, instance, **kwargs):
+    """课程参与的活动发生了变化[删除活动或优惠公式时，也会级联触发当前信号]"""
+    refresh_course_price_on_commit([instance.course_id])
+
+
+def delete_course_detail_cache(course_id_list):
+    """事务提交以后，删除课程详情的缓存[避免事务提交之前，其他请求又把旧数据写回缓存]"""
+    keys = []
+    for course_id in set(course_id_list):
+        # 课程详情和课程大纲的缓存
+        keys.append(f"{constants.COURSE_DETAIL_CACHE_KEY}:{course_id}")
+        keys.append(f"{constants.COURSE_DETAIL_CACHE_KEY}:{course_id}:outline")
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_detail_changed(sender, instance, **kwargs):
+    delete_course_detail_cache([instance.id])
+
+
+@receiver(post_save, sender=CourseChapter)
+@receiver(post_delete, sender=CourseChapter)
+@receiver(post_save, sender=CourseLesson)
+@receiver(post_delete, sender=CourseLesson)
+def course_outline_changed(sender, instance, **kwargs):
+    """课程的章节或课时发生变化"""
+    delete_course_detail_cache([instance.course_id])
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_save, sender=CourseDirection)
+@receiver(post_save, sender=CourseCategory)
+def course_related_changed(sender, instance, **kwargs):
+    """课程的讲师、学习方向或课程分类发生变化"""
+    delete_course_detail_cache(instance.course_list.values_list("id", flat=True))
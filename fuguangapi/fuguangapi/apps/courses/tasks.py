@@ -0,0 +1,29 @@
+import logging
+
+from celery import shared_task
+
+from .services import refresh_course_price_snapshot, refresh_due_activity_price
+
+logger = logging.getLogger('django')
+
+
+@shared_task(name="refresh_course_price")
+def refresh_course_price(course_id_list):
+    """重新计算指定课程的价格快照"""
+    total = refresh_course_price_snapshot(course_id_list)
+    logger.info(f"课程价格快照更新完成！数量:{total}")
+    return total
+
+
+@shared_task(name="sweep_activity_price")
+def sweep_activity_price(max_batches=20):
+    """定时任务：重新计算已经到达开始或结束时间的活动的课程价格快照"""
+    total = 0
+    for _ in range(max_batches):
+        count = refresh_due_activity_price()
+        if not count:
+            break
+        total += count
+    if total:
+        logger.info(f"活动课程价格快照更新完成！活动数量:{total}")
+    return total
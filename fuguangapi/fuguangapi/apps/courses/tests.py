@@ -1 +1,245 @@
-# Create your tests here.
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase, SimpleTestCase
+from django.utils import timezone as datetime
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+import constants
+
+from fuguangapi.utils.pricing import PricingRuleError, compile_rule, get_pricing_rule
+from .models import Course, Activity, DiscountType, Discount, CourseActivityPrice, CoursePriceSnapshot
+from .models import Teacher, CourseDirection, CourseCategory, CourseChapter, CourseLesson
+from .services import get_course_discount_map, prefetch_course_discount, refresh_course_price_snapshot
+from .tasks import sweep_activity_price
+
+
+def create_activity_course(name, price, sale, condition=0):
+    """创建一个参与了进行中活动的课程"""
+    now_time = datetime.now()
+    course = Course.objects.create(name=name, price=price)
+    activity = Activity.objects.create(name=f"{name}活动", start_time=now_time - timedelta(days=1),
+                                       end_time=now_time + timedelta(days=1))
+    discount_type = DiscountType.objects.create(name="限时折扣")
+    discount = Discount.objects.create(name=f"{name}优惠", discount_type=discount_type,
+                                       condition=condition, sale=sale)
+    CourseActivityPrice.objects.create(name=f"{name}价格", activity=activity, course=course, discount=discount)
+    return course
+
+
+class CourseDiscountTestCase(TestCase):
+    """课程优惠信息批量计算的测试集"""
+
+    def setUp(self):
+        self.course_list = [
+            create_activity_course("python入门", 100, "*0.8"),
+            create_activity_course("django入门", 300, "-100"),
+            create_activity_course("vue入门", 50, "0"),
+            create_activity_course("go入门", 50, "-10", condition=100),
+            Course.objects.create(name="无优惠课程", price=200),
+        ]
+
+    def test_discount_map_same_as_property(self):
+        """测试批量计算的优惠信息与单个课程计算的结果一致"""
+        now_time = datetime.now()
+        discount_map = get_course_discount_map(self.course_list, now_time)
+        for course in self.course_list:
+            data = course.discount
+            self.assertEqual(data.get("type"), discount_map[course.id].get("type"))
+            self.assertEqual(data.get("price"), discount_map[course.id].get("price"))
+
+    def test_discount_map_by_course_id(self):
+        """测试根据课程ID列表批量计算优惠信息"""
+        discount_map = get_course_discount_map([course.id for course in self.course_list])
+        self.assertEqual(80, discount_map[self.course_list[0].id]["price"])
+        self.assertEqual(200, discount_map[self.course_list[1].id]["price"])
+        self.assertEqual(0, discount_map[self.course_list[2].id]["price"])
+        self.assertNotIn("price", discount_map[self.course_list[3].id])
+        self.assertEqual({}, discount_map[self.course_list[4].id])
+
+    def test_prefetch_course_discount_queries(self):
+        """测试批量计算优惠信息以后，访问课程的优惠信息不再查询数据库"""
+        course_list = list(Course.objects.all())
+        with self.assertNumQueries(1):
+            prefetch_course_discount(course_list)
+            for course in course_list:
+                course.discount
+
+    def test_refresh_course_price_snapshot(self):
+        """测试课程价格快照的计算结果"""
+        refresh_course_price_snapshot([course.id for course in self.course_list])
+        snapshot_dict = {item.course_id: item for item in CoursePriceSnapshot.objects.all()}
+        self.assertEqual(5, len(snapshot_dict))
+        self.assertEqual(80, snapshot_dict[self.course_list[0].id].real_price)
+        self.assertEqual("限时折扣", snapshot_dict[self.course_list[0].id].discount_type)
+        self.assertIsNotNone(snapshot_dict[self.course_list[0].id].expire_time)
+        self.assertEqual(50, snapshot_dict[self.course_list[3].id].real_price)
+        self.assertIsNone(snapshot_dict[self.course_list[3].id].discount_price)
+        self.assertEqual(200, snapshot_dict[self.course_list[4].id].real_price)
+
+        # 课程原价发生变化以后，再次计算快照
+        Course.objects.filter(pk=self.course_list[0].id).update(price=200)
+        refresh_course_price_snapshot([self.course_list[0].id])
+        self.assertEqual(160, CoursePriceSnapshot.objects.get(course=self.course_list[0]).real_price)
+
+
+class ActivityPriceRefreshTestCase(TestCase):
+    """活动开始或结束时重新计算价格快照的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+
+    def test_schedule_once_per_activity(self):
+        """测试重复保存活动只保留一个时间点，到点以后重新计算价格快照并写入下一个时间点"""
+        redis = get_redis_connection("default")
+        with self.captureOnCommitCallbacks(execute=True):
+            course = create_activity_course("python入门", 100, "*0.8")
+        activity = Activity.objects.get()
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                activity.save()
+        self.assertEqual(1, redis.zcard(constants.ACTIVITY_PRICE_REFRESH_KEY))
+        self.assertEqual((activity.end_time + timedelta(seconds=1)).timestamp(),
+                         redis.zscore(constants.ACTIVITY_PRICE_REFRESH_KEY, activity.id))
+
+        # 模拟活动已经到达时间点
+        CoursePriceSnapshot.objects.all().delete()
+        redis.zadd(constants.ACTIVITY_PRICE_REFRESH_KEY, {activity.id: 0})
+        self.assertEqual(1, sweep_activity_price())
+        self.assertEqual(80, CoursePriceSnapshot.objects.get(course=course).real_price)
+        self.assertEqual(1, redis.zcard(constants.ACTIVITY_PRICE_REFRESH_KEY))
+
+        # 活动已经结束，不再写入待处理队列
+        Activity.objects.filter(pk=activity.id).update(end_time=datetime.now() - timedelta(seconds=1))
+        redis.zadd(constants.ACTIVITY_PRICE_REFRESH_KEY, {activity.id: 0})
+        self.assertEqual(1, sweep_activity_price())
+        self.assertEqual(0, redis.zcard(constants.ACTIVITY_PRICE_REFRESH_KEY))
+
+
+class CourseOutlineTestCase(TestCase):
+    """课程大纲与章节课时列表的测试集"""
+
+    def setUp(self):
+        cache.clear()
+        teacher = Teacher.objects.create(name="讲师", title="讲师", brief="讲师简介")
+        direction = CourseDirection.objects.create(name="后端开发")
+        category = CourseCategory.objects.create(name="python", direction=direction)
+        self.course = Course.objects.create(name="python入门", price=100, teacher=teacher,
+                                            direction=direction, category=category)
+        self.chapter = CourseChapter.objects.create(name="第一章", course=self.course, orders=1)
+        for orders in range(1, 26):
+            CourseLesson.objects.create(name=f"第{orders}课时", chapter=self.chapter, course=self.course,
+                                        orders=orders, free_trail=orders == 1)
+        CourseLesson.objects.create(name="隐藏课时", chapter=self.chapter, course=self.course, is_show=False)
+        self.client = APIClient()
+
+    def test_outline(self):
+        """测试课程大纲只返回章节的课时数量"""
+        response = self.client.get(f"/courses/{self.course.id}/", {"outline": 1})
+        self.assertEqual(200, response.status_code)
+        chapter = response.data["chapter_list"][0]
+        self.assertEqual(25, chapter["lesson_count"])
+        self.assertNotIn("lesson_list", chapter)
+        self.assertTrue(response.data["can_free_study"])
+
+    def test_chapter_lessons(self):
+        """测试按游标分页获取章节的课时列表"""
+        url = f"/courses/{self.course.id}/chapters/{self.chapter.id}/lessons/"
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertIn("max-age", response["Cache-Control"])
+        self.assertEqual(list(range(1, 21)), [item["orders"] for item in response.data["results"]])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(list(range(21, 26)), [item["orders"] for item in response.data["results"]])
+        self.assertIsNone(response.data["next"])
+
+    def test_hidden_course_lessons(self):
+        """测试下架课程的课时列表不能访问"""
+        Course.objects.filter(pk=self.course.id).update(is_show=False)
+        response = self.client.get(f"/courses/{self.course.id}/chapters/{self.chapter.id}/lessons/")
+        self.assertEqual([], response.data["results"])
+
+
+class CourseListPaginationTestCase(TestCase):
+    """课程列表游标分页的测试集"""
+
+    def setUp(self):
+        cache.clear()
+        for i in range(12):
+            Course.objects.create(name=f"课程{i}", price=100, orders=i % 3)
+        self.client = APIClient()
+
+    def test_keyset_same_as_page_number(self):
+        """测试游标分页与页码分页的结果顺序一致"""
+        page_id_list = []
+        for page in range(1, 4):
+            response = self.client.get("/courses/0/0/", {"page": page})
+            page_id_list += [item["id"] for item in response.data["results"]]
+
+        cursor_id_list = []
+        response = self.client.get("/courses/0/0/", {"paginate": "cursor", "count": 1})
+        self.assertEqual(12, response.data["count"])
+        while True:
+            cursor_id_list += [item["id"] for item in response.data["results"]]
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(page_id_list, cursor_id_list)
+
+    def test_cached_count(self):
+        """测试课程总数被缓存，课程发生变化以后重新统计"""
+        self.assertEqual(12, self.client.get("/courses/0/0/").data["count"])
+        Course.objects.filter(orders=0).update(is_show=False)
+        self.assertEqual(12, self.client.get("/courses/0/0/").data["count"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Course.objects.create(name="新课程", price=100)
+        self.assertEqual(9, self.client.get("/courses/0/0/").data["count"])
+
+    def test_price_filter(self):
+        """测试价格区间过滤，价格格式错误时返回400"""
+        Course.objects.create(name="低价课程", price=10)
+        self.assertEqual(1, self.client.get("/courses/0/0/", {"max_price": "50.5"}).data["count"])
+        for value in ["abc", "nan", "inf"]:
+            self.assertEqual(400, self.client.get("/courses/0/0/", {"min_price": value}).status_code)
+
+    def test_invalid_cursor(self):
+        """测试无效的游标与不支持的排序"""
+        self.assertEqual(404, self.client.get("/courses/0/0/", {"cursor": "abc"}).status_code)
+        # 格式正确但是值的类型与排序字段不一致的游标，例如 ["x", "y"]、[1, null]
+        for cursor in ["WyJ4IiwieSJd", "WzEsbnVsbF0"]:
+            self.assertEqual(404, self.client.get("/courses/0/0/", {"cursor": cursor}).status_code)
+        response = self.client.get("/courses/0/0/", {"paginate": "cursor", "ordering": "-students"})
+        self.assertEqual(400, response.status_code)
+
+
+class PricingRuleTestCase(SimpleTestCase):
+    """优惠公式编译的测试集"""
+
+    def test_compile_rule(self):
+        """测试优惠公式的计算结果"""
+        self.assertEqual(Decimal("0.00"), compile_rule("0")(Decimal("99.90")))
+        self.assertEqual(Decimal("81.92"), compile_rule("*0.82")(Decimal("99.90")))
+        self.assertEqual(Decimal("199.00"), compile_rule("-100")(Decimal("299.00")))
+        self.assertEqual(Decimal("0.00"), compile_rule("-100")(Decimal("50.00")))
+        self.assertEqual(Decimal("20.00"), compile_rule("*0.8").reduction(100))
+
+    def test_apply(self):
+        """测试批量计算优惠价格"""
+        rule = compile_rule("*0.5")
+        self.assertEqual([Decimal("50.00"), Decimal("0.50"), Decimal("0.00")], rule.apply([100, "1", 0]))
+
+    def test_invalid_rule(self):
+        """测试不合规的优惠公式"""
+        for sale in ["", "abc", "*", "*1.5", "--10", "-nan", "8"]:
+            with self.assertRaises(PricingRuleError):
+                compile_rule(sale)
+
+    def test_rule_cache(self):
+        """测试同一条记录的优惠公式只编译一次，修改以后重新编译"""
+        rule = get_pricing_rule("discount", 1, "*0.8")
+        self.assertIs(rule, get_pricing_rule("discount", 1, "*0.8"))
+        self.assertIsNot(rule, get_pricing_rule("coupon", 1, "*0.8"))
+        self.assertEqual(Decimal("70.00"), get_pricing_rule("discount", 1, "*0.7")(100))
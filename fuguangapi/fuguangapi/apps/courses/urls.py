@@ -13,6 +13,8 @@ urlpatterns = [
                   re_path('^(?P<direction>\d+)/(?P<category>\d+)/$', views.CourseListAPiView.as_view()),
                   path('hot_word/', views.HotWordAPIView.as_view()),
                   re_path('^(?P<pk>\d+)/$', views.CourseRetrieveAPIView.as_view()),
+                  re_path('^(?P<pk>\d+)/chapters/(?P<chapter>\d+)/lessons/$',
+                          views.CourseChapterLessonListAPIView.as_view()),
                   path('type/', views.CourseTypeListAPIView.as_view()),
                   re_path("^polyv/token/(?P<vid>\w+)/$", views.PolyvViewSet.as_view({"get": "token"})),
               ] + router.urls
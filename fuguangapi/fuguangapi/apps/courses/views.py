@@ -1,9 +1,15 @@
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q, Count, Prefetch
+from django.db.models.functions import Coalesce
+from django.utils.cache import patch_cache_control
 from django_redis import get_redis_connection
 from drf_haystack.filters import HaystackFilter
 from drf_haystack.viewsets import HaystackViewSet
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated
@@ -13,21 +19,24 @@ from rest_framework.viewsets import ViewSet
 
 import constants
 from fuguangapi.libs.polyv import PolyvPlayer
-from .models import CourseDirection, CourseCategory, Course
-from .paginations import CourseListPageNumberPagination
+from fuguangapi.utils.caches import get_model_versions, get_cached_count
+from fuguangapi.utils.views import ListAPIView as CacheListAPIView
+from .models import CourseDirection, CourseCategory, Course, CourseChapter, CourseLesson
+from .paginations import CourseListPageNumberPagination, CourseLessonCursorPagination
 from .serializers import CourseDirectionSerializer, CourseCategorySerializer, CourseModelSerializer
 from .serializers import CourseIndexHaystackSerializer
-from .serializers import CourseRetrieveModelSerializer
+from .serializers import CourseRetrieveModelSerializer, CourseOutlineModelSerializer, CourseLessonModelserializer
+from .services import get_course_discount_map
 
 
-class CourseDirectionListView(ListAPIView):
+class CourseDirectionListView(CacheListAPIView):
     """学习方向视图"""
     queryset = CourseDirection.objects.filter(
         is_show=True, is_delete=False).order_by("orders", "id")
     serializer_class = CourseDirectionSerializer
 
 
-class CourseCategoryListView(ListAPIView):
+class CourseCategoryListView(CacheListAPIView):
     """学习分类视图"""
     serializer_class = CourseCategorySerializer
     # 取消分页
@@ -47,12 +56,14 @@ class CourseListAPiView(ListAPIView):
     """所有课程视图"""
     serializer_class = CourseModelSerializer
     filter_backends = [OrderingFilter]
-    ordering_fields = ("id", "students", "orders")
+    ordering_fields = ("id", "students", "orders", "real_price")
     pagination_class = CourseListPageNumberPagination
 
     def get_queryset(self):
         """列表页数据"""
-        queryset = Course.objects.filter(is_delete=False, is_show=True).order_by("-orders", "-id")
+        # 课程的当前价格从价格快照中读取，没有快照的课程则使用课程原价
+        queryset = Course.objects.filter(is_delete=False, is_show=True).annotate(
+            real_price=Coalesce(F("price_snapshot__real_price"), F("price"))).order_by("-orders", "-id")
         direction = int(self.kwargs.get("direction", 0))
         category = int(self.kwargs.get("category", 0))
 
@@ -64,8 +75,40 @@ class CourseListAPiView(ListAPIView):
         if category > 0:
             queryset = queryset.filter(category=category)
 
+        # 根据课程的当前价格进行过滤
+        min_price = self.get_price_param("min_price")
+        max_price = self.get_price_param("max_price")
+        if min_price is not None:
+            queryset = queryset.filter(real_price__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(real_price__lte=max_price)
+
         return queryset.all()
 
+    def get_price_param(self, name):
+        """获取价格区间的查询参数，格式错误时返回400"""
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: "价格格式错误"})
+        if not price.is_finite():
+            raise ValidationError({name: "价格格式错误"})
+        return price
+
+    def get_pagination_count(self, queryset):
+        """课程总数按学习方向和课程分类缓存，课程发生变化时数据版本号变化，缓存自动失效"""
+        # 价格区间的条件组合太多，并且价格快照的变化不会更新数据版本号，所以不缓存总数
+        if self.request.query_params.get("min_price") or self.request.query_params.get("max_price"):
+            return queryset.count()
+        direction = int(self.kwargs.get("direction", 0))
+        category = int(self.kwargs.get("category", 0))
+        version = get_model_versions([Course])
+        key = f"{constants.COURSE_COUNT_CACHE_KEY}:{direction}:{category}:{version}"
+        return get_cached_count(key, queryset, constants.COURSE_COUNT_CACHE_TIME)
+
 
 class CourseSearchViewSet(HaystackViewSet):
     # 指定本次搜索的最终真实数据的保存模型
@@ -109,9 +152,65 @@ class HotWordAPIView(APIView):
 
 
 class CourseRetrieveAPIView(RetrieveAPIView):
-    """课程详情视图"""
-    queryset = Course.objects.filter(is_delete=False, is_show=True)
-    serializer_class = CourseRetrieveModelSerializer
+    """
+    课程详情视图
+    查询参数outline=1时只返回课程大纲[章节列表与每个章节的课时数量]，课时列表通过章节课时接口按需获取
+    """
+
+    def is_outline(self):
+        return self.request.query_params.get("outline") == "1"
+
+    def get_serializer_class(self):
+        if self.is_outline():
+            return CourseOutlineModelSerializer
+        return CourseRetrieveModelSerializer
+
+    def get_queryset(self):
+        # 一次性查询课程的讲师、方向、分类以及所有章节，课程大纲只统计课时数量，不查询课时列表
+        chapter_queryset = CourseChapter.objects.filter(is_show=True, is_delete=False).order_by("orders", "id")
+        if self.is_outline():
+            chapter_queryset = chapter_queryset.annotate(lesson_count=Count(
+                "lesson_list", filter=Q(lesson_list__is_show=True, lesson_list__is_delete=False)))
+        else:
+            lesson_queryset = CourseLesson.objects.filter(is_show=True, is_delete=False).order_by("orders", "id")
+            chapter_queryset = chapter_queryset.prefetch_related(Prefetch("lesson_list", queryset=lesson_queryset))
+        return Course.objects.filter(is_delete=False, is_show=True).select_related(
+            "teacher", "direction", "category").prefetch_related(Prefetch("chapter_list", queryset=chapter_queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        # 课程详情从缓存中读取，课程、章节、课时、讲师等信息发生变化时，缓存会被删除
+        key = f"{constants.COURSE_DETAIL_CACHE_KEY}:{kwargs['pk']}"
+        if self.is_outline():
+            key = f"{key}:outline"
+        data = cache.get(key)
+        if data is None:
+            instance = self.get_object()
+            data = self.get_serializer(instance).data
+            cache.set(key, data, constants.COURSE_DETAIL_CACHE_TIME)
+
+        # 优惠信息随时间变化，每次请求实时计算
+        course = Course(id=data["id"], price=Decimal(data["price"]))
+        data["discount"] = get_course_discount_map([course])[course.id]
+        return Response(data)
+
+
+class CourseChapterLessonListAPIView(ListAPIView):
+    """章节课时列表视图，客户端展开章节时才获取章节下的课时"""
+    serializer_class = CourseLessonModelserializer
+    pagination_class = CourseLessonCursorPagination
+
+    def get_queryset(self):
+        return CourseLesson.objects.filter(
+            course_id=self.kwargs["pk"], chapter_id=self.kwargs["chapter"],
+            course__is_show=True, course__is_delete=False,
+            chapter__is_show=True, chapter__is_delete=False,
+            is_show=True, is_delete=False)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # 课时信息很少变化，允许客户端缓存
+        patch_cache_control(response, public=True, max_age=constants.COURSE_LESSON_CACHE_TIME)
+        return response
 
 
 class CourseTypeListAPIView(APIView):
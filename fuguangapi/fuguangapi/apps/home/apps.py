@@ -6,3 +6,7 @@ class HomeConfig(AppConfig):
     name = 'home'
     verbose_name = '公共数据'
     verbose_name_plural = verbose_name
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa
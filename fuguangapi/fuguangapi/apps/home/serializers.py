@@ -1,4 +1,6 @@
 from rest_framework import serializers
+
+from courses.models import Course, CourseDirection
 from .models import Nav, Banner
 
 
@@ -20,3 +22,25 @@ class BannerModuleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Banner
         fields = ["image", "link", "name", "is_http"]
+
+
+class HomeDirectionModelSerializer(serializers.ModelSerializer):
+    """
+    首页推荐学习方向序列化器
+    """
+
+    class Meta:
+        model = CourseDirection
+        fields = ["id", "name", "recomment_home_hot", "recomment_home_top"]
+
+
+class HomeCourseModelSerializer(serializers.ModelSerializer):
+    """
+    首页推荐课程序列化器
+    首页数据是预先生成的，所以不包含随时间变化的优惠信息
+    """
+
+    class Meta:
+        model = Course
+        fields = ["id", "name", "course_cover", "level", "get_level_display", "students",
+                  "lessons", "pub_lessons", "price", "direction"]
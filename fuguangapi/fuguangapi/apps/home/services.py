@@ -0,0 +1,73 @@
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+import constants
+from courses.models import Course, CourseDirection
+from .models import Nav, Banner
+from .serializers import NavModelSerializer, BannerModuleSerializer
+from .serializers import HomeDirectionModelSerializer, HomeCourseModelSerializer
+
+
+class ServerURLBuilder(object):
+    """
+    后台任务中生成数据时没有请求对象，序列化器只能返回图片的相对地址，
+    使用配置的服务端域名[settings.SERVER_URL]代替请求对象，返回与其他接口一致的完整地址
+    """
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+
+    def build_absolute_uri(self, location):
+        return urljoin(self.server_url, location)
+
+
+def get_serializer_context():
+    """生成首页数据时序列化器使用的上下文，没有配置服务端域名时返回图片的相对地址"""
+    server_url = getattr(settings, "SERVER_URL", None)
+    if not server_url:
+        return {}
+    return {"request": ServerURLBuilder(server_url)}
+
+
+def build_home_payload():
+    """生成首页的聚合数据：导航菜单、轮播图、推荐学习方向和推荐课程"""
+    context = get_serializer_context()
+    nav_list = Nav.objects.filter(is_delete=False, is_show=True).order_by("orders", "-id")
+    banner_list = Banner.objects.filter(is_delete=False, is_show=True).order_by("orders", "-id")
+    direction_list = CourseDirection.objects.filter(is_delete=False, is_show=True).order_by("orders", "id")
+    course_list = Course.objects.filter(is_delete=False, is_show=True).order_by("-orders", "-id")
+
+    data = {
+        "header_nav": NavModelSerializer(
+            nav_list.filter(position=constants.NAV_HEADER)[:constants.NAV_HEADER_SIZE], many=True).data,
+        "footer_nav": NavModelSerializer(
+            nav_list.filter(position=constants.NAV_FOOTER)[:constants.NAV_FOOTER_SIZE], many=True).data,
+        "banner": BannerModuleSerializer(banner_list[:constants.BANNER_SIZE], many=True, context=context).data,
+        "hot_direction": HomeDirectionModelSerializer(
+            direction_list.filter(recomment_home_hot=True)[:constants.HOME_DIRECTION_SIZE], many=True).data,
+        "top_direction": HomeDirectionModelSerializer(
+            direction_list.filter(recomment_home_top=True)[:constants.HOME_DIRECTION_SIZE], many=True).data,
+        "hot_course": HomeCourseModelSerializer(
+            course_list.filter(recomment_home_hot=True)[:constants.HOME_COURSE_SIZE], many=True, context=context).data,
+        "top_course": HomeCourseModelSerializer(
+            course_list.filter(recomment_home_top=True)[:constants.HOME_COURSE_SIZE], many=True, context=context).data,
+    }
+    return JSONRenderer().render(data)
+
+
+def refresh_home_payload():
+    """重新生成首页的聚合数据并保存到缓存中，数据变化时会主动更新，所以不设置过期时间"""
+    payload = build_home_payload()
+    cache.set(constants.HOME_PAYLOAD_KEY, payload, None)
+    return payload
+
+
+def get_home_payload():
+    """获取首页的聚合数据，缓存不存在时才重新生成"""
+    payload = cache.get(constants.HOME_PAYLOAD_KEY)
+    if payload is None:
+        payload = refresh_home_payload()
+    return payload
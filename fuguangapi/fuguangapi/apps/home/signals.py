@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from courses.models import Course, CourseDirection
+from fuguangapi.utils.caches import register_cache_models
+from .models import Nav, Banner
+from .tasks import refresh_home
+
+# 导航菜单和轮播图发生变化时，更新数据版本号，列表页缓存自动失效
+register_cache_models(Nav, Banner)
+
+
+@receiver(post_save, sender=Nav)
+@receiver(post_delete, sender=Nav)
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+@receiver(post_save, sender=CourseDirection)
+@receiver(post_delete, sender=CourseDirection)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def home_data_changed(sender, **kwargs):
+    """首页相关的数据发生变化以后，在后台重新生成首页的聚合数据"""
+    transaction.on_commit(lambda: refresh_home.delay())
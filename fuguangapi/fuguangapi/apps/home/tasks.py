@@ -0,0 +1,15 @@
+import logging
+
+from celery import shared_task
+
+from .services import refresh_home_payload
+
+logger = logging.getLogger('django')
+
+
+@shared_task(name="refresh_home")
+def refresh_home():
+    """重新生成首页的聚合数据"""
+    payload = refresh_home_payload()
+    logger.info(f"首页数据更新完成！大小:{len(payload)}")
+    return len(payload)
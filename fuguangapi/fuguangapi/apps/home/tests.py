@@ -1,3 +1,93 @@
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIClient
 
-# Create your tests here.
+import constants
+from courses.models import Course
+from .models import Nav, Banner
+from .services import refresh_home_payload
+
+# 编写测试的接口地址
+NAV_HEADER_URL = "/nav/header/"
+BANNER_URL = "/banner/"
+HOME_URL = "/home/"
+
+
+class ListPageCacheTestCase(TestCase):
+    """列表页缓存的测试集"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_list_page_cached(self):
+        """测试列表页缓存以后不再查询数据库"""
+        Nav.objects.create(name="首页", link="/", position=constants.NAV_HEADER)
+        self.client.get(NAV_HEADER_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(NAV_HEADER_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(1, len(res.data))
+
+    def test_list_page_invalidated(self):
+        """测试模型数据发生变化并且事务提交以后，列表页缓存失效"""
+        with self.captureOnCommitCallbacks(execute=True):
+            nav = Nav.objects.create(name="首页", link="/", position=constants.NAV_HEADER)
+        self.assertEqual(1, len(self.client.get(NAV_HEADER_URL).data))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Nav.objects.create(name="课程", link="/course", position=constants.NAV_HEADER)
+            # 事务提交之前版本号不变，仍然返回缓存数据
+            with self.assertNumQueries(0):
+                self.assertEqual(1, len(self.client.get(NAV_HEADER_URL).data))
+        self.assertEqual(2, len(self.client.get(NAV_HEADER_URL).data))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nav.delete()
+        self.assertEqual(1, len(self.client.get(NAV_HEADER_URL).data))
+
+        # 其他模型的数据变化不影响当前列表页的缓存
+        with self.captureOnCommitCallbacks(execute=True):
+            Banner.objects.create(name="广告", image="banner/2021/1.jpg", link="/", note="")
+        with self.assertNumQueries(0):
+            self.client.get(NAV_HEADER_URL)
+
+
+class HomeTestCase(TestCase):
+    """首页聚合数据的测试集"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_home_payload(self):
+        """测试首页聚合数据的内容，并且生成以后不再查询数据库"""
+        Nav.objects.create(name="首页", link="/", position=constants.NAV_HEADER)
+        Nav.objects.create(name="关于", link="/about", position=constants.NAV_FOOTER)
+        Course.objects.create(name="python入门", price=100, recomment_home_hot=True)
+        refresh_home_payload()
+
+        with self.assertNumQueries(0):
+            res = self.client.get(HOME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = res.json()
+        self.assertEqual("首页", data["header_nav"][0]["name"])
+        self.assertEqual("关于", data["footer_nav"][0]["name"])
+        self.assertEqual("python入门", data["hot_course"][0]["name"])
+        self.assertEqual([], data["top_course"])
+
+    def test_home_image_url(self):
+        """测试后台任务生成的首页数据与轮播图接口一样返回图片的完整地址"""
+        Banner.objects.create(name="广告", image="banner/2021/1.jpg", link="/", note="")
+        with self.settings(SERVER_URL="http://testserver"):
+            refresh_home_payload()
+        banner = self.client.get(BANNER_URL).json()[0]
+        self.assertEqual(banner["image"], self.client.get(HOME_URL).json()["banner"][0]["image"])
+        self.assertTrue(banner["image"].startswith("http://testserver/"))
+
+    def test_home_payload_missing(self):
+        """测试缓存不存在时，实时生成首页聚合数据"""
+        res = self.client.get(HOME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("banner", res.json())
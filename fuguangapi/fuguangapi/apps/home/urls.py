@@ -5,4 +5,5 @@ urlpatterns = [
     path('nav/header/', views.HeaderNavListAPIView.as_view()),
     path('nav/footer/', views.FooterNavListAPIView.as_view()),
     path('banner/', views.BannerListAPIView.as_view()),
+    path('home/', views.HomeAPIView.as_view()),
 ]
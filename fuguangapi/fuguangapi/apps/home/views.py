@@ -1,6 +1,10 @@
+from django.http.response import HttpResponse
+from rest_framework.views import APIView
+
 from home.models import Nav, Banner
 import constants
 from home.serializers import NavModelSerializer, BannerModuleSerializer
+from home.services import get_home_payload
 from views import ListAPIView
 
 
@@ -28,3 +32,13 @@ class BannerListAPIView(ListAPIView):
     """
     queryset = Banner.objects.filter(is_delete=False, is_show=True).order_by("orders", "-id")[:constants.BANNER_SIZE]
     serializer_class = BannerModuleSerializer
+
+
+class HomeAPIView(APIView):
+    """
+    首页聚合数据：导航菜单、轮播图、推荐学习方向和推荐课程
+    数据预先生成并保存在缓存中，直接返回缓存中的json数据
+    """
+
+    def get(self, request):
+        return HttpResponse(get_home_payload(), content_type="application/json")
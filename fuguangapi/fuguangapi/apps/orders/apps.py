@@ -6,3 +6,7 @@ class OrdersConfig(AppConfig):
     name = 'orders'
     verbose_name = '订单管理'
     verbose_name_plural = verbose_name
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa
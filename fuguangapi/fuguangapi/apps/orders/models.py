@@ -12,6 +12,7 @@ class Order(BaseModel):
         (1, '已支付'),
         (2, '已取消'),
         (3, '已超时'),
+        (4, '已退款'),
     )
     pay_choices = (
         (0, '支付宝'),
@@ -26,20 +27,37 @@ class Order(BaseModel):
     order_desc = models.TextField(null=True, blank=True, max_length=500, verbose_name="订单描述")
     pay_time = models.DateTimeField(null=True, blank=True, verbose_name="支付时间")
     user = models.ForeignKey(User, related_name='user_orders', on_delete=models.DO_NOTHING, db_constraint=False,
-                             verbose_name="下单用户")
+                             db_index=False, verbose_name="下单用户")
     credit = models.IntegerField(default=0, verbose_name="积分", null=True, blank=True)
+    # 下单时的商品和优惠券信息，订单列表直接读取快照，不需要再查询订单详情和课程
+    snapshot = models.JSONField(null=True, blank=True, verbose_name="订单快照")
 
     class Meta:
         db_table = "fg_order"
         verbose_name = "订单记录"
         verbose_name_plural = verbose_name
+        constraints = [
+            # 支付宝同步/异步通知都是根据订单号查询订单
+            models.UniqueConstraint(fields=["order_number"], name="fg_order_number_uniq"),
+        ]
+        indexes = [
+            # 用户的订单列表，按订单状态过滤，按id倒序
+            models.Index(fields=["user", "is_show", "is_delete", "order_status", "-id"],
+                         name="fg_order_user_status_idx"),
+            # 兜底扫描过期未支付的订单
+            models.Index(fields=["order_status", "created_time"], name="fg_order_status_time_idx"),
+        ]
 
     def __str__(self):
         return "%s,总价: %s,实付: %s" % (self.name, self.total_price, self.real_price)
 
     def coupon(self):
         """当前订单关联的优惠券信息"""
-        coupon_related = self.to_coupon.first()
+        if self.snapshot is not None:
+            return self.snapshot["coupon"]
+
+        # 使用all()而不是first()，订单列表中预加载的优惠券记录才会生效
+        coupon_related = next(iter(self.to_coupon.all()), None)
         if coupon_related:
             return {
                 "id": coupon_related.coupon.id,
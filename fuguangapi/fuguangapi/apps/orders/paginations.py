@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from fuguangapi.utils.paginations import PageNumberPagination
 
 
 class OrderListPageNumberPagination(PageNumberPagination):
@@ -7,3 +7,4 @@ class OrderListPageNumberPagination(PageNumberPagination):
     max_page_size = 20
     page_size_query_param = "size"
     page_query_param = "page"
+    keyset_ordering = ("-id",)
@@ -0,0 +1,829 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone as datetime
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework import serializers
+
+import constants
+from cart.services import split_cart_courses, delete_cart_courses
+from coupon.models import CouponLog
+from coupon.services import add_coupon_to_redis
+from courses.models import Course
+from courses.services import prefetch_course_discount
+from fuguangapi.utils.pricing import PRICE_PRECISION
+from users.models import User, Credit
+from users.services import change_credit, change_credits
+from .models import Order, OrderDetail
+
+logger = logging.getLogger('django')
+
+# 用户订单数量存在时才累加，不存在时等待下次查询从数据库重新统计，避免写入不完整的数量
+ORDER_COUNT_SCRIPT = """
+if redis.call("exists", KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call("hincrby", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+# 对账时用户订单数量仍然存在才修正，已经过期的数量不再重新创建[修改字段的值不影响原有的有效期]
+RESET_ORDER_COUNT_SCRIPT = """
+if redis.call("exists", KEYS[1]) == 0 then
+    return 0
+end
+redis.call("hset", KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# 从延时队列中取出已经到期的订单，取出的同时从队列中删除，避免多个进程重复处理
+POP_TIMEOUT_ORDERS_SCRIPT = """
+local order_id_list = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "limit", 0, ARGV[2])
+if #order_id_list > 0 then
+    redis.call("zrem", KEYS[1], unpack(order_id_list))
+end
+return order_id_list
+"""
+
+# 从下单队列中取出一批下单请求，同时放入处理中的zset[score为处理超时的时间戳]，处理完成以后再删除
+CLAIM_ORDER_QUEUE_SCRIPT = """
+local payload_list = redis.call("lrange", KEYS[1], 0, ARGV[1] - 1)
+if #payload_list > 0 then
+    redis.call("ltrim", KEYS[1], #payload_list, -1)
+    for i = 1, #payload_list do
+        redis.call("zadd", KEYS[2], ARGV[2], payload_list[i])
+    end
+end
+return payload_list
+"""
+
+# 把处理超时的下单请求重新放回下单队列的头部，优先处理
+REQUEUE_ORDER_QUEUE_SCRIPT = """
+local payload_list = redis.call("zrangebyscore", KEYS[2], "-inf", ARGV[1], "limit", 0, ARGV[2])
+for i = #payload_list, 1, -1 do
+    redis.call("zrem", KEYS[2], payload_list[i])
+    redis.call("lpush", KEYS[1], payload_list[i])
+end
+return #payload_list
+"""
+
+# 每个进程只注册一次lua脚本
+_order_count_script = None
+_reset_order_count_script = None
+_pop_timeout_orders_script = None
+_claim_order_queue_script = None
+_requeue_order_queue_script = None
+
+
+def get_order_count_script():
+    global _order_count_script
+    if _order_count_script is None:
+        redis = get_redis_connection("default")
+        _order_count_script = redis.register_script(ORDER_COUNT_SCRIPT)
+    return _order_count_script
+
+
+def get_order_count_key(user_id):
+    """用户订单数量在redis中的key"""
+    return f"{constants.ORDER_COUNT_KEY}:{user_id}"
+
+
+def get_order_count_fields(order_status, is_show=True, is_delete=False):
+    """
+    订单在用户订单数量中占用的字段，隐藏或删除的订单不计入订单列表
+    :return: Counter {"all": 1, "<订单状态>": 1}
+    """
+    if not is_show or is_delete:
+        return Counter()
+    return Counter({"all": 1, str(order_status): 1})
+
+
+def get_order_counts(user_id):
+    """
+    获取用户在订单列表中各个状态的订单数量
+    :param user_id: 用户ID
+    :return: 字典 {"all": 全部订单数量, "0": 未支付数量, "1": 已支付数量, ...}
+    """
+    redis = get_redis_connection("default")
+    key = get_order_count_key(user_id)
+    data = redis.hgetall(key)
+    if data:
+        return {field.decode(): int(value) for field, value in data.items()}
+
+    # redis中没有数量，从数据库中统计
+    counts = count_user_orders([user_id])[user_id]
+    pipe = redis.pipeline()
+    pipe.hset(key, mapping=counts)
+    pipe.expire(key, constants.ORDER_COUNT_CACHE_TIME)
+    pipe.execute()
+    return counts
+
+
+def count_user_orders(user_id_list):
+    """
+    从数据库中统计多个用户在订单列表中各个状态的订单数量
+    :return: 字典 {用户ID: {"all": 全部订单数量, "0": 未支付数量, ...}}
+    """
+    result = {}
+    for user_id in user_id_list:
+        result[user_id] = {"all": 0}
+        for status, _ in Order.status_choices:
+            result[user_id][str(status)] = 0
+
+    queryset = Order.objects.filter(user_id__in=user_id_list, is_show=True, is_delete=False)
+    for item in queryset.values("user_id", "order_status").annotate(total=Count("id")).order_by():
+        counts = result[item["user_id"]]
+        counts[str(item["order_status"])] = item["total"]
+        counts["all"] += item["total"]
+    return result
+
+
+def reconcile_order_counts(batch_size=500):
+    """
+    对账：用数据库中的订单数量修正redis中的用户订单数量
+    只处理redis中已经存在的用户，不存在的用户在下次查询时会从数据库中统计
+    :return: 数量不一致的用户数量
+    """
+    redis = get_redis_connection("default")
+    prefix = f"{constants.ORDER_COUNT_KEY}:"
+    key_list = []
+    fixed = 0
+    for key in redis.scan_iter(match=f"{prefix}*", count=batch_size):
+        key_list.append(key.decode())
+        if len(key_list) >= batch_size:
+            fixed += reconcile_order_count_keys(redis, key_list)
+            key_list = []
+    if key_list:
+        fixed += reconcile_order_count_keys(redis, key_list)
+    return fixed
+
+
+def reconcile_order_count_keys(redis, key_list):
+    user_id_list = [int(key.rsplit(":", 1)[-1]) for key in key_list]
+    pipe = redis.pipeline()
+    for key in key_list:
+        pipe.hgetall(key)
+    redis_counts = pipe.execute()
+
+    db_counts = count_user_orders(user_id_list)
+
+    global _reset_order_count_script
+    if _reset_order_count_script is None:
+        _reset_order_count_script = redis.register_script(RESET_ORDER_COUNT_SCRIPT)
+
+    fixed = 0
+    pipe = redis.pipeline()
+    for user_id, key, data in zip(user_id_list, key_list, redis_counts):
+        counts = {field.decode(): int(value) for field, value in data.items()}
+        if data and counts != db_counts[user_id]:
+            logger.warning(f"用户订单数量不一致！user_id:{user_id} redis:{counts} db:{db_counts[user_id]}")
+            args = []
+            for field, value in db_counts[user_id].items():
+                args += [field, value]
+            # 读取以后数量可能已经过期，只修正仍然存在的数量，避免重新创建没有有效期的数量
+            _reset_order_count_script(keys=[key], args=args, client=pipe)
+            fixed += 1
+    pipe.execute()
+    return fixed
+
+
+def update_order_counts(user_id, delta):
+    """
+    增量更新用户的订单数量
+    :param user_id: 用户ID
+    :param delta: 各个字段的变化量，例如 {"all": 1, "0": 1}
+    """
+    args = []
+    for field, value in delta.items():
+        if value:
+            args += [field, value]
+    if args:
+        get_order_count_script()(keys=[get_order_count_key(user_id)], args=args)
+
+
+def delete_order_counts(user_id):
+    """删除用户的订单数量，下次查询时从数据库重新统计"""
+    get_redis_connection("default").delete(get_order_count_key(user_id))
+
+
+def add_order_timeout(order_id, timeout=constants.ORDER_TIMEOUT):
+    """把订单添加到超时取消的延时队列中，score为订单的过期时间戳"""
+    redis = get_redis_connection("default")
+    redis.zadd(constants.ORDER_TIMEOUT_KEY, {order_id: time.time() + timeout})
+
+
+def remove_order_timeout(*order_id_list):
+    """订单支付或取消以后，从延时队列中删除"""
+    if order_id_list:
+        redis = get_redis_connection("default")
+        redis.zrem(constants.ORDER_TIMEOUT_KEY, *order_id_list)
+
+
+def pop_timeout_orders(size=constants.ORDER_SWEEP_SIZE):
+    """
+    从延时队列中取出已经过期的订单
+    :param size: 每次最多取出的订单数量
+    :return: 订单ID列表
+    """
+    global _pop_timeout_orders_script
+    if _pop_timeout_orders_script is None:
+        redis = get_redis_connection("default")
+        _pop_timeout_orders_script = redis.register_script(POP_TIMEOUT_ORDERS_SCRIPT)
+    order_id_list = _pop_timeout_orders_script(keys=[constants.ORDER_TIMEOUT_KEY], args=[time.time(), size])
+    return [int(order_id) for order_id in order_id_list]
+
+
+def get_order_status_channel(order_number):
+    """订单状态变化的发布订阅频道"""
+    return f"{constants.ORDER_STATUS_CHANNEL}:{order_number}"
+
+
+def publish_order_status(order_list):
+    """
+    发布订单状态的变化，等待支付结果的客户端立即收到通知
+    发布失败不影响订单处理，客户端等待超时以后重新连接时会从数据库读取订单状态
+    """
+    redis = get_redis_connection("default")
+    pipe = redis.pipeline(transaction=False)
+    for order in order_list:
+        pipe.publish(get_order_status_channel(order.order_number), json.dumps({
+            "order_number": order.order_number,
+            "order_status": order.order_status,
+        }))
+    try:
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"发布订单状态失败！{e}")
+
+
+def on_orders_transitioned(order_list, from_status, to_status):
+    """
+    订单状态切换成功以后的处理：事务提交以后增量更新用户的订单数量，离开未支付状态的订单从延时队列中删除，
+    并发布订单状态的变化，条件更新不会触发模型信号，所以在这里手动处理
+    """
+    count_delta = defaultdict(Counter)
+    for order in order_list:
+        count_delta[order.user_id].subtract(get_order_count_fields(from_status, order.is_show, order.is_delete))
+        count_delta[order.user_id].update(get_order_count_fields(to_status, order.is_show, order.is_delete))
+        # 同步模型对象的计数状态，避免之后再调用save()时重复计数
+        order._count_state = get_order_count_fields(to_status, order.is_show, order.is_delete)
+    order_id_list = [order.id for order in order_list]
+
+    def on_commit():
+        for user_id, delta in count_delta.items():
+            update_order_counts(user_id, delta)
+        if from_status == 0:
+            remove_order_timeout(*order_id_list)
+        publish_order_status(order_list)
+
+    transaction.on_commit(on_commit)
+
+
+def transition_order(order, from_status, to_status, **fields):
+    """
+    切换订单状态：UPDATE ... WHERE id=<订单ID> AND order_status=<from_status>
+    并发的请求中只有一个能切换成功，不需要先查询再保存，也不需要长时间锁定订单
+    :param order: 订单模型对象
+    :param from_status: 切换之前的订单状态
+    :param to_status: 切换以后的订单状态
+    :param fields: 同时更新的其他字段，例如 pay_time
+    :return: 是否切换成功
+    """
+    fields["updated_time"] = datetime.now()
+    if not Order.objects.filter(pk=order.pk, order_status=from_status).update(order_status=to_status, **fields):
+        return False
+
+    order.order_status = to_status
+    for name, value in fields.items():
+        setattr(order, name, value)
+    on_orders_transitioned([order], from_status, to_status)
+    return True
+
+
+def transition_orders(order_id_list, from_status, to_status, user_id=None):
+    """
+    批量切换订单状态
+    :param order_id_list: 订单ID列表
+    :param from_status: 切换之前的订单状态
+    :param to_status: 切换以后的订单状态
+    :param user_id: 只切换指定用户的订单
+    :return: 切换成功的订单列表
+    """
+    queryset = Order.objects.filter(pk__in=order_id_list, order_status=from_status)
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+
+    # mysql的UPDATE不能返回被修改的记录，使用本次的更新时间标记被当前请求切换成功的订单
+    now_time = datetime.now()
+    with transaction.atomic():
+        if not queryset.update(order_status=to_status, updated_time=now_time):
+            return []
+        order_list = list(Order.objects.filter(pk__in=order_id_list, order_status=to_status, updated_time=now_time).only(
+            "id", "user_id", "order_number", "credit", "order_status", "is_show", "is_delete"))
+        on_orders_transitioned(order_list, from_status, to_status)
+    return order_list
+
+
+def cancel_unpaid_orders(order_id_list, order_status=3, user_id=None):
+    """
+    批量取消未支付的订单，并归还订单中使用的积分和优惠券
+    :param order_id_list: 订单ID列表
+    :param order_status: 取消以后的订单状态，默认为超时
+    :param user_id: 只取消指定用户的订单
+    :return: 实际取消的订单数量
+    """
+    with transaction.atomic():
+        # 只处理仍然是未支付状态的订单，已经支付或取消的订单直接跳过
+        order_list = transition_orders(order_id_list, 0, order_status, user_id=user_id)
+        if not order_list:
+            return 0
+        order_id_list = [order.id for order in order_list]
+
+        # 1. 归还订单中使用的积分，一条SQL语句归还所有用户的积分并记录积分流水
+        change_credits([
+            Credit(user_id=order.user_id, number=order.credit, operation=1, remark=f"订单{order.order_number}取消，归还抵扣的积分")
+            for order in order_list if order.credit and order.credit > 0
+        ])
+
+        # 2. 归还订单中使用的优惠券
+        coupon_log_list = list(CouponLog.objects.filter(order_id__in=order_id_list).select_related("user", "coupon"))
+        if coupon_log_list:
+            CouponLog.objects.filter(pk__in=[log.id for log in coupon_log_list]).update(
+                order=None, use_time=None, use_status=0)
+            transaction.on_commit(lambda: [add_coupon_to_redis(coupon_log) for coupon_log in coupon_log_list])
+
+    return len(order_list)
+
+
+def get_stale_order_ids(size=constants.ORDER_SWEEP_SIZE):
+    """
+    查询已经过期但是仍然未支付的订单[redis数据丢失或者延时队列中的订单已经被取出但是没有处理完成]
+    :return: 订单ID列表
+    """
+    expire_time = datetime.now() - timedelta(seconds=constants.ORDER_TIMEOUT + constants.ORDER_SWEEP_DELAY)
+    return list(Order.objects.filter(order_status=0, created_time__lt=expire_time).order_by(
+        "created_time").values_list("id", flat=True)[:size])
+
+
+class OrderNumberAllocator(object):
+    """
+    订单号序列的分段分配器
+    每个进程每次从redis中预留一段序列号[INCRBY]，在进程内存中依次分配，用完以后再预留下一段，
+    redis不可用时，使用基于时间戳、节点编号的雪花算法生成相同位数的序列号
+    """
+
+    def __init__(self, key="order_number", block_size=constants.ORDER_NUMBER_BLOCK_SIZE, node_id=None):
+        self.key = key
+        self.block_size = block_size
+        # 节点编号[0~9]，每台服务器[容器]单独配置，多个节点同时使用雪花算法时不会生成相同的序列号
+        self.node_id = node_id
+        self.lock = threading.Lock()
+        self.pid = None
+        self.current = 0
+        self.end = 0
+        # 雪花算法上一次使用的时间戳[单位: 10毫秒]
+        self.last_cs = 0
+
+    def get_node_id(self):
+        if self.node_id is None:
+            self.node_id = int(getattr(settings, "ORDER_NUMBER_NODE_ID", 0)) % 10
+        return self.node_id
+
+    def reserve_block(self):
+        """从redis中预留一段序列号"""
+        redis = get_redis_connection("cart")
+        self.end = redis.incrby(self.key, self.block_size)
+        self.current = self.end - self.block_size
+
+    def next_snowflake(self):
+        """
+        redis不可用时的序列号：当天的时间戳[单位: 10毫秒](7位) + 节点编号(1位)，与正常的序列号一样是8位，
+        同一个10毫秒内的下一个序列号使用下一个时间戳，进程内的序列号不会重复，
+        同一个节点的多个进程在同一个10毫秒内为同一个用户生成的重复订单号，由创建订单时的唯一约束重试处理
+        """
+        now_cs = int(time.time() * 100)
+        self.last_cs = max(now_cs, self.last_cs + 1)
+        cs_of_day = (self.last_cs + time.localtime().tm_gmtoff * 100) % 8640000
+        return "%07d%d" % (cs_of_day, self.get_node_id())
+
+    def next(self):
+        """获取下一个序列号"""
+        with self.lock:
+            # fork出来的子进程会继承父进程的序列号段，必须重新预留，否则会生成重复的订单号
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.current = self.end = 0
+
+            if self.current >= self.end:
+                try:
+                    self.reserve_block()
+                except RedisError as e:
+                    logger.warning(f"预留订单号序列失败，使用雪花算法生成订单号！{e}")
+                    return self.next_snowflake()
+
+            self.current += 1
+            return "%08d" % (self.current % 100000000)
+
+
+order_number_allocator = OrderNumberAllocator()
+
+
+def generate_order_number(user_id):
+    """
+    生成唯一订单号：日期(8位) + 用户ID(8位) + 序列号(8位)
+    """
+    return time.strftime("%Y%m%d") + ("%08d" % user_id) + order_number_allocator.next()
+
+
+def build_order_snapshot(order, detail_list, user_coupon=None):
+    """
+    生成订单快照，格式与订单列表接口中的 order_courses 和 coupon 字段一致
+    :param order: 订单模型对象
+    :param detail_list: 订单详情模型对象列表
+    :param user_coupon: 本次下单使用的优惠券发放记录
+    """
+    # mysql批量添加数据以后不会返回主键，需要重新查询
+    if any(detail.pk is None for detail in detail_list):
+        detail_id_dict = dict(OrderDetail.objects.filter(order=order).values_list("course_id", "id"))
+        for detail in detail_list:
+            detail.pk = detail_id_dict.get(detail.course_id)
+
+    coupon = {}
+    if user_coupon:
+        coupon = {
+            "id": user_coupon.coupon.id,
+            "name": user_coupon.coupon.name,
+            "sale": user_coupon.coupon.sale,
+            "discount": user_coupon.coupon.discount,
+            "condition": user_coupon.coupon.condition,
+        }
+
+    return {
+        "order_courses": [{
+            "id": detail.pk,
+            "price": str(detail.price),
+            "real_price": str(detail.real_price),
+            "discount_name": detail.discount_name,
+            "course_id": detail.course.id,
+            "course_name": detail.course.name,
+            # 保存图片的相对地址，序列化时再转换成完整地址
+            "course_cover": detail.course.course_cover.url if detail.course.course_cover else None,
+        } for detail in detail_list],
+        "coupon": coupon,
+    }
+
+
+def get_cart_selected_course_ids(user_id):
+    """获取用户购物车中勾选的课程ID列表"""
+    # 在redis服务端拆分勾选与不勾选的商品，只返回课程ID
+    selected_list, unselected_list = split_cart_courses(user_id)
+    return selected_list
+
+
+def create_order(user, pay_type, user_coupon_id=-1, use_credit=0, order_number=None, course_id_list=None):
+    """
+    创建订单
+    :param user: 下单用户
+    :param pay_type: 支付方式
+    :param user_coupon_id: 本次下单使用的优惠券发放记录ID，-1 为不使用优惠券
+    :param use_credit: 本次下单使用的积分数量
+    :param order_number: 订单号，默认自动生成
+    :param course_id_list: 下单的课程ID列表，默认为购物车中勾选的课程
+    :return: 订单模型对象
+    """
+    user_id = user.id  # 用户id
+
+    # 本次下单时，用户使用的优惠券
+    user_coupon = None
+
+    # -1 为不使用优惠券
+    if user_coupon_id != -1:
+        user_coupon = CouponLog.objects.filter(pk=user_coupon_id, user_id=user_id).first()
+
+    # 如果本次下单用户使用了抵扣积分，并且抵扣的积分数量 > 用户拥有的积分数量，则报错。
+    if use_credit > 0 and use_credit > user.credit:
+        raise serializers.ValidationError(detail="您拥有的积分不足以抵扣本次下单的积分，请重新下单！", code="credit")
+
+    # 唯一订单号[基于时间、用户ID、随机数]
+    # order_number = datetime.now().strftime("%Y%m%d%H%M%S") + ("%08d" % user_id) + "%08d" % random.randint(1,99999999)
+    # 基于redis分段预留的序列号生成分布式唯一订单号[排队下单时，订单号在入队时已经生成]
+    order_number_retries = 0
+    if order_number is None:
+        order_number = generate_order_number(user_id)
+        # 自动生成的订单号重复时[redis不可用时多个进程生成了相同的订单号]，重新生成订单号
+        order_number_retries = constants.ORDER_NUMBER_RETRIES
+    # 开启事务操作
+    with transaction.atomic():
+        # 设置事务的回滚点标记
+        t1 = transaction.savepoint()
+        try:
+            # 创建订单基本信息的记录
+            while True:
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(
+                            name="课程购买",  # 订单标题
+                            user_id=user_id,  # 用户ID
+                            total_price=0,  # 订单总价，先默认为0，后面计算了所有的课程价格以后。累加得出
+                            real_price=0,  # 订单实价，先默认为0，后面计算了所有的课程价格以后。累加得出
+                            order_number=order_number,  # 订单号
+                            pay_type=pay_type,  # 支付方式
+                        )
+                    break
+                except IntegrityError:
+                    if order_number_retries <= 0:
+                        raise
+                    order_number_retries -= 1
+                    order_number = generate_order_number(user_id)
+
+            # 记录本次下单的商品列表[排队下单时，商品列表在入队时已经从购物车中读取]
+            if course_id_list is None:
+                course_id_list = get_cart_selected_course_ids(user_id)
+            if len(course_id_list) < 1:
+                raise serializers.ValidationError(detail="购物车中没有商品")
+
+            # 添加订单与课程的关系
+            course_list = Course.objects.filter(pk__in=course_id_list, is_delete=False, is_show=True).all()
+            # 批量计算课程的优惠信息
+            course_list = prefetch_course_discount(course_list)
+
+            detail_list = []  # 订单详情的模型列表[避免出现在循环中执行IO操作]
+            total_price = Decimal(0)  # 订单总价
+            real_price = Decimal(0)  # 订单实价
+
+            total_discount_price = Decimal(0)
+            max_discount_course = None  # 享受最大优惠的课程
+
+            # 本次下单最多可以抵扣的积分
+            max_use_credit = 0
+
+            for course in course_list:
+                discount = course.discount
+                # 判断商品课程是否有优惠，有就记录优惠类型
+                discount_name = discount.get("type", "")
+                # 判断商品课程是否有优惠价格，没有优惠价格则按原价计算
+                if "price" in discount:
+                    discount_price = Decimal(f'{discount["price"]:.2f}')
+                else:
+                    discount_price = course.price
+
+                detail_list.append(OrderDetail(
+                    order=order,
+                    course=course,
+                    name=course.name,
+                    price=course.price,  # 原价
+                    real_price=discount_price,
+                    discount_name=discount_name,
+                ))
+
+                # 统计订单的总价和实付价格
+                total_price += course.price
+                real_price += discount_price
+
+                # 在用户使用了优惠券，并且当前课程没有参与其他优惠活动时，找到最佳优惠课程
+                if user_coupon and "price" not in discount:
+                    if max_discount_course is None:
+                        max_discount_course = course
+                    else:
+                        if course.price >= max_discount_course.price:
+                            max_discount_course = course
+
+                # 添加每个课程的可用积分
+                if use_credit > 0:
+                    max_use_credit += course.credit
+
+            # 在用户使用了优惠券以后，根据循环中得到的最佳优惠课程进行计算最终抵扣金额
+            if user_coupon:
+                # 编译好的优惠公式
+                rule = user_coupon.coupon.rule
+                if user_coupon.coupon.discount == 1:
+                    """减免优惠券"""
+                    total_discount_price += rule.operand
+                elif user_coupon.coupon.discount == 2 and max_discount_course:
+                    """折扣优惠券"""
+                    total_discount_price += rule.reduction(max_discount_course.price)
+
+            # 在用户使用了积分抵扣以后
+            if use_credit > 0:
+                # 如果本次下单最大可用积分数量 < 用户提交的抵扣数量，则报错
+                if max_use_credit < use_credit:
+                    raise serializers.ValidationError(detail="本次使用的抵扣积分数额超过了限制！")
+
+                # 当前订单添加积分抵扣的数量
+                order.credit = use_credit
+                total_discount_price += Decimal(use_credit) / constants.CREDIT_TO_MONEY
+
+                # 扣除用户拥有的积分并记录积分流水[只更新积分字段，积分不足时抛出异常]，
+                # 后续在订单超时未支付或用户取消下单时，则返还订单中对应数量的积分给用户。
+                change_credit(user_id, -use_credit, operation=1, remark=f"订单{order_number}使用积分抵扣")
+                user.credit -= use_credit
+
+            # 一次性批量添加本次下单的商品记录
+            OrderDetail.objects.bulk_create(detail_list)
+
+            # 记录订单快照
+            order.snapshot = build_order_snapshot(order, detail_list, user_coupon)
+
+            # 保存订单的总价格和实付价格
+            order.total_price = total_price
+            order.real_price = max(real_price - total_discount_price, Decimal(0)).quantize(PRICE_PRECISION)
+            order.save()
+
+            # 从购物车中删除本次下单的商品，没有被勾选的商品继续保留在购物车中
+            delete_cart_courses(user_id, course_id_list)
+
+            # 如果有使用了优惠券，则把优惠券和当前订单进行绑定
+            if user_coupon:
+                redis = get_redis_connection("coupon")
+                user_coupon.order = order
+                user_coupon.use_time = order.updated_time
+                user_coupon.use_status = 1
+                user_coupon.save()
+                # 把优惠券从redis中移除
+                redis.delete(f"{user_id}:{user_coupon_id}")
+
+                # 将来订单状态发生改变，再修改优惠券的使用状态，如果订单过期，则再次还原优惠券到redis中
+
+            # 事务提交以后，把订单添加到超时取消的延时队列中
+            transaction.on_commit(lambda: add_order_timeout(order.id))
+
+            return order
+
+        except serializers.ValidationError:
+            # 下单数据验证失败[购物车为空、积分超过限制等]，事务回滚以后把具体的错误原因返回客户端
+            transaction.savepoint_rollback(t1)
+            raise
+        except Exception as e:
+            # 1. 事务回滚
+            transaction.savepoint_rollback(t1)
+            # 2. 日志记录
+            logger.error(f"生成订单失败！{e}")
+            # 3. 抛出异常
+            raise serializers.ValidationError(detail="生成订单失败！")
+
+
+def enqueue_order(user, pay_type, user_coupon_id=-1, use_credit=0):
+    """
+    排队下单：只做不需要查询数据库的验证，生成订单号以后把下单请求放入队列，由后台任务批量创建订单
+    :return: 订单号
+    """
+    if use_credit > 0 and use_credit > user.credit:
+        raise serializers.ValidationError(detail="您拥有的积分不足以抵扣本次下单的积分，请重新下单！", code="credit")
+
+    # 入队时读取购物车中勾选的商品，避免排队期间购物车发生变化
+    course_id_list = get_cart_selected_course_ids(user.id)
+    if len(course_id_list) < 1:
+        raise serializers.ValidationError(detail="购物车中没有商品")
+
+    order_number = generate_order_number(user.id)
+    payload = json.dumps({
+        "order_number": order_number,
+        "user_id": user.id,
+        "pay_type": pay_type,
+        "user_coupon_id": user_coupon_id,
+        "use_credit": use_credit,
+        "course_id_list": course_id_list,
+    })
+
+    redis = get_redis_connection("default")
+    status_key = f"{constants.ORDER_QUEUE_STATUS_KEY}:{order_number}"
+    pipe = redis.pipeline()
+    pipe.hset(status_key, mapping={"status": "pending", "user_id": user.id})
+    pipe.expire(status_key, constants.ORDER_QUEUE_STATUS_TIME)
+    pipe.rpush(constants.ORDER_QUEUE_KEY, payload)
+    pipe.execute()
+    return order_number
+
+
+def acquire_order_queue_trigger():
+    """下单接口入队以后触发后台任务，短时间内只触发一次，避免每个请求都投递一个任务"""
+    redis = get_redis_connection("default")
+    return bool(redis.set(constants.ORDER_QUEUE_TRIGGER_KEY, 1, nx=True, px=constants.ORDER_QUEUE_TRIGGER_TIME))
+
+
+def get_order_queue_status(order_number):
+    """
+    获取排队下单的处理结果
+    :return: 字典 {"status": pending/success/fail, "user_id": 用户ID, "order_id": 订单ID, "errmsg": 失败原因}
+    """
+    redis = get_redis_connection("default")
+    data = redis.hgetall(f"{constants.ORDER_QUEUE_STATUS_KEY}:{order_number}")
+    return {key.decode(): value.decode() for key, value in data.items()}
+
+
+def set_order_queue_status(order_number, **data):
+    redis = get_redis_connection("default")
+    redis.hset(f"{constants.ORDER_QUEUE_STATUS_KEY}:{order_number}", mapping=data)
+
+
+def claim_order_queue(size=constants.ORDER_QUEUE_BATCH_SIZE):
+    """
+    从下单队列中取出一批下单请求，取出的请求同时放入处理中的zset，
+    订单创建完成以后调用 ack_order_queue 确认，进程异常退出时由 requeue_stale_order_queue 重新放回队列
+    :return: [(原始请求数据, 解析以后的请求数据), ...]
+    """
+    global _claim_order_queue_script
+    redis = get_redis_connection("default")
+    if _claim_order_queue_script is None:
+        _claim_order_queue_script = redis.register_script(CLAIM_ORDER_QUEUE_SCRIPT)
+    deadline = time.time() + constants.ORDER_QUEUE_PROCESSING_TIMEOUT
+    payload_list = _claim_order_queue_script(
+        keys=[constants.ORDER_QUEUE_KEY, constants.ORDER_QUEUE_PROCESSING_KEY], args=[size, deadline])
+    return [(payload, json.loads(payload)) for payload in payload_list]
+
+
+def extend_order_queue(payload_list):
+    """延长正在处理的下单请求的处理超时时间，已经被重新放回队列的请求不再加入处理中的zset"""
+    if not payload_list:
+        return
+    redis = get_redis_connection("default")
+    deadline = time.time() + constants.ORDER_QUEUE_PROCESSING_TIMEOUT
+    redis.zadd(constants.ORDER_QUEUE_PROCESSING_KEY, {payload: deadline for payload in payload_list}, xx=True)
+
+
+def ack_order_queue(payload):
+    """确认下单请求已经处理完成[订单已经创建或者已经确定失败]"""
+    redis = get_redis_connection("default")
+    redis.zrem(constants.ORDER_QUEUE_PROCESSING_KEY, payload)
+
+
+def requeue_stale_order_queue(size=constants.ORDER_QUEUE_BATCH_SIZE):
+    """
+    把处理超时仍未确认的下单请求重新放回下单队列[重复投递的请求会根据订单号跳过，不会重复创建订单]
+    :return: 重新放回队列的请求数量
+    """
+    global _requeue_order_queue_script
+    redis = get_redis_connection("default")
+    if _requeue_order_queue_script is None:
+        _requeue_order_queue_script = redis.register_script(REQUEUE_ORDER_QUEUE_SCRIPT)
+    return _requeue_order_queue_script(
+        keys=[constants.ORDER_QUEUE_KEY, constants.ORDER_QUEUE_PROCESSING_KEY], args=[time.time(), size])
+
+
+def process_order_queue(size=constants.ORDER_QUEUE_BATCH_SIZE):
+    """
+    从下单队列中取出一批下单请求并创建订单
+    :return: 本次处理的下单请求数量
+    """
+    claimed_list = claim_order_queue(size)
+    if not claimed_list:
+        return 0
+    payload_list = [payload for _, payload in claimed_list]
+
+    # 一次性查询本批次的所有用户，已经创建的订单[重复投递的请求]直接跳过
+    user_dict = User.objects.in_bulk({payload["user_id"] for payload in payload_list})
+    exists_order_dict = dict(Order.objects.filter(
+        order_number__in=[payload["order_number"] for payload in payload_list]).values_list("order_number", "id"))
+
+    # 处理超时时间是按照批次设置的，处理过半时延长本批次剩余请求的超时时间，避免处理较慢的批次在处理期间被重新投递
+    extend_time = time.time() + constants.ORDER_QUEUE_PROCESSING_TIMEOUT / 2
+    for index, (raw_payload, payload) in enumerate(claimed_list):
+        if time.time() >= extend_time:
+            extend_order_queue([raw_payload for raw_payload, _ in claimed_list[index:]])
+            extend_time = time.time() + constants.ORDER_QUEUE_PROCESSING_TIMEOUT / 2
+
+        order_number = payload["order_number"]
+        if order_number in exists_order_dict:
+            set_order_queue_status(order_number, status="success", order_id=exists_order_dict[order_number])
+            ack_order_queue(raw_payload)
+            continue
+
+        try:
+            order = create_order(
+                user_dict[payload["user_id"]],
+                pay_type=payload["pay_type"],
+                user_coupon_id=payload["user_coupon_id"],
+                use_credit=payload["use_credit"],
+                order_number=order_number,
+                course_id_list=payload["course_id_list"],
+            )
+        except Exception as e:
+            # 重复投递的请求已经由其他进程创建了订单[订单号唯一约束冲突]，按照下单成功处理
+            order_id = Order.objects.filter(order_number=order_number).values_list("id", flat=True).first()
+            if order_id is not None:
+                set_order_queue_status(order_number, status="success", order_id=order_id)
+                ack_order_queue(raw_payload)
+                continue
+            errmsg = e.detail[0] if isinstance(e, serializers.ValidationError) else "生成订单失败！"
+            set_order_queue_status(order_number, status="fail", errmsg=str(errmsg))
+            ack_order_queue(raw_payload)
+            continue
+
+        # 订单事务已经提交，才从处理中的zset删除
+        set_order_queue_status(order_number, status="success", order_id=order.id)
+        ack_order_queue(raw_payload)
+
+    return len(claimed_list)
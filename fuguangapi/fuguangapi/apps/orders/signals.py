@@ -0,0 +1,48 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Order
+from .services import get_order_count_fields, update_order_counts, delete_order_counts
+
+# 订单中影响用户订单数量的字段
+COUNT_FIELDS = ("order_status", "is_show", "is_delete")
+
+
+def get_count_state(instance):
+    """订单当前的计数状态，字段没有被加载时返回None[例如使用了only()查询]"""
+    if any(field not in instance.__dict__ for field in COUNT_FIELDS):
+        return None
+    return get_order_count_fields(instance.order_status, instance.is_show, instance.is_delete)
+
+
+@receiver(post_init, sender=Order)
+def order_loaded(sender, instance, **kwargs):
+    """记录订单加载时的计数状态，保存时与新的状态比较"""
+    instance._count_state = get_count_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    """订单创建或状态发生变化以后，增量更新用户的订单数量"""
+    old_state = None if created else instance._count_state
+    new_state = get_count_state(instance)
+    instance._count_state = new_state
+    user_id = instance.user_id
+
+    if not created and (old_state is None or new_state is None):
+        # 无法确定订单保存之前的状态，删除用户的订单数量，下次查询时重新统计
+        transaction.on_commit(lambda: delete_order_counts(user_id))
+        return
+
+    delta = Counter(new_state)
+    delta.subtract(old_state or {})
+    transaction.on_commit(lambda: update_order_counts(user_id, delta))
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: delete_order_counts(user_id))
@@ -1,44 +1,74 @@
 import logging
 
 from celery import shared_task
-from django.db import transaction
 
-from coupon.services import add_coupon_to_redis
-from .models import Order
+from .services import cancel_unpaid_orders, pop_timeout_orders, get_stale_order_ids, process_order_queue
+from .services import reconcile_order_counts, requeue_stale_order_queue
 
 logger = logging.getLogger('django')
 
 
 @shared_task(name="order_timeout")
 def order_timeout(order_id):
+    """
+    取消单个超时订单
+    新订单已经改用延时队列[sweep_timeout_orders]处理，保留当前任务用于处理升级之前已经投递的任务
+    """
     try:
-        order = Order.objects.get(pk=order_id)
+        total = cancel_unpaid_orders([order_id])
     except Exception as e:
-        logger.warning(f"订单不存在！order_id:{order_id}: {e}")
-        return
-
-    if order.order_status == 0:
-        """只针对未支付的订单进行超时取消"""
-        with transaction.atomic():
-            save_id = transaction.savepoint()
-            try:
-                # 1. 查询当前订单是否使用了积分，如果有则恢复
-                if order.credit > 0:
-                    order.user.credit += order.credit
-                    order.user.save()
-
-                # 2. 查询当前订单是否使用了优惠券，如果有则恢复
-                obj = order.to_coupon.first()
-                if obj:
-                    add_coupon_to_redis(obj)
-
-                # 3. 切换当前订单为取消状态
-                order.order_status = 3
-                order.save()
-
-                return {"order_id": order.id, "status": True, "errmsg": f"订单超时取消成功！"}
-
-            except Exception as e:
-                transaction.savepoint_rollback(save_id)
-                logger.warning(f"过期订单无法处理！order_id:{order_id}: {e}")
-                return {"order_id": order.id, "status": False, "errmsg": f"{e}"}
+        logger.warning(f"过期订单无法处理！order_id:{order_id}: {e}")
+        return {"order_id": order_id, "status": False, "errmsg": f"{e}"}
+    return {"order_id": order_id, "status": bool(total), "errmsg": "订单超时取消成功！" if total else "订单无需取消！"}
+
+
+@shared_task(name="sweep_timeout_orders")
+def sweep_timeout_orders(max_batches=20):
+    """
+    定时任务：从延时队列中分批取出已经过期的订单并取消
+    最后再从数据库中兜底查询一批过期未处理的订单[redis数据丢失或者取出以后处理失败的订单]
+    """
+    total = 0
+    for _ in range(max_batches):
+        order_id_list = pop_timeout_orders()
+        if not order_id_list:
+            break
+        try:
+            total += cancel_unpaid_orders(order_id_list)
+        except Exception as e:
+            # 处理失败的订单会由数据库兜底查询再次处理
+            logger.error(f"超时订单批量取消失败！order_id_list:{order_id_list}: {e}")
+
+    order_id_list = get_stale_order_ids()
+    if order_id_list:
+        total += cancel_unpaid_orders(order_id_list)
+
+    if total:
+        logger.info(f"超时订单取消完成！数量:{total}")
+    return total
+
+
+@shared_task(name="process_order_queue")
+def process_order_queue_task(max_batches=50):
+    """从下单队列中分批取出下单请求并创建订单，下单接口入队以后触发，同时由定时任务兜底"""
+    # 先把处理超时的下单请求[处理过程中进程异常退出]重新放回队列
+    requeued = requeue_stale_order_queue()
+    if requeued:
+        logger.warning(f"下单请求处理超时，重新放回下单队列！数量:{requeued}")
+
+    total = 0
+    for _ in range(max_batches):
+        count = process_order_queue()
+        if not count:
+            break
+        total += count
+    return total
+
+
+@shared_task(name="reconcile_order_counts")
+def reconcile_order_counts_task():
+    """定时任务：用数据库中的订单数量修正redis中的用户订单数量"""
+    fixed = reconcile_order_counts()
+    if fixed:
+        logger.info(f"用户订单数量对账完成！修正数量:{fixed}")
+    return fixed
@@ -1 +1,443 @@
-# Create your tests here.
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from unittest import mock
+
+from django.utils import timezone as datetime
+from django_redis import get_redis_connection
+from redis.exceptions import ConnectionError
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+import constants
+from coupon.models import Coupon, CouponLog
+from courses.models import Course
+from .models import Order, OrderDetail
+from .services import get_order_counts, add_order_timeout, reconcile_order_counts, OrderNumberAllocator, create_order as create_order_service
+from .services import cancel_unpaid_orders, transition_order, count_user_orders
+from .services import enqueue_order, claim_order_queue, get_order_queue_status, process_order_queue
+from .tasks import sweep_timeout_orders, process_order_queue_task
+from .views import OrderStatusStreamAPIView
+
+ORDER_LIST_URL = "/orders/list/"
+
+
+def create_order(user, order_status=0, **params):
+    return Order.objects.create(name="测试订单", user=user, order_number=f"{Order.objects.count() + 1}",
+                                order_status=order_status, **params)
+
+
+class OrderCountTestCase(TestCase):
+    """用户订单数量的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        create_order(self.user, 0)
+        create_order(self.user, 1)
+        create_order(self.user, 1, is_show=False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_counts_from_database(self):
+        """测试redis中没有数量时从数据库统计"""
+        counts = get_order_counts(self.user.id)
+        self.assertEqual({"all": 2, "0": 1, "1": 1, "2": 0, "3": 0, "4": 0}, counts)
+
+    def test_incremental_update(self):
+        """测试订单创建和状态变化时增量更新数量"""
+        get_order_counts(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = create_order(self.user, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.order_status = 2
+            order.save()
+        self.assertEqual({"all": 3, "0": 1, "1": 1, "2": 1, "3": 0, "4": 0}, get_order_counts(self.user.id))
+
+    def test_order_list_count(self):
+        """测试订单列表的总数从redis中读取"""
+        get_order_counts(self.user.id)
+        response = self.client.get(ORDER_LIST_URL, {"order_status": 1})
+        self.assertEqual(1, response.data["count"])
+
+        # 直接修改数据库不会更新redis中的数量
+        Order.objects.filter(user=self.user).update(order_status=1)
+        response = self.client.get(ORDER_LIST_URL, {"order_status": 1})
+        self.assertEqual(1, response.data["count"])
+
+    def test_order_count_api(self):
+        """测试订单数量接口"""
+        response = self.client.get("/orders/counts/")
+        self.assertEqual({"all": 2, "0": 1, "1": 1, "2": 0, "3": 0, "4": 0}, response.data)
+
+    def test_reconcile(self):
+        """测试对账修正redis中的订单数量"""
+        get_order_counts(self.user.id)
+        Order.objects.filter(user=self.user).update(order_status=1)
+        self.assertEqual(1, reconcile_order_counts())
+        self.assertEqual({"all": 2, "0": 0, "1": 2, "2": 0, "3": 0, "4": 0}, get_order_counts(self.user.id))
+        self.assertEqual(0, reconcile_order_counts())
+        # 修正以后保留原有的有效期
+        self.assertGreater(get_redis_connection("default").ttl(f"{constants.ORDER_COUNT_KEY}:{self.user.id}"), 0)
+
+    def test_reconcile_expired_counts(self):
+        """测试对账期间已经过期的订单数量不会被重新创建"""
+        get_order_counts(self.user.id)
+        key = f"{constants.ORDER_COUNT_KEY}:{self.user.id}"
+        redis = get_redis_connection("default")
+        Order.objects.filter(user=self.user).update(order_status=1)
+
+        def count_after_expired(user_id_list):
+            # 模拟读取redis中的数量以后，数量过期
+            redis.delete(key)
+            return count_user_orders(user_id_list)
+
+        with mock.patch("orders.services.count_user_orders", side_effect=count_after_expired):
+            self.assertEqual(1, reconcile_order_counts())
+        self.assertFalse(redis.exists(key))
+
+
+class OrderTimeoutTestCase(TestCase):
+    """超时订单延时队列的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        get_redis_connection("coupon").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        now_time = datetime.now()
+        coupon = Coupon.objects.create(name="满减券", sale="-10", start_time=now_time - timedelta(days=1),
+                                       end_time=now_time + timedelta(days=1))
+        self.order = create_order(self.user, 0, credit=50)
+        self.coupon_log = CouponLog.objects.create(name="满减券", user=self.user, coupon=coupon, order=self.order,
+                                                   use_status=1, use_time=now_time)
+        self.paid_order = create_order(self.user, 1)
+
+    def test_sweep_timeout_orders(self):
+        """测试过期订单被取消，并归还积分和优惠券"""
+        add_order_timeout(self.order.id, timeout=-1)
+        add_order_timeout(self.paid_order.id, timeout=-1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(1, sweep_timeout_orders())
+
+        self.order.refresh_from_db()
+        self.paid_order.refresh_from_db()
+        self.user.refresh_from_db()
+        self.coupon_log.refresh_from_db()
+        self.assertEqual(3, self.order.order_status)
+        self.assertEqual(1, self.paid_order.order_status)
+        self.assertEqual(50, self.user.credit)
+        self.assertIsNone(self.coupon_log.order_id)
+        self.assertEqual(0, self.coupon_log.use_status)
+        self.assertTrue(get_redis_connection("coupon").exists(f"{self.user.id}:{self.coupon_log.id}"))
+        self.assertEqual(0, get_redis_connection("default").zcard(constants.ORDER_TIMEOUT_KEY))
+
+    def test_not_expired(self):
+        """测试没有过期的订单不会被取消"""
+        add_order_timeout(self.order.id)
+        self.assertEqual(0, sweep_timeout_orders())
+        self.assertEqual(1, get_redis_connection("default").zcard(constants.ORDER_TIMEOUT_KEY))
+
+    def test_timeout_after_paid(self):
+        """测试订单支付以后，超时取消的条件更新不会生效，积分和优惠券不会被归还"""
+        add_order_timeout(self.order.id, timeout=-1)
+        self.assertTrue(transition_order(self.order, 0, 1, pay_time=datetime.now()))
+        self.assertFalse(transition_order(self.order, 0, 1, pay_time=datetime.now()))
+        self.assertEqual(0, cancel_unpaid_orders([self.order.id]))
+
+        self.order.refresh_from_db()
+        self.user.refresh_from_db()
+        self.coupon_log.refresh_from_db()
+        self.assertEqual(1, self.order.order_status)
+        self.assertEqual(0, self.user.credit)
+        self.assertEqual(self.order.id, self.coupon_log.order_id)
+
+    def test_cancel_other_user_order(self):
+        """测试不能取消其他用户的订单"""
+        self.assertEqual(0, cancel_unpaid_orders([self.order.id], order_status=2, user_id=self.user.id + 1))
+        self.assertEqual(1, cancel_unpaid_orders([self.order.id], order_status=2, user_id=self.user.id))
+        self.order.refresh_from_db()
+        self.assertEqual(2, self.order.order_status)
+
+
+class OrderNumberTestCase(TestCase):
+    """订单号分段分配的测试集"""
+
+    def setUp(self):
+        get_redis_connection("cart").flushall()
+
+    def test_reserve_block(self):
+        """测试每个分段只访问一次redis，多个分配器之间的序列号不重复"""
+        allocator = OrderNumberAllocator(block_size=10)
+        other = OrderNumberAllocator(block_size=10)
+        number_list = [allocator.next() for _ in range(5)] + [other.next() for _ in range(5)]
+        number_list += [allocator.next() for _ in range(10)]
+        self.assertEqual(len(number_list), len(set(number_list)))
+        self.assertEqual("00000001", number_list[0])
+        self.assertEqual("00000011", number_list[5])
+        self.assertEqual(b"30", get_redis_connection("cart").get("order_number"))
+
+    def test_snowflake_fallback(self):
+        """测试redis不可用时使用雪花算法生成序列号"""
+        allocator = OrderNumberAllocator()
+        with mock.patch.object(allocator, "reserve_block", side_effect=ConnectionError):
+            number_list = [allocator.next() for _ in range(300)]
+        self.assertEqual(300, len(set(number_list)))
+        self.assertEqual(number_list, sorted(number_list))
+        # 与正常的序列号位数相同，最后一位是节点编号
+        self.assertEqual({8}, {len(number) for number in number_list})
+        self.assertEqual({"0"}, {number[-1] for number in number_list})
+
+        other = OrderNumberAllocator(node_id=1)
+        with mock.patch.object(other, "reserve_block", side_effect=ConnectionError):
+            self.assertEqual("1", other.next()[-1])
+
+    def test_duplicate_order_number(self):
+        """测试自动生成的订单号重复时，重新生成订单号"""
+        user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        course = Course.objects.create(name="python入门", price=100)
+        create_order(user)
+        with mock.patch("orders.services.generate_order_number", side_effect=["1", "2"]):
+            order = create_order_service(user, pay_type=0, course_id_list=[course.id])
+        self.assertEqual("2", order.order_number)
+
+
+class OrderQueueTestCase(TestCase):
+    """排队下单的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        get_redis_connection("cart").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.course = Course.objects.create(name="python入门", price=100)
+        get_redis_connection("cart").hset(f"cart_{self.user.id}", self.course.id, 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_queue_order(self):
+        """测试排队下单以后由后台任务创建订单"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/orders/queue/", {"pay_type": 0}, format="json")
+        self.assertEqual(202, response.status_code)
+        order_number = response.data["order_number"]
+
+        response = self.client.get(f"/orders/queue/{order_number}/")
+        self.assertEqual("success", response.data["status"])
+        order = Order.objects.get(order_number=order_number)
+        self.assertEqual(order.id, response.data["order_id"])
+        self.assertEqual(100, order.real_price)
+        self.assertFalse(get_redis_connection("cart").hexists(f"cart_{self.user.id}", self.course.id))
+
+    def test_empty_cart(self):
+        """测试购物车为空时直接返回错误，不进入队列"""
+        get_redis_connection("cart").delete(f"cart_{self.user.id}")
+        response = self.client.post("/orders/queue/", {"pay_type": 0}, format="json")
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(0, get_redis_connection("default").llen(constants.ORDER_QUEUE_KEY))
+
+    def test_requeue_stale_request(self):
+        """测试取出以后没有确认的下单请求，处理超时以后重新放回队列并创建订单"""
+        redis = get_redis_connection("default")
+        order_number = enqueue_order(self.user, 0)
+        # 模拟进程取出下单请求以后异常退出
+        payload, _ = claim_order_queue()[0]
+        self.assertEqual(1, redis.zcard(constants.ORDER_QUEUE_PROCESSING_KEY))
+        self.assertEqual(0, process_order_queue_task())
+        self.assertFalse(Order.objects.filter(order_number=order_number).exists())
+
+        redis.zadd(constants.ORDER_QUEUE_PROCESSING_KEY, {payload: 0})
+        self.assertEqual(1, process_order_queue_task())
+        self.assertTrue(Order.objects.filter(order_number=order_number).exists())
+        self.assertEqual(0, redis.zcard(constants.ORDER_QUEUE_PROCESSING_KEY))
+        self.assertEqual("success", get_order_queue_status(order_number)["status"])
+
+    def test_duplicate_delivery(self):
+        """测试重复投递的请求在处理期间已经由其他进程创建了订单，按照下单成功处理"""
+        order_number = enqueue_order(self.user, 0)
+
+        def create_order_twice(*args, **kwargs):
+            # 模拟其他进程在本批次查询已经创建的订单之后创建了订单，本次创建时订单号唯一约束冲突
+            create_order_service(*args, **kwargs)
+            return create_order_service(*args, **kwargs)
+
+        with mock.patch("orders.services.create_order", side_effect=create_order_twice):
+            self.assertEqual(1, process_order_queue_task())
+        status = get_order_queue_status(order_number)
+        self.assertEqual("success", status["status"])
+        self.assertEqual(str(Order.objects.get(order_number=order_number).id), status["order_id"])
+        self.assertEqual(0, get_redis_connection("default").zcard(constants.ORDER_QUEUE_PROCESSING_KEY))
+
+    def test_extend_processing_deadline(self):
+        """测试处理较慢的批次在处理期间延长剩余请求的处理超时时间，不会被重新投递"""
+        redis = get_redis_connection("default")
+        for _ in range(3):
+            enqueue_order(self.user, 0)
+        now = [time.time()]
+        deadline_list = []
+
+        def slow_create_order(*args, **kwargs):
+            deadline_list.append(redis.zrange(constants.ORDER_QUEUE_PROCESSING_KEY, 0, 0, withscores=True)[0][1])
+            now[0] += constants.ORDER_QUEUE_PROCESSING_TIMEOUT * 2 / 3
+            return create_order_service(*args, **kwargs)
+
+        with mock.patch("orders.services.time.time", side_effect=lambda: now[0]), \
+                mock.patch("orders.services.create_order", side_effect=slow_create_order):
+            start = now[0]
+            self.assertEqual(3, process_order_queue())
+        self.assertEqual(3, len(deadline_list))
+        # 每个请求开始处理时都还没有超时
+        for index, deadline in enumerate(deadline_list):
+            self.assertGreater(deadline, start + index * constants.ORDER_QUEUE_PROCESSING_TIMEOUT * 2 / 3)
+        self.assertEqual(3, Order.objects.count())
+
+    def test_validation_errmsg(self):
+        """测试下单数据验证失败时返回具体的错误原因"""
+        with self.assertRaisesMessage(serializers.ValidationError, "购物车中没有商品"):
+            create_order_service(self.user, pay_type=0, order_number="1", course_id_list=[])
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderIdempotencyTestCase(TestCase):
+    """下单接口携带Idempotency-Key的幂等请求的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        get_redis_connection("cart").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.course = Course.objects.create(name="python入门", price=100)
+        get_redis_connection("cart").hset(f"cart_{self.user.id}", self.course.id, 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_order(self, key):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/orders/", {"pay_type": 0}, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_duplicate_request(self):
+        """测试携带相同Idempotency-Key的重复请求只创建一个订单"""
+        response_list = [self.post_order("abc") for _ in range(2)]
+        self.assertEqual([201, 201], [response.status_code for response in response_list])
+        self.assertEqual(response_list[0].data, response_list[1].data)
+        self.assertEqual(1, Order.objects.count())
+
+        # 使用新的key重新下单时，购物车已经为空
+        self.assertEqual(400, self.post_order("def").status_code)
+
+    def test_concurrent_request(self):
+        """测试第一次请求还在处理中时，重复请求等待超时以后返回409，不会再执行一次"""
+        key = f"{constants.IDEMPOTENCY_KEY}:OrderCreateAPIView:{self.user.id}:abc"
+        # 模拟第一次请求已经抢到处理权，还没有处理完成
+        get_redis_connection("default").set(key, "")
+        with mock.patch.object(constants, "IDEMPOTENCY_WAIT_TIME", 0):
+            response = self.post_order("abc")
+        self.assertEqual(409, response.status_code)
+        self.assertFalse(Order.objects.exists())
+
+    def test_failed_request_retry(self):
+        """测试第一次请求失败以后释放key，使用相同的key重试时重新执行"""
+        get_redis_connection("cart").delete(f"cart_{self.user.id}")
+        self.assertEqual(400, self.post_order("abc").status_code)
+
+        get_redis_connection("cart").hset(f"cart_{self.user.id}", self.course.id, 1)
+        self.assertEqual(201, self.post_order("abc").status_code)
+        self.assertEqual(1, Order.objects.count())
+
+
+class OrderListTestCase(TestCase):
+    """订单列表的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        get_redis_connection("cart").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.course_list = [Course.objects.create(name=f"课程{i}", price=100) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_legacy_order(self):
+        """没有快照的历史订单"""
+        order = create_order(self.user, 0)
+        OrderDetail.objects.bulk_create([
+            OrderDetail(order=order, course=course, name=course.name, price=100, real_price=100)
+            for course in self.course_list
+        ])
+        return order
+
+    def test_snapshot(self):
+        """测试下单时记录订单快照，订单列表直接读取快照"""
+        redis = get_redis_connection("cart")
+        for course in self.course_list:
+            redis.hset(f"cart_{self.user.id}", course.id, 1)
+        order = create_order_service(self.user, pay_type=0)
+        self.assertEqual(3, len(order.snapshot["order_courses"]))
+        self.assertEqual({}, order.snapshot["coupon"])
+
+        get_order_counts(self.user.id)
+        with self.assertNumQueries(1):
+            response = self.client.get(ORDER_LIST_URL)
+        self.assertEqual(3, len(response.data["results"][0]["order_courses"]))
+        self.assertEqual("100.00", response.data["results"][0]["order_courses"][0]["real_price"])
+
+    def test_legacy_order_queries(self):
+        """测试没有快照的历史订单，查询次数与订单数量无关"""
+        self.create_legacy_order()
+        get_order_counts(self.user.id)
+        with self.assertNumQueries(3):
+            self.client.get(ORDER_LIST_URL)
+
+        for _ in range(3):
+            self.create_legacy_order()
+        get_redis_connection("default").flushall()
+        get_order_counts(self.user.id)
+        with self.assertNumQueries(3):
+            response = self.client.get(ORDER_LIST_URL)
+        self.assertEqual(3, len(response.data["results"][0]["order_courses"]))
+
+
+class OrderStatusStreamTestCase(TestCase):
+    """订单支付结果推送的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.order = create_order(self.user, 0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/orders/status/{self.order.order_number}/"
+
+    def test_push_paid(self):
+        """测试订单支付以后推送一次结果"""
+        response = self.client.get(self.url, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual("text/event-stream", response["Content-Type"])
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_order(self.order, 0, 1, pay_time=datetime.now())
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("event: status", content)
+        self.assertIn('"order_status": 1', content)
+
+    def test_finished_order(self):
+        """测试已经取消的订单直接返回结果"""
+        cancel_unpaid_orders([self.order.id], order_status=2)
+        response = self.client.get(self.url)
+        self.assertIn('"order_status": 2', b"".join(response.streaming_content).decode())
+
+    def test_other_user_order(self):
+        """测试不能等待其他用户的订单"""
+        other = get_user_model().objects.create_user(username="other", password="123456", mobile="13300000001")
+        self.client.force_authenticate(other)
+        self.assertEqual(404, self.client.get(self.url, HTTP_ACCEPT="text/event-stream").status_code)
+
+    def test_stream_limit(self):
+        """测试等待的连接数量达到上限时，返回当前状态并通知客户端稍后重新连接，不订阅频道"""
+        with mock.patch.object(OrderStatusStreamAPIView, "stream_semaphore", threading.BoundedSemaphore(1)):
+            response = self.client.get(self.url, HTTP_ACCEPT="text/event-stream")
+            content = b"".join(self.client.get(self.url).streaming_content).decode()
+            self.assertIn(f"retry: {constants.ORDER_STATUS_STREAM_RETRY}", content)
+            self.assertIn("event: retry", content)
+            # 第一个连接结束以后释放名额
+            with self.captureOnCommitCallbacks(execute=True):
+                transition_order(self.order, 0, 1, pay_time=datetime.now())
+            b"".join(response.streaming_content)
+            self.assertTrue(OrderStatusStreamAPIView.stream_semaphore.acquire(blocking=False))
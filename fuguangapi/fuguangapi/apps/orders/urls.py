@@ -4,7 +4,11 @@ from . import views
 
 urlpatterns = [
     path('', views.OrderCreateAPIView.as_view(), name='order_create'),
+    path('queue/', views.OrderQueueAPIView.as_view(), name='order_queue'),
+    re_path("^queue/(?P<order_number>\d+)/$", views.OrderQueueStatusAPIView.as_view(), name='order_queue_status'),
+    re_path("^status/(?P<order_number>\d+)/$", views.OrderStatusStreamAPIView.as_view(), name='order_status_stream'),
     path('pay/status/', views.OrderPayChoicesAPIView.as_view(), name='order_pay_choices'),
+    path('counts/', views.OrderCountAPIView.as_view(), name='order_counts'),
     path('list/', views.OrderListAPIView.as_view(), name='order_list'),
     re_path("^(?P<pk>\d+)/$", views.OrderViewSet.as_view({"put": "pay_cancel"})),
 
@@ -1,6 +1,10 @@
+import json
 import logging
+import threading
+import time
 
-from django.db import transaction
+from django.http.response import StreamingHttpResponse
+from django_redis import get_redis_connection
 from rest_framework import status
 from rest_framework.generics import CreateAPIView, ListAPIView
 from rest_framework.permissions import IsAuthenticated
@@ -8,19 +12,162 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ViewSet
 
-from coupon.services import add_coupon_to_redis
+import constants
+from fuguangapi.utils.views import IdempotentMixin
 from .models import Order
 from .paginations import OrderListPageNumberPagination
 from .serializers import OrderModelSerializer, OrderListModelSerializer
+from .services import get_order_counts, cancel_unpaid_orders, enqueue_order, get_order_queue_status
+from .services import acquire_order_queue_trigger, get_order_status_channel
+from .tasks import process_order_queue_task
 
 
-class OrderCreateAPIView(CreateAPIView):
-    """创建订单"""
+class OrderCreateAPIView(IdempotentMixin, CreateAPIView):
+    """创建订单[客户端超时重试时，携带相同的 Idempotency-Key 请求头，不会重复创建订单]"""
     permission_classes = [IsAuthenticated]
     queryset = Order.objects.all()
     serializer_class = OrderModelSerializer
 
 
+class OrderQueueAPIView(IdempotentMixin, CreateAPIView):
+    """
+    排队下单
+    大促期间使用，接口只做简单验证并把下单请求放入队列，立即返回订单号，
+    客户端根据订单号轮询下单结果
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderModelSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_number = enqueue_order(
+            request.user,
+            pay_type=serializer.validated_data.get("pay_type"),
+            user_coupon_id=serializer.validated_data.get("user_coupon_id"),
+            use_credit=serializer.validated_data.get("credit", 0),
+        )
+        if acquire_order_queue_trigger():
+            process_order_queue_task.delay()
+        return Response({"order_number": order_number, "status": "pending"}, status=status.HTTP_202_ACCEPTED)
+
+
+class OrderQueueStatusAPIView(APIView):
+    """排队下单的处理结果"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, order_number):
+        data = get_order_queue_status(order_number)
+        if data and int(data["user_id"]) == request.user.id:
+            return Response({
+                "order_number": order_number,
+                "status": data["status"],
+                "order_id": int(data["order_id"]) if data.get("order_id") else None,
+                "errmsg": data.get("errmsg", ""),
+            })
+
+        # 处理结果已经过期，直接查询订单
+        order = Order.objects.filter(order_number=order_number, user=request.user).only("id").first()
+        if order is None:
+            return Response({"errmsg": "订单不存在"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"order_number": order_number, "status": "success", "order_id": order.id, "errmsg": ""})
+
+
+class OrderStatusStreamAPIView(APIView):
+    """
+    等待订单的支付结果[Server-Sent Events]
+    先订阅订单状态的发布订阅频道，再从数据库读取一次订单状态，订单仍然是未支付时，
+    等待支付、取消或者超时的处理流程发布状态变化，收到以后推送一次结果并关闭连接，
+    代替客户端反复调用支付结果查询接口[每次都会查询数据库并请求支付宝]
+
+    每个等待中的连接都会占用一个工作线程和一个redis连接，需要使用gevent等协程worker部署当前接口，
+    同步WSGI部署时，每个进程同时等待的连接数量限制为 ORDER_STATUS_STREAM_LIMIT，
+    超过以后只返回一次当前状态，客户端在 ORDER_STATUS_STREAM_RETRY 毫秒以后重新连接[短轮询]
+    """
+    permission_classes = [IsAuthenticated]
+    # 当前进程中等待订单状态变化的连接数量限制
+    stream_semaphore = threading.BoundedSemaphore(constants.ORDER_STATUS_STREAM_LIMIT)
+
+    def perform_content_negotiation(self, request, force=False):
+        """客户端的Accept请求头是 text/event-stream，错误信息仍然使用默认的渲染器返回"""
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, order_number):
+        if not self.stream_semaphore.acquire(blocking=False):
+            return self.poll(request, order_number)
+
+        try:
+            # 先订阅再读取订单状态，避免在两个操作之间发布的状态变化丢失
+            pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(get_order_status_channel(order_number))
+            order_status = self.get_order_status(request, order_number)
+        except Exception:
+            self.stream_semaphore.release()
+            raise
+        if order_status is None:
+            pubsub.close()
+            self.stream_semaphore.release()
+            return Response({"errmsg": "订单不存在"}, status=status.HTTP_404_NOT_FOUND)
+
+        return self.event_response(self.stream(pubsub, order_number, order_status))
+
+    def poll(self, request, order_number):
+        """等待的连接数量达到上限，返回一次当前状态，通知客户端稍后重新连接"""
+        order_status = self.get_order_status(request, order_number)
+        if order_status is None:
+            return Response({"errmsg": "订单不存在"}, status=status.HTTP_404_NOT_FOUND)
+        name = "retry" if order_status == 0 else "status"
+        content = f"retry: {constants.ORDER_STATUS_STREAM_RETRY}\n" + self.event(
+            name, {"order_number": order_number, "order_status": order_status})
+        return self.event_response([content])
+
+    def get_order_status(self, request, order_number):
+        return Order.objects.filter(order_number=order_number, user=request.user).values_list(
+            "order_status", flat=True).first()
+
+    def event_response(self, content):
+        response = StreamingHttpResponse(content, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # 禁用nginx的响应缓冲，事件才能立即推送给客户端
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def stream(self, pubsub, order_number, order_status):
+        try:
+            if order_status != 0:
+                yield self.event("status", {"order_number": order_number, "order_status": order_status})
+                return
+
+            deadline = time.monotonic() + constants.ORDER_STATUS_STREAM_TIMEOUT
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # 等待超时，客户端重新连接
+                    yield self.event("timeout", {"order_number": order_number, "order_status": order_status})
+                    return
+                message = pubsub.get_message(timeout=min(remaining, constants.ORDER_STATUS_KEEPALIVE))
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield self.event("status", json.loads(message["data"]))
+                return
+        finally:
+            # 客户端断开连接时，响应关闭也会执行这里
+            pubsub.close()
+            self.stream_semaphore.release()
+
+    def event(self, name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+class OrderCountAPIView(APIView):
+    """订单管理页面各个状态标签的订单数量"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(get_order_counts(request.user.id))
+
+
 class OrderPayChoicesAPIView(APIView):
     """前端订单管理页面，支付状态的展示"""
 
@@ -34,15 +181,26 @@ class OrderListAPIView(ListAPIView):
     serializer_class = OrderListModelSerializer
     pagination_class = OrderListPageNumberPagination
 
+    def get_order_status(self):
+        """查询的订单状态，-1表示全部订单"""
+        order_status = int(self.request.query_params.get('order_status', -1))
+        status_list = [item[0] for item in Order.status_choices]
+        return order_status if order_status in status_list else -1
+
     def get_queryset(self):
         user = self.request.user
         query = Order.objects.filter(user=user, is_show=True, is_delete=False)
-        order_status = int(self.request.query_params.get('order_status', -1))
-        status_list = [item[0] for item in Order.status_choices]
-        if order_status in status_list:
+        order_status = self.get_order_status()
+        if order_status != -1:
             query = query.filter(order_status=order_status)
         return query.order_by('-id')
 
+    def get_pagination_count(self, queryset):
+        """订单总数从redis中读取，订单创建或状态变化时增量更新"""
+        order_status = self.get_order_status()
+        field = "all" if order_status == -1 else str(order_status)
+        return get_order_counts(self.request.user.id).get(field, 0)
+
 
 class OrderViewSet(ViewSet):
     """订单管理视图集"""
@@ -51,28 +209,12 @@ class OrderViewSet(ViewSet):
     def pay_cancel(self, request, pk):
         """取消订单"""
         try:
-            order = Order.objects.get(pk=pk, order_status=0)
-        except:
-            return Response({'errmsg': '订单不存在'}, status=status.HTTP_400_BAD_REQUEST)
+            # 条件更新订单状态，归还订单中使用的积分和优惠券，并从超时取消的延时队列中删除
+            total = cancel_unpaid_orders([pk], order_status=2, user_id=request.user.id)
+        except Exception as e:
+            logging.error(f"订单无法取消！发生未知错误！{e}")
+            return Response({"errmsg": "当前订单取消失败！"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        with transaction.atomic():
-            save_id = transaction.savepoint()
-            try:
-                # 1. 查询当前订单是否使用了积分，如果有则恢复
-                if order.credit > 0:
-                    order.user.credit += order.credit
-                    order.user.save()
-                # 2. 查询当前订单是否使用了优惠券，如果有则恢复
-                obj = order.to_coupon.first()
-                if obj:
-                    add_coupon_to_redis(obj)
-                # 3. 更新订单状态
-                order.order_status = 2
-                order.save()
-
-                return Response({"errmsg": "当前订单已取消！"})
-
-            except Exception as e:
-                logging.error(f"订单无法取消！发生未知错误！{e}")
-                transaction.savepoint_rollback(save_id)
-                return Response({"errmsg": "当前订单取消失败！"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not total:
+            return Response({'errmsg': '订单不存在'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"errmsg": "当前订单已取消！"})
@@ -0,0 +1,86 @@
+"""
+支付网关
+对账等批量任务通过网关查询支付宝的交易状态，默认使用进程内共享的支付宝SDK，
+测试和压测时可以使用本地的模拟网关，不需要访问支付宝
+"""
+import threading
+import time
+
+from alipaysdk import get_alipay_sdk
+
+
+def get_payment_gateway():
+    """获取支付宝网关[支付宝SDK实例]"""
+    return get_alipay_sdk()
+
+
+class FakeAliPayGateway(object):
+    """
+    模拟的支付宝网关，query()的返回格式与支付宝的交易查询接口一致
+    """
+
+    def __init__(self, trades=None, default_status=None, delay=0, refund_errors=None, timeout=None):
+        """
+        :param trades: 模拟的交易信息 {订单号: 交易状态} 或者 {订单号: 交易信息字典}
+        :param default_status: 不在trades中的订单返回的交易状态，为None时返回交易不存在
+        :param delay: 每次查询或退款的模拟耗时[单位: 秒]
+        :param timeout: 每次请求的超时时间，模拟耗时超过超时时间时抛出超时异常[单位: 秒]
+        :param refund_errors: 模拟的退款失败 {订单号: 错误码}，错误码为"timeout"时抛出超时异常，
+                              为"20000"时返回网关服务不可用，其他错误码[例如ACQ.SYSTEM_ERROR]返回业务失败[code=40004]
+        """
+        self.trades = trades or {}
+        self.default_status = default_status
+        self.delay = delay
+        self.refund_errors = refund_errors or {}
+        self.timeout = timeout
+        self.refunds = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def with_timeout(self, timeout):
+        """设置请求的超时时间[与SDK不同，模拟网关直接修改当前实例，方便统计调用次数]"""
+        self.timeout = timeout
+        return self
+
+    def sleep(self):
+        """模拟请求耗时，超过超时时间时与SDK一样抛出超时异常"""
+        if self.timeout is not None and self.delay > self.timeout:
+            time.sleep(self.timeout)
+            raise TimeoutError("模拟的请求超时")
+        if self.delay:
+            time.sleep(self.delay)
+
+    def query(self, order_number):
+        with self.lock:
+            self.calls += 1
+        self.sleep()
+
+        trade = self.trades.get(order_number, self.default_status)
+        if trade is None:
+            return {"code": "40004", "msg": "Business Failed", "sub_code": "ACQ.TRADE_NOT_EXIST",
+                    "sub_msg": "交易不存在", "out_trade_no": order_number}
+        if isinstance(trade, str):
+            trade = {"trade_status": trade}
+        return {"code": "10000", "msg": "Success", "out_trade_no": order_number,
+                "trade_no": f"FAKE{order_number}", **trade}
+
+    def refund(self, order_number, refund_amount, out_request_no=None):
+        with self.lock:
+            self.calls += 1
+        self.sleep()
+
+        error = self.refund_errors.get(order_number)
+        if error == "timeout":
+            raise TimeoutError("模拟的退款请求超时")
+        if error == "20000":
+            return {"code": "20000", "msg": "Service Currently Unavailable", "sub_code": "isp.unknow-error",
+                    "sub_msg": "系统繁忙"}
+        if error:
+            return {"code": "40004", "msg": "Business Failed", "sub_code": error,
+                    "sub_msg": "退款失败", "out_trade_no": order_number}
+
+        # 同一个退款请求号重复调用只会退款一次
+        with self.lock:
+            self.refunds.setdefault(out_request_no or order_number, refund_amount)
+        return {"code": "10000", "msg": "Success", "out_trade_no": order_number, "trade_no": f"FAKE{order_number}",
+                "fund_change": "Y", "refund_fee": str(refund_amount)}
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+import constants
+
+from payments.gateways import FakeAliPayGateway
+from payments.services import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = "支付对账：查询未支付订单在支付宝的交易状态，补偿处理已支付的订单，取消交易已关闭的超时订单"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=constants.PAYMENT_RECONCILE_BATCH_SIZE,
+                            dest='size', help='每批扫描的订单数量')
+        parser.add_argument('--workers', type=int, default=constants.PAYMENT_RECONCILE_WORKERS,
+                            dest='workers', help='同时查询支付宝的线程数量')
+        parser.add_argument('--timeout', type=float, default=constants.PAYMENT_RECONCILE_TIMEOUT,
+                            dest='timeout', help='每次查询的超时时间[单位: 秒]')
+        parser.add_argument('--min-age', type=int, default=constants.PAYMENT_RECONCILE_MIN_AGE,
+                            dest='min_age', help='只处理下单超过指定秒数的订单')
+        parser.add_argument('--limit', type=int, default=None,
+                            dest='limit', help='本次最多扫描的订单数量')
+        parser.add_argument('--fake', type=str, default=None, choices=['TRADE_SUCCESS', 'TRADE_CLOSED', 'WAIT_BUYER_PAY'],
+                            dest='fake', help='使用本地的模拟网关，所有订单都返回指定的交易状态')
+        parser.add_argument('--fake-delay', type=float, default=0,
+                            dest='fake_delay', help='模拟网关每次查询的耗时[单位: 秒]')
+
+    def handle(self, *args, **options):
+        gateway = None
+        if options['fake']:
+            gateway = FakeAliPayGateway(default_status=options['fake'], delay=options['fake_delay'])
+
+        metrics = reconcile_payments(
+            gateway=gateway,
+            size=options['size'],
+            workers=options['workers'],
+            timeout=options['timeout'],
+            min_age=options['min_age'],
+            limit=options['limit'],
+        )
+        self.stdout.write("支付对账完成！" + "，".join(f"{key}:{value}" for key, value in metrics.items()))
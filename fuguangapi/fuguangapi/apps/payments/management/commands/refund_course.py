@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.models import Course
+from payments.gateways import FakeAliPayGateway
+from payments.services import create_course_refunds, get_refund_progress, process_refunds
+from payments.tasks import process_refunds_task
+
+
+class Command(BaseCommand):
+    help = "课程下架以后，为购买了课程的所有已支付订单批量退款，或者查询批量退款的进度"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, default=None,
+                            dest='course', help='退款的课程ID')
+        parser.add_argument('--reason', type=str, default='课程下架',
+                            dest='reason', help='退款原因')
+        parser.add_argument('--progress', type=str, default=None,
+                            dest='progress', help='查询指定批次号的退款进度')
+        parser.add_argument('--fake', action='store_true', default=False,
+                            dest='fake', help='使用本地的模拟网关，在当前进程中处理退款')
+
+    def handle(self, *args, **options):
+        if options['progress']:
+            self.write_progress(options['progress'])
+            return
+
+        if options['course'] is None:
+            raise CommandError("请指定退款的课程ID[--course]或者查询进度的批次号[--progress]")
+        if not Course.objects.filter(pk=options['course']).exists():
+            raise CommandError("课程不存在")
+
+        batch_no = create_course_refunds(options['course'], reason=options['reason'])
+        self.stdout.write(f"退款请求创建完成！批次号:{batch_no}")
+
+        if not options['fake']:
+            # 由后台任务处理退款，使用 --progress 查询进度
+            process_refunds_task.delay()
+            self.write_progress(batch_no)
+            return
+
+        gateway = FakeAliPayGateway()
+        while process_refunds(gateway)["total"]:
+            self.write_progress(batch_no)
+
+    def write_progress(self, batch_no):
+        progress = get_refund_progress(batch_no)
+        self.stdout.write(f"[{batch_no}] 总数:{progress['total']}，成功:{progress['success']}，失败:{progress['fail']}")
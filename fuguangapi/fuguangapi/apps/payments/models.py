@@ -1 +1,83 @@
-# Create your models here.
+from django.db import models
+from django.utils import timezone
+
+from courses.models import Course
+from orders.models import Order
+from users.models import User
+
+
+class PaymentNotify(models.Model):
+    """
+    支付宝异步通知
+    接收通知时只验证签名并保存通知内容，由后台任务批量处理订单
+    """
+    status_choices = (
+        (0, "待处理"),
+        (1, "处理成功"),
+        (2, "处理失败"),
+    )
+
+    trade_no = models.CharField(max_length=64, unique=True, verbose_name="支付宝交易号")
+    order_number = models.CharField(max_length=64, verbose_name="订单号")
+    data = models.JSONField(verbose_name="通知内容")
+    status = models.SmallIntegerField(choices=status_choices, default=0, verbose_name="处理状态")
+    retries = models.IntegerField(default=0, verbose_name="重试次数")
+    errmsg = models.CharField(max_length=255, default="", blank=True, verbose_name="失败原因")
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'fg_payment_notify'
+        verbose_name = '支付宝异步通知'
+        verbose_name_plural = verbose_name
+        indexes = [
+            # 按顺序取出待处理的通知
+            models.Index(fields=["status", "id"], name="fg_payment_notify_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.order_number}:{self.trade_no}"
+
+
+class Refund(models.Model):
+    """
+    退款请求
+    退款请求保存以后由后台任务分批调用支付宝的退款接口，
+    只退订单中的部分课程时，course为退款的课程，否则为整个订单退款
+    """
+    status_choices = (
+        (0, "待处理"),
+        (1, "退款成功"),
+        (2, "退款失败"),
+        (3, "处理中"),
+    )
+
+    refund_no = models.CharField(max_length=64, unique=True, verbose_name="退款请求号")
+    batch_no = models.CharField(max_length=64, db_index=True, verbose_name="批次号")
+    order = models.ForeignKey(Order, related_name='refunds', on_delete=models.DO_NOTHING, db_constraint=False,
+                              verbose_name="订单")
+    user = models.ForeignKey(User, related_name='refunds', on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, verbose_name="用户")
+    course = models.ForeignKey(Course, related_name='refunds', on_delete=models.DO_NOTHING, db_constraint=False,
+                               db_index=False, null=True, blank=True, verbose_name="退款课程")
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="退款金额")
+    reason = models.CharField(max_length=255, default="", blank=True, verbose_name="退款原因")
+    status = models.SmallIntegerField(choices=status_choices, default=0, verbose_name="处理状态")
+    retries = models.IntegerField(default=0, verbose_name="重试次数")
+    next_retry_time = models.DateTimeField(default=timezone.now, verbose_name="下次处理时间")
+    errmsg = models.CharField(max_length=255, default="", blank=True, verbose_name="失败原因")
+    refund_time = models.DateTimeField(null=True, blank=True, verbose_name="退款时间")
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'fg_refund'
+        verbose_name = '退款记录'
+        verbose_name_plural = verbose_name
+        indexes = [
+            # 按顺序取出到达处理时间的退款请求
+            models.Index(fields=["status", "next_retry_time"], name="fg_refund_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.refund_no}:{self.amount}"
@@ -0,0 +1,541 @@
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q, Count
+from django.utils import timezone as datetime
+from django_redis import get_redis_connection
+
+import constants
+from coupon.models import CouponLog
+from orders.models import Order, OrderDetail
+from fuguangapi.utils.pricing import PRICE_PRECISION
+from orders.services import transition_order, transition_orders, cancel_unpaid_orders
+from users.models import UserCourse, Credit
+from users.services import change_credits
+from .gateways import get_payment_gateway
+from .models import PaymentNotify, Refund
+
+logger = logging.getLogger("django")
+
+# 批量退款进度存在时才累加，进度已经过期时不再重新创建[没有有效期和总数]，查询时从数据库中统计
+REFUND_PROGRESS_SCRIPT = """
+if redis.call("exists", KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call("hincrby", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+# 每个进程只注册一次lua脚本
+_refund_progress_script = None
+
+
+def fulfill_order(order, pay_time=None):
+    """
+    订单支付成功以后的处理[支付宝的同步通知、异步通知和主动查询共用]
+    条件更新订单状态[WHERE order_status=0]，并发的请求中只有切换成功的请求继续处理，
+    其他请求不等待锁，直接返回订单当前的支付状态
+    :param order: 订单模型对象
+    :param pay_time: 支付时间，默认为当前时间
+    :return: 订单是否已支付[本次处理成功或者已经被其他请求处理]
+    """
+    # 已经支付完成，则不需要继续往下处理
+    if order.order_status == 1:
+        return True
+
+    if pay_time is None:
+        pay_time = datetime.now()
+
+    with transaction.atomic():
+        # 1. 修改订单状态，订单超时的延时任务在事务提交以后删除，订单使用的积分在下单时已经扣除并记录了积分流水
+        if not transition_order(order, 0, 1, pay_time=pay_time):
+            # 订单已经被其他请求处理[已支付或已超时取消]
+            order.refresh_from_db(fields=["order_status", "pay_time"])
+            return order.order_status == 1
+
+        # 2. 如果有使用了优惠券, 修改优惠券的使用记录
+        CouponLog.objects.filter(order=order).update(use_time=pay_time, use_status=1)
+
+        # 3. 用户和课程的关系绑定，唯一约束保证重复绑定的课程被忽略
+        course_id_list = OrderDetail.objects.filter(order=order).values_list("course_id", flat=True)
+        UserCourse.objects.bulk_create([
+            UserCourse(user_id=order.user_id, course_id=course_id) for course_id in course_id_list
+        ], ignore_conflicts=True)
+
+    return True
+
+
+def enqueue_payment_notify(data):
+    """
+    保存支付宝的异步通知，同一笔交易[trade_no]重复发送的通知被唯一约束忽略
+    :param data: 验证签名以后的通知内容
+    """
+    PaymentNotify.objects.bulk_create([PaymentNotify(
+        trade_no=data["trade_no"],
+        order_number=data["out_trade_no"],
+        data=data,
+    )], ignore_conflicts=True)
+
+
+def acquire_payment_notify_trigger():
+    """异步通知入队以后触发后台任务，短时间内只触发一次，避免每个通知都投递一个任务"""
+    redis = get_redis_connection("default")
+    return bool(redis.set(constants.PAYMENT_NOTIFY_TRIGGER_KEY, 1, nx=True, px=constants.PAYMENT_NOTIFY_TRIGGER_TIME))
+
+
+def check_payment_notify(notify, order):
+    """
+    检查异步通知与订单是否一致
+    :return: 错误信息，一致时返回空字符串
+    """
+    if order is None:
+        return "订单不存在"
+    try:
+        total_amount = Decimal(notify.data.get("total_amount", ""))
+    except InvalidOperation:
+        return "支付金额格式错误"
+    if total_amount != order.real_price:
+        return f"支付金额[{total_amount}]与订单金额[{order.real_price}]不一致"
+    return ""
+
+
+def process_payment_notifies(size=constants.PAYMENT_NOTIFY_BATCH_SIZE):
+    """
+    批量处理待处理的异步通知
+    多个后台任务同时处理时，使用 SELECT ... FOR UPDATE SKIP LOCKED 跳过其他任务正在处理的通知
+    :return: 本次处理的通知数量
+    """
+    with transaction.atomic():
+        notify_list = list(PaymentNotify.objects.select_for_update(skip_locked=True).filter(
+            status=0).order_by("id")[:size])
+        if not notify_list:
+            return 0
+
+        order_dict = Order.objects.in_bulk([notify.order_number for notify in notify_list], field_name="order_number")
+        now_time = datetime.now()
+        for notify in notify_list:
+            order = order_dict.get(notify.order_number)
+            notify.updated_time = now_time
+            notify.errmsg = check_payment_notify(notify, order)
+            if notify.errmsg:
+                notify.status = 2
+                continue
+
+            try:
+                # 每个通知单独使用一个保存点，处理失败时不影响同一批次的其他通知
+                with transaction.atomic():
+                    paid = fulfill_order(order)
+            except Exception as e:
+                logger.error(f"订单支付处理异步结果发生未知错误：{notify.order_number}: {e}")
+                notify.retries += 1
+                notify.errmsg = str(e)[:255]
+                if notify.retries >= constants.PAYMENT_NOTIFY_MAX_RETRIES:
+                    notify.status = 2
+                continue
+
+            notify.status = 1
+            if not paid:
+                # 支付宝已经收款，但是订单已经超时或被取消，通知已经应答成功，支付宝不会再次通知，原路退款
+                notify.errmsg = "订单超时或已取消，已创建退款请求"
+                create_order_refunds([order], reason="订单超时或已取消，支付宝已收款")
+
+        PaymentNotify.objects.bulk_update(notify_list, ["status", "retries", "errmsg", "updated_time"])
+
+    failed_list = [notify for notify in notify_list if notify.status == 2]
+    if failed_list:
+        logger.error(f"支付宝异步通知处理失败：{[(str(notify), notify.errmsg) for notify in failed_list]}")
+    return len(notify_list)
+
+
+def get_pending_orders(size, last=None, min_age=constants.PAYMENT_RECONCILE_MIN_AGE):
+    """
+    按照(下单时间, 订单ID)的顺序分批查询使用支付宝支付的未支付订单[keyset分页，使用订单状态和下单时间的索引]
+    :param size: 每批查询的数量
+    :param last: 上一批最后一个订单的(下单时间, 订单ID)
+    :param min_age: 只查询下单超过min_age秒的订单
+    :return: 订单列表
+    """
+    queryset = Order.objects.filter(
+        order_status=0, pay_type=0, created_time__lt=datetime.now() - timedelta(seconds=min_age))
+    if last is not None:
+        created_time, order_id = last
+        queryset = queryset.filter(Q(created_time__gt=created_time) | Q(created_time=created_time, id__gt=order_id))
+    return list(queryset.order_by("created_time", "id").only(
+        "id", "user_id", "order_number", "order_status", "real_price", "created_time", "is_show", "is_delete")[:size])
+
+
+def is_timeout_error(error):
+    """请求支付宝是否超时[socket超时，或者被urllib包装以后的超时]"""
+    return isinstance(error, TimeoutError) or isinstance(getattr(error, "reason", None), TimeoutError)
+
+
+def query_trades(gateway, order_list, executor, workers, timeout, metrics):
+    """
+    使用线程池并发查询订单在支付宝的交易状态，每次查询的超时时间由网关的请求超时时间保证
+    :return: (字典 {订单号: 交易信息}，查询失败或超时的订单不在字典中, 等待超时以后仍在执行的查询)
+    """
+    future_dict = {executor.submit(gateway.query, order.order_number): order.order_number for order in order_list}
+    # 线程池的线程数量有限，排队的查询也需要等待，按照排队的轮数计算本批次最长的等待时间
+    rounds = -(-len(future_dict) // workers)
+    done, not_done = wait(future_dict, timeout=timeout * rounds)
+    # 还没有开始的查询直接取消，已经开始的查询无法取消，由调用方等待结束以后再提交下一批
+    running = {future for future in not_done if not future.cancel()}
+    metrics["timeout"] += len(not_done)
+
+    trade_dict = {}
+    for future in done:
+        order_number = future_dict[future]
+        try:
+            trade_dict[order_number] = future.result()
+        except Exception as e:
+            if is_timeout_error(e):
+                metrics["timeout"] += 1
+            else:
+                metrics["error"] += 1
+            logger.warning(f"支付对账查询交易失败：{order_number}: {e}")
+    return trade_dict, running
+
+
+def settle_trades(order_list, trade_dict, metrics):
+    """根据支付宝的交易状态，批量处理已支付和已关闭的订单"""
+    expire_time = datetime.now() - timedelta(seconds=constants.ORDER_TIMEOUT)
+    expired_id_list = []
+    for order in order_list:
+        trade = trade_dict.get(order.order_number)
+        if trade is None:
+            continue
+
+        trade_status = trade.get("trade_status")
+        if trade_status in ["TRADE_FINISHED", "TRADE_SUCCESS"]:
+            if "total_amount" in trade:
+                try:
+                    total_amount = Decimal(str(trade["total_amount"]))
+                except InvalidOperation:
+                    # 支付宝返回的金额格式错误，按照金额不一致处理，不影响其他订单
+                    total_amount = None
+                if total_amount != order.real_price:
+                    metrics["mismatch"] += 1
+                    logger.error(f"支付对账金额不一致：{order.order_number}: {trade['total_amount']} != {order.real_price}")
+                    continue
+            try:
+                if fulfill_order(order):
+                    metrics["paid"] += 1
+                else:
+                    # 支付宝已经收款，但是订单已经被取消，原路退款
+                    metrics["cancelled"] += 1
+                    create_order_refunds([order], reason="订单超时或已取消，支付宝已收款")
+                    logger.warning(f"支付对账发现已取消的订单已经支付，已创建退款请求：{order.order_number}")
+            except Exception as e:
+                metrics["error"] += 1
+                logger.error(f"支付对账处理订单失败：{order.order_number}: {e}")
+        elif (trade_status == "TRADE_CLOSED" or trade.get("sub_code") == "ACQ.TRADE_NOT_EXIST") \
+                and order.created_time < expire_time:
+            # 交易已关闭或者用户没有扫码，并且订单已经超时
+            expired_id_list.append(order.id)
+        else:
+            metrics["pending"] += 1
+
+    if expired_id_list:
+        metrics["expired"] += cancel_unpaid_orders(expired_id_list)
+
+
+def reconcile_payments(gateway=None, size=constants.PAYMENT_RECONCILE_BATCH_SIZE,
+                       workers=constants.PAYMENT_RECONCILE_WORKERS, timeout=constants.PAYMENT_RECONCILE_TIMEOUT,
+                       min_age=constants.PAYMENT_RECONCILE_MIN_AGE, limit=None):
+    """
+    支付对账：分批扫描未支付的订单，并发查询支付宝的交易状态，补偿处理丢失了异步通知的已支付订单，
+    同时取消交易已经关闭的超时订单
+    :param gateway: 支付网关，默认使用支付宝SDK，测试时可以使用 FakeAliPayGateway
+    :param size: 每批扫描的订单数量
+    :param workers: 同时查询支付宝的线程数量
+    :param timeout: 每次查询的超时时间[单位: 秒]
+    :param min_age: 只处理下单超过min_age秒的订单
+    :param limit: 本次最多扫描的订单数量，默认不限制
+    :return: 对账指标 {scanned, queried, paid, expired, pending, cancelled, mismatch, timeout, error, elapsed, qps}
+    """
+    if gateway is None:
+        gateway = get_payment_gateway()
+    # 每次请求支付宝的超时时间
+    gateway = gateway.with_timeout(timeout)
+
+    metrics = Counter()
+    start_time = time.monotonic()
+    last = None
+    running = set()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reconcile")
+    try:
+        while limit is None or metrics["scanned"] < limit:
+            # 上一批仍在执行的查询占用着线程，继续提交只会让下一批的查询也超时，等待结束以后再提交
+            if running and wait(running, timeout=timeout).not_done:
+                logger.warning(f"支付对账查询支付宝超时，停止本次对账！仍在执行的查询数量:{len(running)}")
+                break
+            batch_size = size if limit is None else min(size, limit - metrics["scanned"])
+            order_list = get_pending_orders(batch_size, last, min_age)
+            if not order_list:
+                break
+            last = (order_list[-1].created_time, order_list[-1].id)
+            metrics["scanned"] += len(order_list)
+
+            trade_dict, running = query_trades(gateway, order_list, executor, workers, timeout, metrics)
+            metrics["queried"] += len(trade_dict)
+            settle_trades(order_list, trade_dict, metrics)
+    finally:
+        # 不等待卡住的查询，线程在请求超时以后自动结束
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.monotonic() - start_time
+    result = {key: metrics[key] for key in (
+        "scanned", "queried", "paid", "expired", "pending", "cancelled", "mismatch", "timeout", "error")}
+    result["elapsed"] = round(elapsed, 3)
+    result["qps"] = round(metrics["queried"] / elapsed, 2) if elapsed > 0 else 0
+    logger.info(f"支付对账完成：{result}")
+    return result
+
+
+def generate_refund_batch_no(course_id):
+    """批量退款的批次号[基于时间、课程ID和随机数]"""
+    return time.strftime("%Y%m%d%H%M%S") + f"{course_id:08d}" + f"{random.randint(0, 9999):04d}"
+
+
+def create_course_refunds(course_id, reason="", batch_no=None, size=constants.REFUND_BATCH_SIZE):
+    """
+    为购买了指定课程的所有已支付订单创建退款请求
+    订单中只有当前课程时整个订单退款，否则按照课程实价占订单的比例退还实付金额中的一部分，
+    同一个订单[或者同一个订单中的同一个课程]重复创建的退款请求被唯一约束忽略
+    :param course_id: 课程ID
+    :param reason: 退款原因
+    :param batch_no: 批次号，默认自动生成
+    :param size: 每批处理的订单数量
+    :return: 批次号
+    """
+    if batch_no is None:
+        batch_no = generate_refund_batch_no(course_id)
+
+    last_id = 0
+    while True:
+        # 按照订单详情的ID分批查询购买了当前课程的已支付订单
+        detail_list = list(OrderDetail.objects.filter(
+            course_id=course_id, order__order_status=1, pk__gt=last_id).select_related("order").only(
+            "id", "real_price", "order__id", "order__user_id", "order__order_number", "order__real_price").order_by(
+            "id")[:size])
+        if not detail_list:
+            break
+        last_id = detail_list[-1].id
+
+        # 一次性统计本批订单中所有课程的实价合计
+        order_price_dict = defaultdict(Decimal)
+        for item in OrderDetail.objects.filter(order_id__in=[detail.order_id for detail in detail_list]).values(
+                "order_id", "real_price"):
+            order_price_dict[item["order_id"]] += item["real_price"]
+
+        refund_list = []
+        for detail in detail_list:
+            order = detail.order
+            total_price = order_price_dict[order.id]
+            if total_price == detail.real_price:
+                refund_list.append(Refund(
+                    refund_no=f"R{order.order_number}", batch_no=batch_no, order_id=order.id, user_id=order.user_id,
+                    amount=order.real_price, reason=reason))
+            else:
+                amount = (order.real_price * detail.real_price / total_price).quantize(PRICE_PRECISION)
+                refund_list.append(Refund(
+                    refund_no=f"R{order.order_number}C{course_id}", batch_no=batch_no, order_id=order.id,
+                    user_id=order.user_id, course_id=course_id, amount=amount, reason=reason))
+        Refund.objects.bulk_create(refund_list, ignore_conflicts=True)
+
+    total = Refund.objects.filter(batch_no=batch_no).count()
+    redis = get_redis_connection("default")
+    key = f"{constants.REFUND_PROGRESS_KEY}:{batch_no}"
+    pipe = redis.pipeline()
+    pipe.hset(key, mapping={"total": total, "success": 0, "fail": 0})
+    pipe.expire(key, constants.REFUND_PROGRESS_TIME)
+    pipe.execute()
+    return batch_no
+
+
+def create_order_refunds(order_list, reason=""):
+    """
+    为整个订单创建退款请求[例如支付宝已经收款，但是订单已经超时或被取消]，由后台任务调用退款接口
+    退款请求号与课程退款的整单退款相同，同一个订单重复创建的退款请求被唯一约束忽略
+    :return: 批次号
+    """
+    batch_no = generate_refund_batch_no(0)
+    Refund.objects.bulk_create([Refund(
+        refund_no=f"R{order.order_number}", batch_no=batch_no, order_id=order.id, user_id=order.user_id,
+        amount=order.real_price, reason=reason) for order in order_list], ignore_conflicts=True)
+    return batch_no
+
+
+def get_refund_progress(batch_no):
+    """
+    获取批量退款的进度
+    :return: 字典 {"total": 退款请求数量, "success": 退款成功数量, "fail": 退款失败数量}
+    """
+    redis = get_redis_connection("default")
+    data = redis.hgetall(f"{constants.REFUND_PROGRESS_KEY}:{batch_no}")
+    if b"total" in data:
+        return {key.decode(): int(value) for key, value in data.items()}
+
+    # 进度已经过期，从数据库中统计
+    counts = dict(Refund.objects.filter(batch_no=batch_no).values("status").annotate(
+        total=Count("id")).order_by().values_list("status", "total"))
+    return {"total": sum(counts.values()), "success": counts.get(1, 0), "fail": counts.get(2, 0)}
+
+
+def claim_refunds(size=constants.REFUND_BATCH_SIZE):
+    """
+    领取一批到达处理时间的退款请求，状态改为处理中以后再调用退款接口，调用期间不锁定数据库记录
+    处理中的状态超过一定时间没有结果时[处理进程已经退出]，重新处理，退款请求号保证不会重复退款
+    :return: 退款请求列表
+    """
+    now_time = datetime.now()
+    Refund.objects.filter(status=3, updated_time__lt=now_time - timedelta(
+        seconds=constants.REFUND_PROCESSING_TIMEOUT)).update(status=0, updated_time=now_time)
+
+    with transaction.atomic():
+        refund_list = list(Refund.objects.select_for_update(skip_locked=True).filter(
+            status=0, next_retry_time__lte=now_time).select_related("order").order_by("next_retry_time", "id")[:size])
+        if refund_list:
+            Refund.objects.filter(pk__in=[refund.id for refund in refund_list]).update(status=3, updated_time=now_time)
+    return refund_list
+
+
+def call_refunds(gateway, refund_list, workers):
+    """
+    使用线程池并发调用退款接口
+    :return: 字典 {退款请求ID: 退款接口的返回结果或者异常}
+    """
+    result_dict = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refund") as executor:
+        future_dict = {executor.submit(
+            gateway.refund, refund.order.order_number, refund.amount, refund.refund_no): refund.id
+            for refund in refund_list}
+        for future, refund_id in future_dict.items():
+            try:
+                result_dict[refund_id] = future.result()
+            except Exception as e:
+                result_dict[refund_id] = e
+    return result_dict
+
+
+def apply_refunds(refund_list):
+    """
+    退款成功以后批量更新订单状态、用户课程和积分
+    整个订单退款时，订单状态改为已退款，并归还订单中抵扣的积分，删除订单中所有课程的购买记录，
+    部分退款时只删除退款课程的购买记录
+    """
+    full_order_id_list = [refund.order_id for refund in refund_list if refund.course_id is None]
+
+    # 1. 修改订单状态[WHERE order_status=1]，重复的退款结果只处理一次
+    order_list = transition_orders(full_order_id_list, 1, 4)
+
+    # 2. 归还订单中抵扣的积分
+    change_credits([
+        Credit(user_id=order.user_id, number=order.credit, operation=1, remark=f"订单{order.order_number}退款，归还抵扣的积分")
+        for order in order_list if order.credit and order.credit > 0
+    ])
+
+    # 3. 删除退款课程的购买记录，所有用户使用一条DELETE语句
+    course_map = defaultdict(set)
+    for item in OrderDetail.objects.filter(order_id__in=[order.id for order in order_list]).values(
+            "order__user_id", "course_id"):
+        course_map[item["order__user_id"]].add(item["course_id"])
+    for refund in refund_list:
+        if refund.course_id is not None:
+            course_map[refund.user_id].add(refund.course_id)
+    if course_map:
+        condition = Q()
+        for user_id, course_id_set in course_map.items():
+            condition |= Q(user_id=user_id, course_id__in=course_id_set)
+        UserCourse.objects.filter(condition).delete()
+
+
+def is_refund_retryable(result):
+    """退款接口的返回结果是否可以使用相同参数重试[网络错误、支付网关异常、支付宝系统繁忙]"""
+    if isinstance(result, Exception):
+        return True
+    # 20000: 支付宝网关服务不可用
+    return result.get("code") == "20000" or result.get("sub_code") in constants.REFUND_RETRY_SUB_CODES
+
+
+def settle_refunds(refund_list, result_dict):
+    """
+    根据退款接口的返回结果批量更新退款请求，网络错误和支付宝系统繁忙时按照指数退避重试
+    :return: 统计 {"success": 退款成功数量, "fail": 退款失败数量, "retry": 等待重试的数量}
+    """
+    now_time = datetime.now()
+    success_list = []
+    for refund in refund_list:
+        result = result_dict[refund.id]
+        refund.updated_time = now_time
+        if isinstance(result, dict) and result.get("code") == "10000":
+            refund.status = 1
+            refund.refund_time = now_time
+            refund.errmsg = ""
+            success_list.append(refund)
+        elif is_refund_retryable(result):
+            refund.retries += 1
+            refund.errmsg = str(result if isinstance(result, Exception) else result.get("sub_msg", ""))[:255]
+            if refund.retries >= constants.REFUND_MAX_RETRIES:
+                refund.status = 2
+            else:
+                refund.status = 0
+                refund.next_retry_time = now_time + timedelta(
+                    seconds=constants.REFUND_RETRY_DELAY * 2 ** (refund.retries - 1))
+        else:
+            refund.status = 2
+            refund.errmsg = f"{result.get('sub_code', '')}:{result.get('sub_msg', '')}"[:255]
+
+    with transaction.atomic():
+        Refund.objects.bulk_update(refund_list, [
+            "status", "retries", "next_retry_time", "errmsg", "refund_time", "updated_time"])
+        apply_refunds(success_list)
+
+    # 按照批次更新退款进度
+    progress = defaultdict(Counter)
+    for refund in refund_list:
+        if refund.status == 1:
+            progress[refund.batch_no]["success"] += 1
+        elif refund.status == 2:
+            progress[refund.batch_no]["fail"] += 1
+    global _refund_progress_script
+    redis = get_redis_connection("default")
+    if _refund_progress_script is None:
+        _refund_progress_script = redis.register_script(REFUND_PROGRESS_SCRIPT)
+    pipe = redis.pipeline()
+    for batch_no, counts in progress.items():
+        args = []
+        for field, value in counts.items():
+            args += [field, value]
+        _refund_progress_script(keys=[f"{constants.REFUND_PROGRESS_KEY}:{batch_no}"], args=args, client=pipe)
+    pipe.execute()
+
+    stats = Counter(refund.status for refund in refund_list)
+    return {"success": stats[1], "fail": stats[2], "retry": stats[0]}
+
+
+def process_refunds(gateway=None, size=constants.REFUND_BATCH_SIZE, workers=constants.REFUND_WORKERS):
+    """
+    处理一批退款请求
+    :param gateway: 支付网关，默认使用支付宝SDK，测试时可以使用 FakeAliPayGateway
+    :return: 统计 {"total": 本批处理的数量, "success": 退款成功数量, "fail": 退款失败数量, "retry": 等待重试的数量}
+    """
+    refund_list = claim_refunds(size)
+    if not refund_list:
+        return {"total": 0, "success": 0, "fail": 0, "retry": 0}
+
+    if gateway is None:
+        gateway = get_payment_gateway()
+    result_dict = call_refunds(gateway, refund_list, workers)
+    stats = settle_refunds(refund_list, result_dict)
+    stats["total"] = len(refund_list)
+    logger.info(f"退款处理完成：{stats}")
+    return stats
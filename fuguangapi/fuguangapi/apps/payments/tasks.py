@@ -0,0 +1,33 @@
+from celery import shared_task
+
+from .services import process_payment_notifies, reconcile_payments, process_refunds
+
+
+@shared_task(name="process_payment_notify")
+def process_payment_notify_task(max_batches=50):
+    """分批处理支付宝的异步通知，接收通知以后触发，同时由定时任务兜底"""
+    total = 0
+    for _ in range(max_batches):
+        count = process_payment_notifies()
+        if not count:
+            break
+        total += count
+    return total
+
+
+@shared_task(name="reconcile_payments")
+def reconcile_payments_task():
+    """定时任务：支付对账，补偿处理丢失了异步通知的已支付订单"""
+    return reconcile_payments()
+
+
+@shared_task(name="process_refunds")
+def process_refunds_task(max_batches=20):
+    """分批处理退款请求，创建退款请求以后触发，同时由定时任务处理等待重试的请求"""
+    total = 0
+    for _ in range(max_batches):
+        stats = process_refunds()
+        if not stats["total"]:
+            break
+        total += stats["total"]
+    return total
@@ -1 +1,209 @@
-# Create your tests here.
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone as datetime
+from django_redis import get_redis_connection
+
+import constants
+from courses.models import Course
+from orders.models import Order, OrderDetail
+from users.models import UserCourse
+from .gateways import FakeAliPayGateway
+from .models import PaymentNotify, Refund
+from .services import fulfill_order, enqueue_payment_notify, process_payment_notifies, reconcile_payments
+from .services import create_course_refunds, get_refund_progress, process_refunds
+
+
+def create_order(user, course_list, order_number="1", **params):
+    order = Order.objects.create(name="测试订单", user=user, order_number=order_number,
+                                 real_price=100 * len(course_list), **params)
+    for course in course_list:
+        OrderDetail.objects.create(name=course.name, order=order, course=course, price=100, real_price=100)
+    return order
+
+
+class FulfillOrderTestCase(TestCase):
+    """订单支付成功以后处理的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.course_list = [Course.objects.create(name=f"课程{i}", price=100) for i in range(2)]
+        self.order = create_order(self.user, self.course_list)
+
+    def test_fulfill_once(self):
+        """测试并发的支付通知只处理一次订单"""
+        other = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(fulfill_order(self.order))
+        self.assertTrue(fulfill_order(other))
+        self.assertTrue(fulfill_order(self.order))
+        self.assertEqual(1, other.order_status)
+        self.assertEqual(2, UserCourse.objects.filter(user=self.user).count())
+
+    def test_ignore_purchased_course(self):
+        """测试已经拥有的课程不会重复绑定"""
+        UserCourse.objects.create(user=self.user, course=self.course_list[0])
+        self.assertTrue(fulfill_order(self.order))
+        self.assertEqual(2, UserCourse.objects.filter(user=self.user).count())
+
+    def test_cancelled_order(self):
+        """测试已经取消的订单不会被处理"""
+        Order.objects.filter(pk=self.order.pk).update(order_status=2)
+        self.assertFalse(fulfill_order(self.order))
+        self.assertFalse(UserCourse.objects.exists())
+
+
+class PaymentNotifyTestCase(TestCase):
+    """支付宝异步通知排队处理的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.order = create_order(self.user, [Course.objects.create(name=f"课程{i}", price=100) for i in range(2)])
+
+    def get_notify_data(self, trade_no="2021001", total_amount="200.00"):
+        return {"trade_no": trade_no, "out_trade_no": self.order.order_number,
+                "trade_status": "TRADE_SUCCESS", "total_amount": total_amount}
+
+    def test_process_notify(self):
+        """测试重复的通知只保存一次，后台任务批量处理以后订单已支付"""
+        enqueue_payment_notify(self.get_notify_data())
+        enqueue_payment_notify(self.get_notify_data())
+        self.assertEqual(1, PaymentNotify.objects.count())
+
+        self.assertEqual(1, process_payment_notifies())
+        self.assertEqual(0, process_payment_notifies())
+        self.order.refresh_from_db()
+        self.assertEqual(1, self.order.order_status)
+        self.assertEqual(1, PaymentNotify.objects.get().status)
+
+    def test_amount_mismatch(self):
+        """测试支付金额与订单金额不一致的通知不会处理订单"""
+        enqueue_payment_notify(self.get_notify_data(total_amount="0.01"))
+        self.assertEqual(1, process_payment_notifies())
+        self.order.refresh_from_db()
+        self.assertEqual(0, self.order.order_status)
+        self.assertEqual(2, PaymentNotify.objects.get().status)
+
+    def test_cancelled_order_refund(self):
+        """测试已经超时取消的订单收到支付通知时，创建退款请求原路退款"""
+        Order.objects.filter(pk=self.order.pk).update(order_status=3)
+        enqueue_payment_notify(self.get_notify_data())
+        enqueue_payment_notify(self.get_notify_data(trade_no="2021002"))
+        self.assertEqual(2, process_payment_notifies())
+        refund = Refund.objects.get()
+        self.assertEqual((self.order.id, 200), (refund.order_id, refund.amount))
+
+        self.assertEqual(1, process_refunds(FakeAliPayGateway())["success"])
+        self.order.refresh_from_db()
+        self.assertEqual(3, self.order.order_status)
+        self.assertFalse(UserCourse.objects.exists())
+
+
+class ReconcilePaymentsTestCase(TestCase):
+    """支付对账的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        self.user = get_user_model().objects.create_user(username="test", password="123456", mobile="13300000000")
+        self.course = Course.objects.create(name="课程", price=100)
+        for order_number in ["1", "2", "3", "4", "5"]:
+            create_order(self.user, [self.course], order_number=order_number, pay_type=0)
+        Order.objects.update(created_time=datetime.now() - timedelta(hours=1))
+
+    def test_reconcile(self):
+        """测试补偿处理已支付的订单，取消交易已关闭的订单，金额不一致的订单不处理"""
+        gateway = FakeAliPayGateway(trades={
+            "1": {"trade_status": "TRADE_SUCCESS", "total_amount": "100.00"},
+            "2": "TRADE_CLOSED",
+            "3": "WAIT_BUYER_PAY",
+            "5": {"trade_status": "TRADE_SUCCESS", "total_amount": "0.01"},
+            "6": {"trade_status": "TRADE_SUCCESS", "total_amount": "abc"},
+        })
+        create_order(self.user, [self.course], order_number="6", pay_type=0)
+        Order.objects.update(created_time=datetime.now() - timedelta(hours=1))
+        metrics = reconcile_payments(gateway, size=2, workers=2)
+        self.assertEqual(6, metrics["scanned"])
+        self.assertEqual(6, gateway.calls)
+        self.assertEqual(1, metrics["paid"])
+        self.assertEqual(2, metrics["expired"])
+        self.assertEqual(1, metrics["pending"])
+        # 金额不一致和金额格式错误的订单都不处理
+        self.assertEqual(2, metrics["mismatch"])
+        status_dict = dict(Order.objects.values_list("order_number", "order_status"))
+        self.assertEqual({"1": 1, "2": 3, "3": 0, "4": 3, "5": 0, "6": 0}, status_dict)
+
+    def test_timeout(self):
+        """测试查询超时的订单不处理"""
+        metrics = reconcile_payments(FakeAliPayGateway(default_status="TRADE_SUCCESS", delay=0.5),
+                                     workers=5, timeout=0.1, limit=5)
+        self.assertEqual(5, metrics["timeout"])
+        self.assertEqual(0, metrics["paid"])
+        # 每次查询在超时时间以后结束，不等待模拟的耗时
+        self.assertLess(metrics["elapsed"], 0.5)
+        self.assertFalse(Order.objects.filter(order_status=1).exists())
+
+
+class RefundTestCase(TestCase):
+    """课程批量退款的测试集"""
+
+    def setUp(self):
+        get_redis_connection("default").flushall()
+        User = get_user_model()
+        self.user_list = [User.objects.create_user(username=f"test{i}", password="123456", mobile=f"1330000000{i}")
+                          for i in range(3)]
+        self.course = Course.objects.create(name="下架课程", price=100)
+        self.other_course = Course.objects.create(name="其他课程", price=100)
+        self.order_list = [
+            create_order(self.user_list[0], [self.course], order_number="1", credit=20),
+            create_order(self.user_list[1], [self.course, self.other_course], order_number="2"),
+            create_order(self.user_list[2], [self.course], order_number="3"),
+        ]
+        Order.objects.filter(order_number="2").update(real_price=150)
+        for order in self.order_list:
+            fulfill_order(order)
+
+    def test_refund(self):
+        """测试整单退款和部分退款，以及支付宝系统繁忙时重试"""
+        batch_no = create_course_refunds(self.course.id, reason="课程下架")
+        self.assertEqual({"total": 3, "success": 0, "fail": 0}, get_refund_progress(batch_no))
+        self.assertEqual(75, Refund.objects.get(order__order_number="2").amount)
+        # 重复创建的退款请求被忽略
+        self.assertEqual(0, get_refund_progress(create_course_refunds(self.course.id))["total"])
+
+        gateway = FakeAliPayGateway(refund_errors={"3": "ACQ.SYSTEM_ERROR"})
+        stats = process_refunds(gateway)
+        self.assertEqual({"total": 3, "success": 2, "fail": 0, "retry": 1}, stats)
+        self.assertEqual({"total": 3, "success": 2, "fail": 0}, get_refund_progress(batch_no))
+
+        status_dict = dict(Order.objects.values_list("order_number", "order_status"))
+        self.assertEqual({"1": 4, "2": 1, "3": 1}, status_dict)
+        self.user_list[0].refresh_from_db()
+        self.assertEqual(20, self.user_list[0].credit)
+        self.assertEqual([(self.user_list[1].id, self.other_course.id), (self.user_list[2].id, self.course.id)],
+                         list(UserCourse.objects.order_by("user_id").values_list("user_id", "course_id")))
+
+        # 等待重试的退款请求到达处理时间以后再次处理
+        self.assertEqual(0, process_refunds(gateway)["total"])
+        Refund.objects.filter(status=0).update(next_retry_time=datetime.now())
+        self.assertEqual(1, process_refunds(FakeAliPayGateway())["success"])
+        self.assertEqual({"total": 3, "success": 3, "fail": 0}, get_refund_progress(batch_no))
+
+    def test_refund_failed(self):
+        """测试退款失败时不修改订单"""
+        batch_no = create_course_refunds(self.course.id)
+        errors = {"1": "ACQ.TRADE_HAS_CLOSE", "2": "timeout", "3": "20000"}
+        stats = process_refunds(FakeAliPayGateway(refund_errors=errors))
+        self.assertEqual({"total": 3, "success": 0, "fail": 1, "retry": 2}, stats)
+        self.assertEqual({"total": 3, "success": 0, "fail": 1}, get_refund_progress(batch_no))
+        self.assertFalse(Order.objects.filter(order_status=4).exists())
+        self.assertEqual(4, UserCourse.objects.count())
+
+    def test_expired_progress(self):
+        """测试退款进度过期以后不再重新创建，从数据库中统计进度"""
+        batch_no = create_course_refunds(self.course.id)
+        get_redis_connection("default").delete(f"{constants.REFUND_PROGRESS_KEY}:{batch_no}")
+        process_refunds(FakeAliPayGateway())
+        self.assertFalse(get_redis_connection("default").exists(f"{constants.REFUND_PROGRESS_KEY}:{batch_no}"))
+        self.assertEqual({"total": 3, "success": 3, "fail": 0}, get_refund_progress(batch_no))
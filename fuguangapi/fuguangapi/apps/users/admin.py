@@ -1,7 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin, _
 
 from .models import User, Credit
+from .services import change_credit, CreditNotEnough
 
 
 class UserModelAdmin(UserAdmin):
@@ -25,26 +26,24 @@ class UserModelAdmin(UserAdmin):
     )
 
     def save_model(self, request, obj, form, change):
+        """积分通过积分流水变更，保存用户信息时不直接覆盖积分字段"""
         if change:
             """更新用户信息"""
-            user = User.objects.get(pk=obj.pk)
-            has_credit = user.credit
-            new_credit = obj.credit
-
-            Credit.objects.create(
-                user=user,
-                number=int(new_credit - has_credit),
-                operation=2
-            )
-        obj.save()
-
-        if not change:
+            number = obj.credit - (form.initial.get("credit") or 0)
+            update_fields = [field.name for field in obj._meta.concrete_fields
+                             if not field.primary_key and field.name != "credit"]
+            obj.save(update_fields=update_fields)
+        else:
             """创建用户信息"""
-            Credit.objects.create(
-                user=obj.id,
-                number=obj.credit,
-                operation=2
-            )
+            number, obj.credit = obj.credit, 0
+            obj.save()
+
+        if number:
+            try:
+                change_credit(obj.pk, number, operation=2, remark="后台调整积分")
+            except CreditNotEnough:
+                self.message_user(request, "用户的积分不足，积分调整失败！", level=messages.ERROR)
+            obj.refresh_from_db(fields=["credit"])
 
 
 admin.site.register(User, UserModelAdmin)
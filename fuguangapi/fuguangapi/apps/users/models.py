@@ -59,13 +59,17 @@ class Credit(BaseModel):
     number = models.IntegerField(default=0, verbose_name="积分数量",
                                  help_text="如果是扣除积分则需要设置积分为负数，如果消费10积分，则填写-10，<br>如果是添加积分则需要设置积分为正数，如果获得10积分，则填写10。")
     user = models.ForeignKey(User, related_name='user_credits', on_delete=models.CASCADE, db_constraint=False,
-                             verbose_name="用户")
+                             db_index=False, verbose_name="用户")
     remark = models.CharField(max_length=500, null=True, blank=True, verbose_name="备注信息")
 
     class Meta:
         db_table = 'fg_credit'
         verbose_name = '积分流水'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 用户的积分流水，以及快照之后新增的积分流水
+            models.Index(fields=["user", "-id"], name="fg_credit_user_idx"),
+        ]
 
     def __str__(self):
         if self.number > 0:
@@ -78,10 +82,33 @@ class Credit(BaseModel):
             abs(self.number))
 
 
+class CreditSnapshot(models.Model):
+    """
+    积分余额快照
+    记录截止到某一条积分流水时用户的积分余额和流水数量，
+    查询余额和流水总数时只需要统计快照之后新增的积分流水
+    """
+    user = models.ForeignKey(User, related_name='credit_snapshots', on_delete=models.CASCADE, db_constraint=False,
+                             db_index=False, verbose_name="用户")
+    credit_id = models.BigIntegerField(default=0, verbose_name="最后一条积分流水ID")
+    balance = models.IntegerField(default=0, verbose_name="积分余额")
+    total = models.IntegerField(default=0, verbose_name="积分流水数量")
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        db_table = 'fg_credit_snapshot'
+        verbose_name = '积分余额快照'
+        verbose_name_plural = verbose_name
+        indexes = [
+            # 用户最新的积分余额快照
+            models.Index(fields=["user", "-credit_id"], name="fg_credit_snapshot_idx"),
+        ]
+
+
 class UserCourse(BaseModel):
     """用户的课程"""
     user = models.ForeignKey(User, related_name='user_courses', on_delete=models.CASCADE, verbose_name="用户",
-                             db_constraint=False)
+                             db_constraint=False, db_index=False)
     course = models.ForeignKey(Course, related_name='course_users', on_delete=models.CASCADE, verbose_name="课程名称",
                                db_constraint=False)
     chapter = models.ForeignKey(CourseChapter, related_name="user_chapter", on_delete=models.DO_NOTHING, null=True,
@@ -94,6 +121,10 @@ class UserCourse(BaseModel):
         db_table = 'fg_user_course'
         verbose_name = '用户课程购买记录'
         verbose_name_plural = verbose_name
+        constraints = [
+            # 同一个用户不能重复购买同一个课程，同时用于判断用户是否购买了课程
+            models.UniqueConstraint(fields=["user", "course"], name="fg_user_course_uniq"),
+        ]
 
     def progress(self):
         """学习进度"""
@@ -138,7 +169,7 @@ class UserCourse(BaseModel):
 
 class StudyProgress(models.Model):
     user = models.ForeignKey(User, related_name='to_progress', on_delete=models.CASCADE, verbose_name="用户",
-                             db_constraint=False)
+                             db_constraint=False, db_index=False)
     lesson = models.ForeignKey(CourseLesson, related_name="to_progress", on_delete=models.DO_NOTHING, null=True,
                                blank=True, verbose_name="课时信息", db_constraint=False)
     study_time = models.IntegerField(default=0, verbose_name="学习时长")
@@ -147,6 +178,10 @@ class StudyProgress(models.Model):
         db_table = 'fg_study_progress'
         verbose_name = '课时进度记录'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 查询用户的课时学习进度
+            models.Index(fields=["user", "lesson"], name="fg_study_progress_idx"),
+        ]
 
 
 class StudyCode(models.Model):
@@ -0,0 +1,19 @@
+from fuguangapi.utils.paginations import PageNumberPagination
+
+
+class UserCourseListPageNumberPagination(PageNumberPagination):
+    """用户课程列表分页器"""
+    page_size = 5
+    page_size_query_param = 'size'
+    page_query_param = 'page'
+    max_page_size = 20
+    keyset_ordering = ('-id',)
+
+
+class CreditListPageNumberPagination(PageNumberPagination):
+    """积分流水分页器"""
+    page_size = 10
+    page_size_query_param = 'size'
+    page_query_param = 'page'
+    max_page_size = 50
+    keyset_ordering = ('-id',)
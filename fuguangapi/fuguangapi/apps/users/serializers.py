@@ -7,7 +7,7 @@ from rest_framework import serializers
 import constants
 from authenticate import generate_jwt_token
 from tencentcloudapi import TencentCloudAPI
-from .models import User, UserCourse
+from .models import User, UserCourse, Credit
 
 
 class UserRegisterModelSerializer(serializers.ModelSerializer):
@@ -125,3 +125,13 @@ class UserCourseModelSerializer(serializers.ModelSerializer):
         fields = ["course_id", "course_cover", "course_name", "study_time", "chapter_id", "chapter_orders",
                   "chapter_name", "lesson_id", "lesson_orders", "lesson_name", "course_type", "get_course_type_display",
                   "progress", "note", "qa", "code"]
+
+
+class CreditModelSerializer(serializers.ModelSerializer):
+    """
+    积分流水序列化器
+    """
+
+    class Meta:
+        model = Credit
+        fields = ["id", "number", "operation", "get_operation_display", "remark", "created_time"]
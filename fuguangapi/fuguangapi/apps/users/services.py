@@ -0,0 +1,142 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum, Count, Max, Case, When, Value, IntegerField
+from django.utils import timezone as datetime
+
+import constants
+from .models import User, Credit, CreditSnapshot
+
+
+class CreditNotEnough(ValueError):
+    """用户的积分不足"""
+    pass
+
+
+def change_credits(credit_list):
+    """
+    批量变更用户的积分：使用F()表达式只更新用户表的积分字段，并在同一个事务中写入积分流水
+    :param credit_list: 积分流水列表[未保存的Credit模型对象]，number为正数表示增加积分，负数表示扣除积分
+    :return: 保存以后的积分流水列表
+    """
+    credit_list = [credit for credit in credit_list if credit.number]
+    if not credit_list:
+        return []
+
+    delta_map = defaultdict(int)
+    for credit in credit_list:
+        delta_map[credit.user_id] += credit.number
+
+    with transaction.atomic():
+        # 扣除积分时，条件更新保证余额不会被扣成负数，每个用户一条UPDATE语句
+        increase_map = {}
+        for user_id, delta in delta_map.items():
+            if delta >= 0:
+                increase_map[user_id] = delta
+            elif not User.objects.filter(pk=user_id, credit__gte=-delta).update(credit=F("credit") + delta):
+                raise CreditNotEnough(f"用户{user_id}的积分不足")
+
+        # 增加积分的所有用户使用一条UPDATE语句
+        if increase_map:
+            User.objects.filter(pk__in=increase_map).update(credit=F("credit") + Case(
+                *[When(pk=user_id, then=Value(delta)) for user_id, delta in increase_map.items()],
+                default=Value(0), output_field=IntegerField(),
+            ))
+
+        Credit.objects.bulk_create(credit_list)
+    return credit_list
+
+
+def change_credit(user_id, number, operation, remark=None):
+    """
+    变更单个用户的积分
+    :param user_id: 用户ID
+    :param number: 积分数量，正数表示增加积分，负数表示扣除积分
+    :param operation: 积分操作类型，参考 Credit.opera_choices
+    :param remark: 备注信息
+    :return: 积分流水，积分数量为0时返回None
+    """
+    credit_list = change_credits([Credit(user_id=user_id, number=number, operation=operation, remark=remark)])
+    return credit_list[0] if credit_list else None
+
+
+def get_last_credit_snapshots(user_id_list):
+    """
+    批量获取用户最新的积分余额快照
+    :return: 字典 {用户ID: CreditSnapshot}，没有快照的用户不在字典中
+    """
+    snapshot_dict = {}
+    for snapshot in CreditSnapshot.objects.filter(user_id__in=user_id_list).order_by("user_id", "-credit_id"):
+        snapshot_dict.setdefault(snapshot.user_id, snapshot)
+    return snapshot_dict
+
+
+def get_credit_summary(user_id):
+    """
+    获取用户的积分余额和积分流水数量，只统计最新快照之后新增的积分流水
+    :return: 字典 {"credit": 积分余额, "total": 积分流水数量}
+    """
+    snapshot = get_last_credit_snapshots([user_id]).get(user_id)
+    with transaction.atomic():
+        if snapshot is None:
+            # 还没有生成快照的用户，积分余额以用户表为准
+            credit = User.objects.filter(pk=user_id).values_list("credit", flat=True).first() or 0
+            return {"credit": credit, "total": Credit.objects.filter(user_id=user_id).count()}
+
+        data = Credit.objects.filter(user_id=user_id, id__gt=snapshot.credit_id).aggregate(
+            number=Sum("number"), total=Count("id"))
+    return {
+        "credit": snapshot.balance + (data["number"] or 0),
+        "total": snapshot.total + data["total"],
+    }
+
+
+def create_credit_snapshots(batch_size=constants.CREDIT_SNAPSHOT_BATCH_SIZE, lag=constants.CREDIT_SNAPSHOT_LAG):
+    """
+    为上一次快照之后积分发生了变化的用户生成新的积分余额快照
+    :param lag: 只统计写入超过lag秒的积分流水，等待ID较小但是还没有提交的积分流水
+    :return: 本次生成的快照数量
+    """
+    last_credit_id = CreditSnapshot.objects.aggregate(credit_id=Max("credit_id"))["credit_id"] or 0
+
+    with transaction.atomic():
+        # 本次快照截止到lag秒之前写入的最后一条积分流水[从主键索引的末尾倒序查找，只扫描最近写入的积分流水]，
+        # 同一个事务中读取到的用户积分与积分流水是一致的
+        credit_id = Credit.objects.filter(created_time__lte=datetime.now() - timedelta(seconds=lag)).order_by(
+            "-id").values_list("id", flat=True).first() or 0
+        if credit_id <= last_credit_id:
+            return 0
+
+        change_list = list(Credit.objects.filter(id__gt=last_credit_id, id__lte=credit_id).values(
+            "user_id").annotate(number=Sum("number"), total=Count("id")).order_by("user_id"))
+
+        snapshot_list = []
+        for start in range(0, len(change_list), batch_size):
+            batch = change_list[start:start + batch_size]
+            user_id_list = [item["user_id"] for item in batch]
+            snapshot_dict = get_last_credit_snapshots(user_id_list)
+            new_user_id_list = [user_id for user_id in user_id_list if user_id not in snapshot_dict]
+
+            # 第一次生成快照的用户，根据用户表的积分余额倒推截止到本次快照时的余额
+            credit_dict = dict(User.objects.filter(pk__in=new_user_id_list).values_list("id", "credit"))
+            after_dict = {item["user_id"]: item for item in Credit.objects.filter(
+                user_id__in=new_user_id_list, id__gt=credit_id).values("user_id").annotate(
+                number=Sum("number")).order_by("user_id")}
+            before_dict = {item["user_id"]: item for item in Credit.objects.filter(
+                user_id__in=new_user_id_list, id__lte=last_credit_id).values("user_id").annotate(
+                total=Count("id")).order_by("user_id")}
+
+            for item in batch:
+                user_id = item["user_id"]
+                snapshot = snapshot_dict.get(user_id)
+                if snapshot is not None:
+                    balance = snapshot.balance + item["number"]
+                    total = snapshot.total + item["total"]
+                else:
+                    balance = credit_dict.get(user_id, 0) - after_dict.get(user_id, {}).get("number", 0)
+                    total = before_dict.get(user_id, {}).get("total", 0) + item["total"]
+                snapshot_list.append(CreditSnapshot(user_id=user_id, credit_id=credit_id, balance=balance, total=total))
+
+        CreditSnapshot.objects.bulk_create(snapshot_list, batch_size=batch_size)
+    return len(snapshot_list)
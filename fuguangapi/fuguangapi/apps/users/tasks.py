@@ -2,6 +2,8 @@ from celery import shared_task
 from ronglianyunapi import send_sms as sms
 import logging
 
+from .services import create_credit_snapshots
+
 # 记录日志
 logger = logging.getLogger("django")
 
@@ -13,3 +15,9 @@ def send_sms(tid, mobile, datas):
         return sms(tid, mobile, datas)
     except Exception as e:
         logger.error(f"发送短信失败 - {e}")
+
+
+@shared_task(name="create_credit_snapshots")
+def create_credit_snapshots_task():
+    """定时为积分发生变化的用户生成积分余额快照"""
+    return create_credit_snapshots()
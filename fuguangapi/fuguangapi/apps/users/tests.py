@@ -1,13 +1,20 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone as datetime
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from .models import Credit, CreditSnapshot
+from .services import CreditNotEnough, change_credit, change_credits, create_credit_snapshots, get_credit_summary
+
 # 编写测试的接口地址
 TOKEN_URL = "/users/login/"
 MOBILE_URL = "/users/mobile/"
 REGISTER_URL = "/users/register/"
 SMS_URL = "/users/sms/"
+CREDIT_URL = "/users/credit/"
 
 
 def create_user(**params):
@@ -134,3 +141,86 @@ class RegisterTestCase(TestCase):
     def test_empty_password(self):
         """测试空密码是否通过测试"""
         pass
+
+
+class CreditTestCase(TestCase):
+    """积分流水与积分余额快照的测试集"""
+
+    def setUp(self):
+        self.user = create_user(username="xiaoming", password="123456", mobile="13334500000", credit=100)
+        self.other = create_user(username="xiaohong", password="123456", mobile="13334500001")
+
+    def test_change_credits(self):
+        """测试批量变更积分，同时写入积分流水"""
+        change_credits([
+            Credit(user_id=self.user.id, number=-30, operation=1),
+            Credit(user_id=self.other.id, number=20, operation=2),
+            Credit(user_id=self.other.id, number=0, operation=2),
+        ])
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(70, self.user.credit)
+        self.assertEqual(20, self.other.credit)
+        self.assertEqual(2, Credit.objects.count())
+
+    def test_credit_not_enough(self):
+        """测试积分不足时不扣除积分，也不写入积分流水"""
+        with self.assertRaises(CreditNotEnough):
+            change_credit(self.user.id, -101, operation=1)
+        self.user.refresh_from_db()
+        self.assertEqual(100, self.user.credit)
+        self.assertFalse(Credit.objects.exists())
+
+    def test_credit_snapshots(self):
+        """测试积分余额从快照开始统计，与用户表的积分一致"""
+        change_credit(self.user.id, -10, operation=1)
+        self.assertEqual({"credit": 90, "total": 1}, get_credit_summary(self.user.id))
+        self.assertEqual(1, create_credit_snapshots(lag=0))
+        self.assertEqual(0, create_credit_snapshots(lag=0))
+
+        change_credit(self.user.id, 5, operation=2)
+        change_credit(self.other.id, 8, operation=2)
+        # 刚写入的积分流水等待一段时间以后才生成快照
+        self.assertEqual(0, create_credit_snapshots())
+        self.assertEqual(2, create_credit_snapshots(lag=0))
+        self.assertEqual(95, CreditSnapshot.objects.filter(user=self.user).order_by("-credit_id").first().balance)
+
+        change_credit(self.user.id, -15, operation=1)
+        self.assertEqual({"credit": 80, "total": 3}, get_credit_summary(self.user.id))
+        self.assertEqual({"credit": 8, "total": 1}, get_credit_summary(self.other.id))
+
+    def test_late_commit_credit(self):
+        """测试ID较小的积分流水在快照之后才提交，仍然会被统计"""
+        change_credit(self.user.id, -10, operation=1)
+        Credit.objects.update(created_time=datetime.now() - timedelta(hours=1))
+        change_credit(self.user.id, -20, operation=1)
+        late_id = Credit.objects.order_by("-id").first().id + 1
+        change_credit(self.user.id, -30, operation=1)
+        Credit.objects.filter(number=-30).update(id=late_id + 1)
+
+        # 快照只截止到写入超过一段时间的积分流水
+        self.assertEqual(1, create_credit_snapshots())
+        self.assertEqual(90, CreditSnapshot.objects.get().balance)
+
+        # 模拟ID较小的积分流水在快照之后才提交
+        change_credits([Credit(id=late_id, user_id=self.user.id, number=-5, operation=1)])
+        Credit.objects.update(created_time=datetime.now() - timedelta(hours=1))
+        self.assertEqual(1, create_credit_snapshots())
+        self.assertEqual({"credit": 35, "total": 4}, get_credit_summary(self.user.id))
+        self.user.refresh_from_db()
+        self.assertEqual(35, self.user.credit)
+
+    def test_credit_api(self):
+        """测试积分余额与积分流水接口"""
+        for number in range(1, 13):
+            change_credit(self.user.id, number, operation=2)
+        create_credit_snapshots(lag=0)
+        change_credit(self.user.id, -1, operation=1)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(CREDIT_URL)
+        self.assertEqual({"credit": 177, "total": 13}, response.data)
+        response = client.get(f"{CREDIT_URL}list/")
+        self.assertEqual(13, response.data["count"])
+        self.assertEqual(-1, response.data["results"][0]["number"])
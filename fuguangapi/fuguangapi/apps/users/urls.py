@@ -11,4 +11,6 @@ urlpatterns = [
     re_path("^course/(?P<course_id>[0-9]+)/$", views.UserCourseAPIView.as_view()),
     path("lesson/", views.StudyLessonAPIView.as_view()),
     path("progress/", views.StudyProgressAPIView.as_view()),
+    path("credit/", views.CreditAPIView.as_view()),
+    path("credit/list/", views.CreditListAPIView.as_view()),
 ]
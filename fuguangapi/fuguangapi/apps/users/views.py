@@ -13,10 +13,11 @@ from rest_framework_jwt.views import ObtainJSONWebToken
 
 import constants
 from courses.models import Course, CourseLesson
-from courses.paginations import CourseListPageNumberPagination
 from fuguangapi.utils.tencentcloudapi import TencentCloudAPI, TencentCloudSDKException
-from .models import User, UserCourse, StudyProgress
-from .serializers import UserRegisterModelSerializer, UserCourseModelSerializer
+from .models import User, UserCourse, StudyProgress, Credit
+from .paginations import UserCourseListPageNumberPagination, CreditListPageNumberPagination
+from .serializers import UserRegisterModelSerializer, UserCourseModelSerializer, CreditModelSerializer
+from .services import get_credit_summary
 # from ronglianyunapi import send_sms
 # from mycelery.sms.tasks import send_sms
 from .tasks import send_sms
@@ -119,7 +120,7 @@ class CourseListAPiView(ListAPIView):
     """
     permission_classes = [IsAuthenticated]
     serializer_class = UserCourseModelSerializer
-    pagination_class = CourseListPageNumberPagination
+    pagination_class = UserCourseListPageNumberPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -248,3 +249,26 @@ class StudyProgressAPIView(APIView):
                 logger.error(f"更新课时进度失败！:{e}")
                 transaction.savepoint_rollback(save_id)
                 return Response({"error": "当前课时学习进度丢失！"})
+
+
+class CreditAPIView(APIView):
+    """用户的积分余额"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """积分余额和积分流水数量从最新的快照开始统计，不扫描用户的全部积分流水"""
+        return Response(get_credit_summary(request.user.id))
+
+
+class CreditListAPIView(ListAPIView):
+    """用户的积分流水"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = CreditModelSerializer
+    pagination_class = CreditListPageNumberPagination
+
+    def get_queryset(self):
+        return Credit.objects.filter(user=self.request.user).order_by("-id")
+
+    def get_pagination_count(self, queryset):
+        """积分流水总数从最新的快照开始统计"""
+        return get_credit_summary(self.request.user.id)["total"]
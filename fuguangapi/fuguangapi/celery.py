@@ -15,3 +15,47 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # 注册任务
 app.autodiscover_tasks()
+
+# 定时任务
+app.conf.beat_schedule = {
+    # 每10秒从延时队列中取出已经过期的订单并取消
+    "sweep_timeout_orders": {
+        "task": "sweep_timeout_orders",
+        "schedule": 10.0,
+    },
+    # 每秒处理一次排队下单的队列[下单接口入队以后也会触发，这里用于兜底]
+    "process_order_queue": {
+        "task": "process_order_queue",
+        "schedule": 1.0,
+    },
+    # 每10秒重新计算一次到达开始或结束时间的活动的课程价格快照
+    "sweep_activity_price": {
+        "task": "sweep_activity_price",
+        "schedule": 10.0,
+    },
+    # 每10分钟对账一次用户的订单数量
+    "reconcile_order_counts": {
+        "task": "reconcile_order_counts",
+        "schedule": 600.0,
+    },
+    # 每5秒处理一次支付宝的异步通知[接收通知以后也会触发，这里用于兜底]
+    "process_payment_notify": {
+        "task": "process_payment_notify",
+        "schedule": 5.0,
+    },
+    # 每5分钟对账一次未支付的订单
+    "reconcile_payments": {
+        "task": "reconcile_payments",
+        "schedule": 300.0,
+    },
+    # 每10秒处理一次到达处理时间的退款请求[包括等待重试的请求]
+    "process_refunds": {
+        "task": "process_refunds",
+        "schedule": 10.0,
+    },
+    # 每小时生成一次积分余额快照
+    "create_credit_snapshots": {
+        "task": "create_credit_snapshots",
+        "schedule": 3600.0,
+    },
+}
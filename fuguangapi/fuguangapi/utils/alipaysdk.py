@@ -1,9 +1,17 @@
+import copy
+import os
+import threading
 from datetime import datetime
 
 from alipay import AliPay
 from alipay.utils import AliPayConfig
 from django.conf import settings
 
+# 进程内共享的SDK实例，以及创建实例时密钥文件的修改时间
+_sdk = None
+_sdk_key_mtimes = None
+_sdk_lock = threading.Lock()
+
 
 class AliPaySDK(AliPay):
     """支付宝支付SDK"""
@@ -15,8 +23,10 @@ class AliPaySDK(AliPay):
             self.config = config
 
         # 读取公钥私钥文件
-        app_private_key_string = open(settings.ALIPAY["app_private_key_path"]).read()
-        alipay_public_key_string = open(settings.ALIPAY["alipay_public_key_path"]).read()
+        with open(self.config["app_private_key_path"]) as f:
+            app_private_key_string = f.read()
+        with open(self.config["alipay_public_key_path"]) as f:
+            alipay_public_key_string = f.read()
         super().__init__(
             appid=self.config["appid"],
             app_notify_url=self.config["notify_url"],  # 默认全局回调 url
@@ -29,6 +39,15 @@ class AliPaySDK(AliPay):
             config=AliPayConfig(timeout=self.config["timeout"])  # 可选，请求超时时间，单位：秒
         )
 
+    def with_timeout(self, timeout):
+        """
+        复制一个请求超时时间不同的SDK实例，批量任务使用更短的超时时间，避免卡住的请求长时间占用线程
+        复制的实例共享已经解析的密钥，不重新读取密钥文件
+        """
+        sdk = copy.copy(self)
+        sdk._config = AliPayConfig(timeout=timeout)
+        return sdk
+
     def page_pay(self, order_number, real_price, order_name):
         """生成支付链接"""
         order_string = self.client_api(
@@ -63,19 +82,20 @@ class AliPaySDK(AliPay):
             }
         )
 
-    def refund(self, order_number, real_price):
+    def refund(self, order_number, refund_amount, out_request_no=None):
         """
         原路退款
         @params order_number: 退款的订单号
-        @params real_price: 退款的订单金额
+        @params refund_amount: 退款金额
+        @params out_request_no: 退款请求号，部分退款时必须传递，同一个退款请求号重复调用只会退款一次
         """
-        self.server_api(
-            "alipay.rade.refund",
-            biz_content={
-                "out_trade_no": order_number,
-                "refund_amount": real_price
-            }
-        )
+        biz_content = {
+            "out_trade_no": order_number,
+            "refund_amount": float(refund_amount),
+        }
+        if out_request_no:
+            biz_content["out_request_no"] = out_request_no
+        return self.server_api("alipay.trade.refund", biz_content=biz_content)
 
     def transfer(self, account, amount):
         """
@@ -92,3 +112,31 @@ class AliPaySDK(AliPay):
                 "amount": amount
             }
         )
+
+
+def get_key_mtimes(config):
+    """获取公钥私钥文件的修改时间"""
+    return (
+        os.stat(config["app_private_key_path"]).st_mtime_ns,
+        os.stat(config["alipay_public_key_path"]).st_mtime_ns,
+    )
+
+
+def get_alipay_sdk():
+    """
+    获取进程内共享的支付宝SDK实例
+    SDK实例只在创建时读取并解析密钥文件，签名和验签不修改实例的状态，可以在多个线程中共享，
+    每次获取时只检查密钥文件的修改时间，密钥文件被替换以后重新创建实例
+    """
+    global _sdk, _sdk_key_mtimes
+    key_mtimes = get_key_mtimes(settings.ALIPAY)
+    sdk = _sdk
+    if sdk is not None and _sdk_key_mtimes == key_mtimes:
+        return sdk
+
+    with _sdk_lock:
+        # 等待锁的期间，其他线程可能已经创建了新的实例
+        if _sdk is None or _sdk_key_mtimes != key_mtimes:
+            _sdk = AliPaySDK()
+            _sdk_key_mtimes = key_mtimes
+        return _sdk
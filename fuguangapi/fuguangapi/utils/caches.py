@@ -0,0 +1,108 @@
+"""
+带版本号的缓存工具
+缓存的内容与相关模型的版本号绑定，模型数据发生变化时版本号自增，缓存自动失效
+"""
+import time
+
+import constants
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+
+def get_model_version_key(model):
+    """模型数据版本号在redis中的key"""
+    return f"{constants.MODEL_VERSION_KEY}:{model._meta.label_lower}"
+
+
+def get_model_versions(models):
+    """
+    获取多个模型的数据版本号
+    :param models: 模型类列表
+    :return: 版本号组成的字符串，例如 "1634000000000.1634000000001"
+    """
+    keys = [get_model_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # 版本号不存在[首次访问或者redis数据被清空]，使用当前时间戳作为初始版本号，避免与之前的版本号重复
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return ".".join(str(versions[key]) for key in keys)
+
+
+def bump_model_version(sender, **kwargs):
+    """模型数据发生变化时，自增模型的数据版本号"""
+    key = get_model_version_key(sender)
+    # 版本号不存在时，使用当前时间戳作为新的版本号，存在则自增
+    if not cache.add(key, int(time.time() * 1000), None):
+        cache.incr(key)
+
+
+def bump_model_version_on_commit(sender, using=None, **kwargs):
+    """
+    事务提交以后才自增模型的数据版本号
+    在提交之前自增版本号，其他请求会把还没有提交的旧数据按照新的版本号写入缓存，直到下一次数据变化都不会失效
+    """
+    transaction.on_commit(lambda: bump_model_version(sender), using=using)
+
+
+def register_cache_models(*models):
+    """当模型数据保存或删除时，自动更新模型的数据版本号"""
+    for model in models:
+        dispatch_uid = f"bump_version_{model._meta.label_lower}"
+        post_save.connect(bump_model_version_on_commit, sender=model, dispatch_uid=dispatch_uid)
+        post_delete.connect(bump_model_version_on_commit, sender=model, dispatch_uid=dispatch_uid)
+
+
+def get_or_refresh(key, version, refresh, timeout=constants.LIST_PAGE_CACHE_TIME):
+    """
+    读取带版本号的缓存
+    缓存过期或版本号发生变化时，只允许一个请求重新计算缓存，其他请求在此期间继续返回旧数据，避免缓存击穿
+    :param key: 缓存的key
+    :param version: 缓存数据对应的版本号
+    :param refresh: 重新计算缓存数据的函数
+    :param timeout: 缓存的有效期，单位：秒
+    :return: 缓存数据
+    """
+    item = cache.get(key)
+    if item and item["version"] == version and item["expire"] > time.time():
+        return item["data"]
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, constants.CACHE_LOCK_TIME):
+        try:
+            data = refresh()
+            cache.set(key, {"version": version, "expire": time.time() + timeout, "data": data},
+                      timeout + constants.CACHE_STALE_TIME)
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    if item:
+        # 其他请求正在重新计算缓存，先返回旧数据
+        return item["data"]
+
+    # 没有任何旧数据，等待其他请求计算完成
+    for _ in range(constants.CACHE_LOCK_TIME * 10):
+        time.sleep(0.1)
+        item = cache.get(key)
+        if item and item["version"] == version:
+            return item["data"]
+
+    return refresh()
+
+
+def get_cached_count(key, queryset, timeout=constants.PAGINATION_COUNT_CACHE_TIME):
+    """
+    读取缓存的查询集总数，缓存不存在时查询数据库并写入缓存
+    :param key: 缓存的key，需要包含查询条件，如果数据变化需要失效，还要包含模型的数据版本号
+    :param queryset: 查询集
+    :param timeout: 缓存的有效期，单位：秒
+    :return: 总数
+    """
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
@@ -17,9 +17,73 @@ NAV_FOOTER_SIZE = 7
 # 轮播广告的显示数量
 BANNER_SIZE = 10
 
+# 首页推荐课程的显示数量
+HOME_COURSE_SIZE = 8
+
+# 首页推荐学习方向的显示数量
+HOME_DIRECTION_SIZE = 6
+
+# 首页聚合数据在redis中的key
+HOME_PAYLOAD_KEY = "home_payload"
+
 # 通用列表的缓存时间，单位：秒
 LIST_PAGE_CACHE_TIME = 60 * 60 * 24
 
+# 通用列表的缓存在redis中的key前缀名称
+LIST_PAGE_CACHE_KEY = "list_page"
+
+# 缓存过期以后，允许继续返回旧数据的时间，单位：秒
+CACHE_STALE_TIME = 60 * 5
+
+# 重新计算缓存时的锁的有效期，单位：秒
+CACHE_LOCK_TIME = 10
+
+# 模型数据版本号在redis中的key前缀名称
+MODEL_VERSION_KEY = "model_version"
+
+# 课程详情在redis中的key前缀名称
+COURSE_DETAIL_CACHE_KEY = "course_detail"
+
+# 课程详情的缓存时间，单位：秒
+COURSE_DETAIL_CACHE_TIME = 60 * 60 * 24
+
+# 章节课时列表的客户端缓存时间，单位：秒
+COURSE_LESSON_CACHE_TIME = 60 * 5
+
+# 分页总数在redis中的key前缀
+PAGINATION_COUNT_CACHE_KEY = "pagination_count"
+
+# 分页总数的缓存时间，单位：秒
+PAGINATION_COUNT_CACHE_TIME = 60
+
+# 课程列表总数在redis中的key前缀
+COURSE_COUNT_CACHE_KEY = "course_count"
+
+# 课程列表总数的缓存时间，单位：秒[课程发生变化时，数据版本号变化，缓存自动失效]
+COURSE_COUNT_CACHE_TIME = 60 * 60
+
+# 活动开始或结束时重新计算课程价格快照的待处理队列在redis中的key，
+# zset类型，member为活动ID，score为活动下一个开始或结束的时间戳[同一个活动只保留一条，重复保存活动不会重复计算]
+ACTIVITY_PRICE_REFRESH_KEY = "activity_price_refresh"
+
+# 每次从待处理队列中取出的活动数量
+ACTIVITY_PRICE_REFRESH_SIZE = 100
+
+# 用户订单数量在redis中的key前缀，hash类型，field为订单状态，all表示全部订单
+ORDER_COUNT_KEY = "order_count"
+
+# 用户订单数量的缓存时间，单位：秒
+ORDER_COUNT_CACHE_TIME = 60 * 60 * 24
+
+# 幂等请求的结果在redis中的key前缀
+IDEMPOTENCY_KEY = "idempotency"
+
+# 幂等请求的结果保存时间[单位: 秒]
+IDEMPOTENCY_TIME = 60 * 10
+
+# 重复请求等待第一次请求结果的最长时间[单位: 秒]
+IDEMPOTENCY_WAIT_TIME = 10
+
 # 默认头像
 DEFAULT_USER_AVATAR = "avatar/2021/avatar.jpg"
 
@@ -35,8 +99,114 @@ HOT_WORD_EXPIRE = 7
 # 积分抵扣现金的比例，n积分:1元
 CREDIT_TO_MONEY = 10
 
+# 每批生成积分余额快照的用户数量
+CREDIT_SNAPSHOT_BATCH_SIZE = 1000
+
+# 积分余额快照只统计写入超过一定时间的积分流水[单位: 秒]，
+# 自增ID在事务提交之前就已经分配，ID较小的积分流水可能在ID较大的积分流水之后才提交，
+# 留出足够的时间等待这些事务提交，避免快照之后再也统计不到这些积分流水
+CREDIT_SNAPSHOT_LAG = 5 * 60
+
 # 设置订单超时超时的时间[单位: 秒]
 ORDER_TIMEOUT = 15 * 60
 
+# 每个进程每次从redis中预留的订单号序列数量
+ORDER_NUMBER_BLOCK_SIZE = 1000
+
+# 自动生成的订单号重复时，重新生成订单号的次数
+ORDER_NUMBER_RETRIES = 3
+
+# 订单超时取消的延时队列在redis中的key，zset类型，score为订单的过期时间戳
+ORDER_TIMEOUT_KEY = "order_timeout"
+
+# 每次从延时队列中取出的超时订单数量
+ORDER_SWEEP_SIZE = 500
+
+# 数据库兜底扫描超时订单时，在超时时间之后再延迟的时间[单位: 秒]，正常情况下由延时队列处理
+ORDER_SWEEP_DELAY = 5 * 60
+
+# 排队下单的队列在redis中的key，list类型
+ORDER_QUEUE_KEY = "order_queue"
+
+# 排队下单的处理结果在redis中的key前缀，hash类型
+ORDER_QUEUE_STATUS_KEY = "order_queue_status"
+
+# 排队下单的处理结果的保存时间[单位: 秒]
+ORDER_QUEUE_STATUS_TIME = 60 * 60
+
+# 触发排队下单后台任务的锁在redis中的key，锁的有效期内不重复触发[单位: 毫秒]
+ORDER_QUEUE_TRIGGER_KEY = "order_queue_trigger"
+ORDER_QUEUE_TRIGGER_TIME = 200
+
+# 每批从下单队列中取出的下单请求数量
+ORDER_QUEUE_BATCH_SIZE = 100
+
+# 正在处理的下单请求在redis中的key，zset类型，score为处理超时的时间戳，订单创建完成以后才删除
+ORDER_QUEUE_PROCESSING_KEY = "order_queue_processing"
+
+# 下单请求的处理超时时间，超时未确认的请求[进程异常退出]重新放回下单队列[单位: 秒]
+ORDER_QUEUE_PROCESSING_TIMEOUT = 60
+
+# 订单状态变化的redis发布订阅频道前缀，完整频道为 order_status:<订单号>
+ORDER_STATUS_CHANNEL = "order_status"
+
+# 客户端等待订单状态变化的最长时间，超时以后客户端重新连接[单位: 秒]
+ORDER_STATUS_STREAM_TIMEOUT = 30
+
+# 等待订单状态变化期间发送心跳的间隔，避免代理服务器断开空闲连接[单位: 秒]
+ORDER_STATUS_KEEPALIVE = 10
+
+# 每个进程同时等待订单状态变化的最大连接数量[每个连接占用一个工作线程和一个redis连接]，
+# 同步WSGI部署时必须小于每个进程的工作线程数量，使用gevent等协程worker部署时可以调大
+ORDER_STATUS_STREAM_LIMIT = 8
+
+# 等待的连接数量达到上限时，通知客户端在指定时间以后重新连接[短轮询，单位: 毫秒]
+ORDER_STATUS_STREAM_RETRY = 3000
+
+# 触发处理支付宝异步通知后台任务的锁在redis中的key，锁的有效期内不重复触发[单位: 毫秒]
+PAYMENT_NOTIFY_TRIGGER_KEY = "payment_notify_trigger"
+PAYMENT_NOTIFY_TRIGGER_TIME = 200
+
+# 每批处理的支付宝异步通知数量
+PAYMENT_NOTIFY_BATCH_SIZE = 100
+
+# 支付宝异步通知处理出错时的最大重试次数
+PAYMENT_NOTIFY_MAX_RETRIES = 5
+
+# 支付对账每批扫描的未支付订单数量
+PAYMENT_RECONCILE_BATCH_SIZE = 200
+
+# 支付对账同时查询支付宝的线程数量
+PAYMENT_RECONCILE_WORKERS = 8
+
+# 支付对账每次查询支付宝的超时时间[单位: 秒]
+PAYMENT_RECONCILE_TIMEOUT = 5
+
+# 支付对账只处理下单超过一定时间的订单，给同步/异步通知留出处理时间[单位: 秒]
+PAYMENT_RECONCILE_MIN_AGE = 60
+
+# 每批处理的退款请求数量
+REFUND_BATCH_SIZE = 50
+
+# 同时请求支付宝退款接口的线程数量
+REFUND_WORKERS = 4
+
+# 退款失败[网络错误或支付宝系统繁忙]时的最大重试次数
+REFUND_MAX_RETRIES = 5
+
+# 支付宝退款接口返回业务失败[code=40004]时，可以使用相同参数重试的错误码
+# ACQ.SYSTEM_ERROR: 系统繁忙；ACQ.SELLER_BALANCE_NOT_ENOUGH: 商户余额不足，充值以后重试
+REFUND_RETRY_SUB_CODES = {"ACQ.SYSTEM_ERROR", "ACQ.SELLER_BALANCE_NOT_ENOUGH"}
+
+# 退款重试的基础间隔，每次重试的间隔翻倍[单位: 秒]
+REFUND_RETRY_DELAY = 60
+
+# 退款请求处理中的最长时间，超过以后认为处理进程已经退出，重新处理[单位: 秒]
+REFUND_PROCESSING_TIMEOUT = 10 * 60
+
+# 批量退款进度在redis中的key前缀，hash类型，完整的key为 refund_progress:<批次号>
+REFUND_PROGRESS_KEY = "refund_progress"
+REFUND_PROGRESS_TIME = 60 * 60 * 24 * 7
+
 # 更新课时学习时间时的跳动最大阀值
 MAV_SEEK_TIME = 300
@@ -0,0 +1,192 @@
+"""
+分页工具
+默认使用页码分页，查询参数中带有 paginate=cursor 或者 cursor 时，改用游标分页[keyset分页]。
+游标分页根据上一页最后一条数据的排序字段值查询下一页，不使用OFFSET，翻页越深查询速度也不会变慢，
+游标分页默认不返回总数，查询参数中带有 count=1 时返回缓存的总数[近似值]。
+视图可以声明 get_pagination_count(queryset) 方法，从缓存中读取总数，避免每次翻页都执行COUNT(*)。
+"""
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from functools import partial
+
+import constants
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination as DRFPageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from fuguangapi.utils.caches import get_cached_count
+
+
+class CountCachedPaginator(Paginator):
+    """总数由外部提供的分页器"""
+
+    def __init__(self, *args, count_func=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_func = count_func
+
+    @cached_property
+    def count(self):
+        if self.count_func is None:
+            return super().count
+        return self.count_func()
+
+
+class KeysetPagination(object):
+    """游标分页[keyset分页]"""
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+
+    def __init__(self, ordering, page_size, count_func=None):
+        """
+        :param ordering: 排序字段，必须与查询集的排序一致，最后一个字段必须唯一，例如 ("-orders", "-id")
+        :param page_size: 每页数据量
+        :param count_func: 获取总数的函数，默认按照SQL语句缓存总数
+        """
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+        self.count_func = count_func
+
+    def encode_cursor(self, values):
+        """把排序字段值编码为不透明的游标"""
+        data = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        """把游标解码为排序字段值"""
+        try:
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(data.decode())
+        except (TypeError, ValueError):
+            raise NotFound("无效的游标")
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound("无效的游标")
+        return values
+
+    def get_ordering_field(self, queryset, name):
+        """获取排序字段对应的模型字段，排序字段也可以是查询集中的注解字段"""
+        try:
+            return queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return queryset.query.annotations[name].output_field
+
+    def clean_cursor(self, queryset, values):
+        """把游标中的值转换为排序字段的类型，客户端伪造的游标值不能直接进入查询条件"""
+        cleaned = []
+        for field, value in zip(self.ordering, values):
+            if value is None:
+                raise NotFound("无效的游标")
+            try:
+                cleaned.append(self.get_ordering_field(queryset, field.lstrip("-")).to_python(value))
+            except (DjangoValidationError, ValueError, TypeError):
+                raise NotFound("无效的游标")
+        return cleaned
+
+    def get_keyset_filter(self, values):
+        """
+        生成查询下一页的条件，例如排序字段为("-orders", "-id")时，条件为：
+        orders < v0 or (orders = v0 and id < v1)
+        """
+        condition = Q()
+        equals = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equals, **{f"{name}__{lookup}": value})
+            equals[name] = value
+        return condition
+
+    def get_count(self, queryset):
+        """获取总数，默认相同查询条件的总数缓存一段时间"""
+        if self.count_func is not None:
+            return self.count_func()
+        sql = str(queryset.query)
+        key = f"{constants.PAGINATION_COUNT_CACHE_KEY}:{hashlib.md5(sql.encode()).hexdigest()}"
+        return get_cached_count(key, queryset)
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        if tuple(queryset.query.order_by) != self.ordering:
+            raise ValidationError({"ordering": "游标分页不支持自定义排序"})
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) == "1":
+            self.count = self.get_count(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.clean_cursor(queryset, self.decode_cursor(cursor))
+            queryset = queryset.filter(self.get_keyset_filter(values))
+
+        # 多查询一条数据，用于判断是否还有下一页
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip("-")) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values))
+
+    def get_paginated_response(self, data):
+        response_data = OrderedDict()
+        if self.count is not None:
+            response_data["count"] = self.count
+        response_data["next"] = self.get_next_link()
+        response_data["results"] = data
+        return Response(response_data)
+
+
+class PageNumberPagination(DRFPageNumberPagination):
+    """
+    可以切换为游标分页的页码分页器
+    子类需要声明游标分页的排序字段 keyset_ordering，与视图中查询集的排序保持一致
+    """
+    keyset_ordering = None
+    paginate_query_param = "paginate"
+
+    def use_keyset(self, queryset, request):
+        """查询参数中带有 paginate=cursor 或者 cursor 时，使用游标分页"""
+        if not self.keyset_ordering or not isinstance(queryset, QuerySet):
+            return False
+        return (request.query_params.get(self.paginate_query_param) == "cursor"
+                or KeysetPagination.cursor_query_param in request.query_params)
+
+    def get_count_func(self, queryset, view):
+        """视图声明了 get_pagination_count 方法时，总数从视图中获取"""
+        if view is None or not hasattr(view, "get_pagination_count"):
+            return None
+        return partial(view.get_pagination_count, queryset)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        count_func = self.get_count_func(queryset, view)
+        if self.use_keyset(queryset, request):
+            page_size = self.get_page_size(request)
+            if not page_size:
+                return None
+            self.keyset = KeysetPagination(self.keyset_ordering, page_size, count_func)
+            return self.keyset.paginate_queryset(queryset, request)
+        self.django_paginator_class = partial(CountCachedPaginator, count_func=count_func)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.keyset is not None:
+            return {}
+        return super().get_html_context()
@@ -0,0 +1,124 @@
+"""
+优惠计算公式的编译工具
+优惠公式的格式：
+    0       表示免费
+    *0.82   *号开头表示折扣价，例如*0.82表示八二折
+    -100    -号开头表示减免价，例如-100表示减免100元
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.core.exceptions import ValidationError
+
+# 价格的精度，保留2位小数
+PRICE_PRECISION = Decimal("0.01")
+
+# 编译以后的优惠公式缓存，{(模型名称, 模型ID): PricingRule}
+_rule_cache = {}
+
+
+class PricingRuleError(ValueError):
+    """优惠公式格式错误"""
+    pass
+
+
+class PricingRule(object):
+    """编译以后的优惠公式"""
+
+    def __init__(self, sale):
+        self.sale = sale
+        sale = (sale or "").strip()
+        if not sale:
+            raise PricingRuleError("优惠公式不能为空")
+
+        if sale[0] in ("*", "-"):
+            self.operator = sale[0]
+            operand = sale[1:].strip()
+        else:
+            self.operator = "0"
+            operand = sale
+
+        try:
+            self.operand = Decimal(operand)
+        except InvalidOperation:
+            raise PricingRuleError(f"优惠公式格式错误：{sale}")
+
+        if not self.operand.is_finite():
+            raise PricingRuleError(f"优惠公式格式错误：{sale}")
+        if self.operator == "0" and self.operand != 0:
+            raise PricingRuleError(f"优惠公式必须以*号或-号开头，免费则填写0：{sale}")
+        if self.operator == "*" and not (0 <= self.operand <= 1):
+            raise PricingRuleError(f"折扣必须在0~1之间：{sale}")
+        if self.operator == "-" and self.operand < 0:
+            raise PricingRuleError(f"减免金额不能为负数：{sale}")
+
+    def __call__(self, price):
+        """
+        计算优惠以后的价格
+        :param price: 原价
+        :return: 优惠价格[Decimal]，最低为0
+        """
+        if not isinstance(price, Decimal):
+            price = Decimal(str(price))
+
+        if self.operator == "*":
+            price = price * self.operand
+        elif self.operator == "-":
+            price = price - self.operand
+        else:
+            price = Decimal(0)
+
+        return max(price, Decimal(0)).quantize(PRICE_PRECISION, rounding=ROUND_HALF_UP)
+
+    def apply(self, prices):
+        """
+        批量计算优惠以后的价格
+        :param prices: 原价列表
+        :return: 优惠价格列表
+        """
+        return [self(price) for price in prices]
+
+    def reduction(self, price):
+        """
+        计算优惠的金额
+        :param price: 原价
+        :return: 优惠金额[Decimal]
+        """
+        if not isinstance(price, Decimal):
+            price = Decimal(str(price))
+        return price.quantize(PRICE_PRECISION, rounding=ROUND_HALF_UP) - self(price)
+
+    def __repr__(self):
+        return f"<PricingRule {self.sale}>"
+
+
+def compile_rule(sale):
+    """编译优惠公式"""
+    return PricingRule(sale)
+
+
+def get_pricing_rule(label, pk, sale):
+    """
+    获取编译以后的优惠公式，同一条记录的优惠公式只编译一次
+    :param label: 优惠公式所属的模型名称，例如：discount、coupon
+    :param pk: 优惠公式所属的模型ID
+    :param sale: 优惠公式
+    :return: PricingRule
+    """
+    if pk is None:
+        return compile_rule(sale)
+
+    key = (label, pk)
+    rule = _rule_cache.get(key)
+    # 优惠公式被修改以后，重新编译
+    if rule is None or rule.sale != sale:
+        rule = compile_rule(sale)
+        _rule_cache[key] = rule
+    return rule
+
+
+def validate_pricing_rule(value):
+    """模型字段的验证器，保存优惠公式时验证格式"""
+    try:
+        compile_rule(value)
+    except PricingRuleError as e:
+        raise ValidationError(str(e))
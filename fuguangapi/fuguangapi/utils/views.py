@@ -1,14 +1,84 @@
+import hashlib
+import json
+import time
+
 import constants
+from django_redis import get_redis_connection
+from rest_framework import status
 from rest_framework.generics import ListAPIView as DRFListAPIView
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from fuguangapi.utils.caches import get_model_versions, get_or_refresh
 
 
 class ListAPIView(DRFListAPIView):
     """
     列表页缓存
+    缓存与模型的数据版本号绑定，模型数据发生变化以后缓存自动失效，
+    需要在模型所在应用中调用 register_cache_models 注册模型
     """
+    # 缓存依赖的模型列表，默认为queryset对应的模型
+    cache_models = None
+
+    def get_cache_models(self):
+        return self.cache_models or [self.get_queryset().model]
 
-    @method_decorator(cache_page(constants.LIST_PAGE_CACHE_TIME))
     def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = f"{constants.LIST_PAGE_CACHE_KEY}:{self.__class__.__name__}:{url}"
+        version = get_model_versions(self.get_cache_models())
+        data = get_or_refresh(key, version, lambda: super(ListAPIView, self).get(request, *args, **kwargs).data)
+        return Response(data)
+
+
+class IdempotentMixin(object):
+    """
+    幂等请求
+    客户端在请求头中携带 Idempotency-Key，相同用户、相同key的重复请求直接返回第一次请求的结果，
+    第一次请求还在处理中时，重复请求等待第一次请求的结果，而不是再执行一次
+    只缓存成功的结果，第一次请求失败以后，客户端可以使用相同的key重试
+    """
+    idempotency_header = "HTTP_IDEMPOTENCY_KEY"
+
+    def get_idempotency_key(self, request):
+        key = request.META.get(self.idempotency_header, "").strip()
+        if not key or len(key) > 64:
+            return None
+        return f"{constants.IDEMPOTENCY_KEY}:{self.__class__.__name__}:{request.user.pk}:{key}"
+
+    def post(self, request, *args, **kwargs):
+        key = self.get_idempotency_key(request)
+        if key is None:
+            return super().post(request, *args, **kwargs)
+
+        redis = get_redis_connection("default")
+        deadline = time.time() + constants.IDEMPOTENCY_WAIT_TIME
+        while True:
+            # 抢到处理权的请求执行业务逻辑
+            if redis.set(key, "", nx=True, ex=constants.IDEMPOTENCY_TIME):
+                return self.idempotent_post(redis, key, request, *args, **kwargs)
+
+            value = redis.get(key)
+            if value:
+                data = json.loads(value)
+                return Response(data["data"], status=data["status"])
+
+            # 第一次请求还在处理中[value为空字符串]，或者刚刚处理失败[key已经被删除]
+            if time.time() > deadline:
+                return Response({"errmsg": "请求正在处理中，请稍后再试！"}, status=status.HTTP_409_CONFLICT)
+            time.sleep(0.1)
+
+    def idempotent_post(self, redis, key, request, *args, **kwargs):
+        try:
+            response = super().post(request, *args, **kwargs)
+        except Exception:
+            redis.delete(key)
+            raise
+
+        if status.is_success(response.status_code):
+            data = {"status": response.status_code, "data": json.loads(JSONRenderer().render(response.data))}
+            redis.set(key, json.dumps(data), ex=constants.IDEMPOTENCY_TIME)
+        else:
+            redis.delete(key)
+        return response